@@ -0,0 +1,229 @@
+#!/usr/bin/python3
+"""!
+@file AsyncEchonetLite.py
+@brief asyncio版のECHONET Lite通信クラス
+@author SUGIMURA Hiroshi, Kanagawa Institute of Technology
+@date 2023年度
+@details 受信をasyncioのDatagramProtocolで行い、要求への応答をawaitできるようにする。
+オブジェクトの管理と返答処理はEchonetLiteをそのまま使う
+"""
+import asyncio
+import inspect
+import threading
+import concurrent.futures
+
+if __name__ == '__main__' and not __package__:  # unit test
+    from EchonetLite import EchonetLite
+    from PDCEDT import PDCEDT
+    from ELFrame import ELFrame
+else:
+    from EchonetLite.EchonetLite import EchonetLite
+    from EchonetLite.PDCEDT import PDCEDT
+    from EchonetLite.ELFrame import ELFrame
+
+
+class ELDatagramProtocol(asyncio.DatagramProtocol):
+    """!
+    @brief 受信ソケットのasyncioプロトコル
+    """
+
+    def __init__(self, el:'AsyncEchonetLite'):
+        """!
+        @brief コンストラクタ
+        @param el AsyncEchonetLite
+        """
+        self.el = el
+
+    def datagram_received(self, data:bytes, addr:tuple):
+        """!
+        @brief 受信
+        @param data bytes
+        @param addr tuple (ip, port)
+        """
+        self.el.receive(addr[0], data)
+
+    def error_received(self, exc:Exception):
+        """!
+        @brief 受信ソケットのエラー
+        @param exc Exception
+        """
+        with self.el.statsLock:
+            self.el.stats['recvErrors'] += 1
+
+
+class AsyncEchonetLite(EchonetLite):
+    """!
+    @brief asyncio版ECHONET Lite通信クラス
+    @details ユーザのコールバックはコルーチン関数でもよい。
+    SET系要求のコールバックは返り値で返答が変わるので、コルーチンなら専用スレッドで返答処理を行い、その中で完了を待つ。
+    それ以外はタスクとして投げるだけで、返答を待たない
+    @note 送信はEchonetLiteの送信ソケットをそのまま使う。UDPなので実質ブロックしない。
+    request, get, setはEchonetLiteと同じくFutureを返す。awaitするならarequest, aget, asetを使う。
+    応答待ちのタイマはEchonetLiteと同じ受信ループ(eventLoop)で回すので、ELCoalescerなどもそのまま使える。
+    終わる時はstop()でなくaclose()を待つ
+    """
+    SET_REQUESTS = (EchonetLite.SETI, EchonetLite.SETC, EchonetLite.SETGET) # コールバックの結果で返答が変わるESV
+
+    def __init__(self, eojs = None, options:dict = None):
+        """!
+        @brief コンストラクタ
+        @param eojs eoj[3]の配列、指定がなければコントローラとする
+        @param options EchonetLiteと同じ
+        """
+        super().__init__(eojs, options)
+        self.loop:asyncio.AbstractEventLoop|None = None
+        self.loopThread:int = 0
+        self.transport:asyncio.DatagramTransport|None = None
+        self.executor:concurrent.futures.ThreadPoolExecutor|None = None # SET系の返答処理用、順序を保つため1スレッド
+        self.tasks:set[asyncio.Task] = set() # 投げたコールバックのタスク、終わるまで参照を持つ
+        self.stats['recvErrors'] = 0 # 受信ソケットのエラー
+
+    async def start(self, sfunc = None, gfunc = None, ifunc = None):
+        """!
+        @brief 受信開始、begin()のasyncio版
+        @param sfunc Setの時に呼ばれる関数、コルーチン関数でもよい。省略すればそのまま
+        @param gfunc Getの時に呼ばれる関数、コルーチン関数でもよい。省略すればそのまま
+        @param ifunc 通知関係を受信した時に呼ばれる関数、コルーチン関数でもよい。省略すればそのまま
+        """
+        self.checkCallbacks(sfunc, gfunc, ifunc)
+        if sfunc != None:
+            self.userSetFunc = sfunc
+        if gfunc != None:
+            self.userGetFunc = gfunc
+        if ifunc != None:
+            self.userInfFunc = ifunc
+        self.loop = asyncio.get_running_loop()
+        self.loopThread = threading.get_ident()
+        # 受信設定、stop()の後に再開する場合はbind済み
+        if self.rsock.getsockname()[1] == 0:
+            self.rsock.bind(('', self.ECHONETport))
+        await self.loop.run_in_executor(None, self.eventLoop.join) # stop()した前のタイマのスレッドが後始末を終えるのを待つ
+        self.thread = self.eventLoop.start('AsyncEchonetLite') # 受信はしない、タイマとcallSoon用
+        # transportは閉じる時にソケットも閉じるので、複製を渡してrsockは再開用に残す
+        self.transport, _ = await self.loop.create_datagram_endpoint(lambda: ELDatagramProtocol(self), sock=self.rsock.dup())
+        self.announce()
+
+    def stop(self):
+        """!
+        @brief 受信停止、すぐに戻る。EchonetLite.stop()と同じく同期で呼べる。start()で再開できる
+        @note 返答処理とコールバックのタスクの終了は待たない。待つならaclose()
+        """
+        if self.transport != None:
+            self.transport.close()
+            self.transport = None
+        self.eventLoop.stop()
+
+    async def aclose(self):
+        """!
+        @brief 受信を止め、返答処理とコールバックのタスクが終わるのを待つ
+        """
+        self.stop()
+        await self.loop.run_in_executor(None, self.eventLoop.join)
+        if self.executor != None:
+            await self.loop.run_in_executor(None, self.executor.shutdown)
+            self.executor = None
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    def receive(self, ip:str, data:bytes):
+        """!
+        @brief 受信データを返答処理に回す内部関数
+        @param ip str
+        @param data bytes
+        @note SET系要求かつSETのコールバックがコルーチン関数の時だけ専用スレッドに回し、それ以外はイベントループ上で処理する
+        """
+        if len(data) > EchonetLite.ESV and data[EchonetLite.ESV] in AsyncEchonetLite.SET_REQUESTS and inspect.iscoroutinefunction(self.userSetFunc):
+            if self.executor == None:
+                self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+            self.loop.run_in_executor(self.executor, self.returner, ip, data)
+        else:
+            self.returner(ip, data)
+
+    def callUser(self, func, frame:ELFrame, epc:int, pdcedt:PDCEDT):
+        """!
+        @brief ユーザのコールバックを呼ぶ内部関数、コルーチンにも対応する
+        @param func ユーザ関数
+        @param frame ELFrame
+        @param epc int
+        @param pdcedt PDCEDT
+        @return ユーザ関数の戻り値、イベントループ上でコルーチンを投げた場合はTrue
+        """
+        res = super().callUser(func, frame, epc, pdcedt)
+        if not inspect.isawaitable(res):
+            return res
+        if threading.get_ident() != self.loopThread: # 専用スレッドからは完了を待つ
+            return asyncio.run_coroutine_threadsafe(res, self.loop).result()
+        task = asyncio.ensure_future(res)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return True
+
+    async def arequest(self, ip:str, seoj:int|list[int]|str, deoj:int|list[int]|str, esv:int|str, props, timeout:float = 3.0, retries:int = 2, scheduler = None, priority:int = 1) -> ELFrame:
+        """!
+        @brief request()をawaitできるようにしたもの
+        @param ip str  IPアドレス、MULTICAST_GROUPなら最初の応答を返す
+        @param seoj (int | list[int] | str)
+        @param deoj (int | list[int] | str)
+        @param esv (int | str)
+        @param props iterable[tuple[int, bytes]]  (epc, edt)の並び、EDTなしならb''
+        @param timeout float = 3.0 1回の応答を待つ秒数
+        @param retries int = 2 応答がない時に送り直す回数、同じTIDで送る
+        @param scheduler ELSendScheduler|None = None
+        @param priority int = 1
+        @return ELFrame 応答
+        @exception TimeoutError 応答がない
+        """
+        return await asyncio.wrap_future(self.request(ip, seoj, deoj, esv, props, timeout, retries, scheduler, priority))
+
+    async def aget(self, ip:str, deoj:int|list[int]|str, epcs:list[int], seoj:int|list[int]|str = EchonetLite.EOJ_Controller, timeout:float = 3.0, retries:int = 2, scheduler = None, priority:int = 1) -> dict[int, PDCEDT]:
+        """!
+        @brief get()をawaitできるようにしたもの
+        @param ip str
+        @param deoj (int | list[int] | str)
+        @param epcs list[int]
+        @param seoj (int | list[int] | str) = EOJ_Controller
+        @param timeout float = 3.0
+        @param retries int = 2
+        @param scheduler ELSendScheduler|None = None
+        @param priority int = 1
+        @return dict[int, PDCEDT]  GET_SNAで取れなかったプロパティはPDC=0
+        @exception TimeoutError 応答がない
+        """
+        return await asyncio.wrap_future(self.get(ip, deoj, epcs, seoj, timeout, retries, scheduler, priority))
+
+    async def aset(self, ip:str, deoj:int|list[int]|str, props:dict, seoj:int|list[int]|str = EchonetLite.EOJ_Controller, timeout:float = 3.0, retries:int = 2, scheduler = None, priority:int = 1) -> bool:
+        """!
+        @brief set()をawaitできるようにしたもの
+        @param ip str
+        @param deoj (int | list[int] | str)
+        @param props dict[int, (list[int] | bytes)]  EPC -> EDT
+        @param seoj (int | list[int] | str) = EOJ_Controller
+        @param timeout float = 3.0
+        @param retries int = 2
+        @param scheduler ELSendScheduler|None = None
+        @param priority int = 1
+        @return bool  SET_RESならTrue、SETC_SNAならFalse
+        @exception TimeoutError 応答がない
+        """
+        return await asyncio.wrap_future(self.set(ip, deoj, props, seoj, timeout, retries, scheduler, priority))
+
+if __name__ == '__main__':
+    print("===== AsyncEchonetLite.py 単体テスト")
+    async def userSetFunc(ip, tid, seoj, deoj, esv, opc, epc, pdcedt):
+        await asyncio.sleep(0.01)
+        return epc == 0x80
+    async def main():
+        el = AsyncEchonetLite([[0x02, 0x90, 0x01]])
+        await el.start(userSetFunc)
+        res = await el.aget(el.LOCAL_ADDR, [0x02, 0x90, 0x01], [0x80, 0x8a])
+        print({hex(epc): res[epc].getString() for epc in res})
+        print(await el.aset(el.LOCAL_ADDR, [0x02, 0x90, 0x01], {0x80: [0x31]}))
+        print(await el.aset(el.LOCAL_ADDR, [0x02, 0x90, 0x01], {0x81: [0x01]}))
+        print(type(el.get(el.LOCAL_ADDR, [0x02, 0x90, 0x01], [0x80]))) # 同期版はFutureのまま
+        await el.aclose()
+        await el.start(userSetFunc) # 再開
+        res = await el.aget(el.LOCAL_ADDR, [0x02, 0x90, 0x01], [0x80])
+        print({hex(epc): res[epc].getString() for epc in res})
+        await el.aclose()
+        print(el.stats)
+    asyncio.run(main())
@@ -0,0 +1,206 @@
+#!/usr/bin/python3
+"""!
+@file ELCoalescer.py
+@brief 送信要求をまとめて複数OPCのフレームにする
+@author SUGIMURA Hiroshi, Kanagawa Institute of Technology
+@date 2023年度
+@details 同じ(宛先IP, SEOJ, DEOJ, ESV)への要求を短い時間だけ溜め、MTUに収まる範囲で一つのフレームにして送る。
+応答が来たら、要求ごとに自分が要求したプロパティだけを返す
+"""
+import threading
+import concurrent.futures
+
+if __name__ == '__main__' and not __package__:  # unit test
+    from EchonetLite import EchonetLite
+    from PDCEDT import PDCEDT
+    from ELFrame import ELFrame
+    from ELDecoder import HEADER_SIZE
+    from ELEncoder import toInt
+else:
+    from EchonetLite.EchonetLite import EchonetLite
+    from EchonetLite.PDCEDT import PDCEDT
+    from EchonetLite.ELFrame import ELFrame
+    from EchonetLite.ELDecoder import HEADER_SIZE
+    from EchonetLite.ELEncoder import toInt
+
+
+class ELCoalescer():
+    """!
+    @brief ELCoalescerクラス
+    @details 要求はFutureで受け取る。結果はdict[int, PDCEDT]で、要求したEPCだけが入る。
+    GET_SNAで取れなかったプロパティはPDC=0、SETC_SNAで受け付けられなかったプロパティは要求の値が返る
+    @note 溜める時間と応答待ちにEchonetLiteの受信ループを使うので、begin()してから使う。ユニキャストのみ
+    """
+    MAX_PAYLOAD = 1472 # UDPの最大ペイロード、MTU 1500からIPとUDPのヘッダを引いたもの
+    MAX_OPC = 255
+
+    def __init__(self, el:EchonetLite, window:float = 0.01, timeout:float = 3.0, scheduler = None, priority:int = 1):
+        """!
+        @brief コンストラクタ
+        @param el EchonetLite
+        @param window float = 0.01 要求を溜める秒数
+        @param timeout float = 3.0 応答を待つ秒数
+        @param scheduler ELSendScheduler|None = None 指定すればこれを通して送る。応答待ちの時間は実際に送った時から数える
+        @param priority int = 1  schedulerに渡す優先度、ELSendScheduler.NORMAL
+        """
+        self.el = el
+        self.window = window
+        self.timeout = timeout
+        self.scheduler = scheduler
+        self.priority = priority
+        self.batches:dict[tuple[str, int, int, int], list] = {} # (ip, seoj, deoj, esv) -> [(future, props)]
+        self.lock = threading.Lock()
+        self.stats:dict[str, int] = {'requests': 0, 'frames': 0, 'timeouts': 0}
+
+    def request(self, ip:str, seoj:int|list[int]|str, deoj:int|list[int]|str, esv:int|str, props) -> concurrent.futures.Future:
+        """!
+        @brief 要求を溜める
+        @param ip str  ユニキャストのIPアドレス
+        @param seoj (int | list[int] | str)
+        @param deoj (int | list[int] | str)
+        @param esv (int | str)  GET, SETC, INF_REQなど応答のあるもの
+        @param props iterable[tuple[int, bytes]]  (epc, edt)の並び、EDTなしならb''
+        @return concurrent.futures.Future  結果はdict[int, PDCEDT]、応答がなければTimeoutError
+        @exception ValueError  マルチキャスト、または1つの要求が1フレームに収まらない(EPCがMAX_OPCを超える、MAX_PAYLOADを超える)
+        """
+        if ip == EchonetLite.MULTICAST_GROUP:
+            raise ValueError('ELCoalescer: multicast is not supported')
+        props = [(epc, bytes(edt)) for epc, edt in props]
+        size = HEADER_SIZE + sum(2 + len(edt) for _, edt in props)
+        if len(props) > ELCoalescer.MAX_OPC or size > ELCoalescer.MAX_PAYLOAD: # 分けて送ると1つの応答にならない
+            raise ValueError('ELCoalescer: a request must fit in one frame, got %d properties in %d bytes' % (len(props), size))
+        key = (ip, toInt(seoj), toInt(deoj), toInt(esv))
+        future = concurrent.futures.Future()
+        with self.lock:
+            self.stats['requests'] += 1
+            batch = self.batches.get(key)
+            if batch == None:
+                batch = self.batches[key] = []
+                self.el.eventLoop.callLater(self.window, self.flush, key)
+            batch.append( (future, props) )
+        return future
+
+    def get(self, ip:str, deoj:int|list[int]|str, epcs:list[int], seoj:int|list[int]|str = EchonetLite.EOJ_Controller) -> concurrent.futures.Future:
+        """!
+        @brief GETを溜める
+        @param ip str
+        @param deoj (int | list[int] | str)
+        @param epcs list[int]
+        @param seoj (int | list[int] | str) = EOJ_Controller
+        @return concurrent.futures.Future  結果はdict[int, PDCEDT]
+        """
+        return self.request(ip, seoj, deoj, EchonetLite.GET, [(epc, b'') for epc in epcs])
+
+    def set(self, ip:str, deoj:int|list[int]|str, props:dict, seoj:int|list[int]|str = EchonetLite.EOJ_Controller) -> concurrent.futures.Future:
+        """!
+        @brief SETCを溜める
+        @param ip str
+        @param deoj (int | list[int] | str)
+        @param props dict[int, (list[int] | bytes)]  EPC -> EDT
+        @param seoj (int | list[int] | str) = EOJ_Controller
+        @return concurrent.futures.Future  結果はdict[int, PDCEDT]、成功したプロパティはPDC=0
+        """
+        return self.request(ip, seoj, deoj, EchonetLite.SETC, props.items())
+
+    def flush(self, key:tuple[str, int, int, int]):
+        """!
+        @brief 溜めた要求をフレームに詰めて送る内部関数
+        @param key tuple (ip, seoj, deoj, esv)
+        @note GETは同じEPCを一つにまとめる。SETは同じEPCがあれば次のフレームに回す。
+        要求1つは必ず1フレームに収まる(request()で確かめている)ので、入らなければ新しいフレームに移すだけでよい
+        """
+        with self.lock:
+            batch = self.batches.pop(key, [])
+        esv = key[3]
+        frames = [] # [(dict[epc, edt], [(future, epcs)])]
+        props = {}
+        callers = []
+        size = HEADER_SIZE
+        for future, req in batch:
+            if not future.set_running_or_notify_cancel(): # 取り消された
+                continue
+            add = [(epc, edt) for epc, edt in req if not (esv == EchonetLite.GET and epc in props)]
+            need = sum(2 + len(edt) for _, edt in add)
+            conflict = esv != EchonetLite.GET and any(epc in props for epc, _ in add)
+            if callers and (conflict or size + need > ELCoalescer.MAX_PAYLOAD or len(props) + len(add) > ELCoalescer.MAX_OPC):
+                frames.append( (props, callers) )
+                props = {}
+                callers = []
+                size = HEADER_SIZE
+                add = req
+                need = sum(2 + len(edt) for _, edt in add)
+            for epc, edt in add:
+                props[epc] = edt
+            size += need
+            callers.append( (future, [epc for epc, _ in req]) )
+        if callers:
+            frames.append( (props, callers) )
+        for props, callers in frames:
+            self.send(key, props, callers)
+
+    def send(self, key:tuple[str, int, int, int], props:dict[int, bytes], callers:list):
+        """!
+        @brief 1フレーム送り、応答を待つ内部関数
+        @param key tuple (ip, seoj, deoj, esv)
+        @param props dict[int, bytes]
+        @param callers list[tuple[Future, list[int]]]
+        """
+        ip, seoj, deoj, esv = key
+        tid = self.el.nextTid()
+        timer = [None]
+        def hook(frame:ELFrame):
+            if frame.ip != ip:
+                return
+            if self.el.responseHooks.pop(tid, None) is not hook: # 時間切れと同時に来た
+                return
+            if timer[0] != None: # schedulerで送った直後に来た
+                timer[0].cancel()
+            details = frame.details['INF']
+            for future, epcs in callers:
+                if not future.done():
+                    future.set_result({epc: details.get(epc, PDCEDT([0])) for epc in epcs})
+        def expire():
+            if self.el.responseHooks.pop(tid, None) is not hook:
+                return
+            with self.lock:
+                self.stats['timeouts'] += 1
+            for future, _ in callers:
+                if not future.done():
+                    future.set_exception(TimeoutError('ELCoalescer: no response from ' + ip))
+        def sent(error:OSError|None):
+            if error == None:
+                with self.lock:
+                    self.stats['frames'] += 1
+                if self.el.responseHooks.get(tid) is hook:
+                    timer[0] = self.el.eventLoop.callLater(self.timeout, expire)
+            elif self.el.responseHooks.pop(tid, None) is hook:
+                for future, _ in callers:
+                    if not future.done():
+                        future.set_exception(error)
+        self.el.responseHooks[tid] = hook
+        if self.scheduler != None: # 応答待ちの時間は実際に送った時から数える
+            self.scheduler.sendFrame(ip, tid, seoj, deoj, esv, props.items(), self.priority, sent)
+            return
+        try:
+            self.el.sendFrame(ip, tid, seoj, deoj, esv, props.items())
+        except OSError as e:
+            sent(e)
+            return
+        sent(None)
+
+if __name__ == '__main__':
+    print("===== ELCoalescer.py 単体テスト")
+    el = EchonetLite([[0x02, 0x90, 0x01]])
+    el.begin(None)
+    co = ELCoalescer(el)
+    futures = [co.get(el.LOCAL_ADDR, [0x02, 0x90, 0x01], [epc]) for epc in (0x80, 0x81, 0x82, 0x88, 0x8a, 0x80)]
+    futures.append(co.get(el.LOCAL_ADDR, [0x02, 0x90, 0x01], [0x83, 0x99]))
+    for f in futures:
+        print({hex(epc): pdcedt.getString() for epc, pdcedt in f.result(3).items()})
+    print(co.set(el.LOCAL_ADDR, [0x02, 0x90, 0x01], {0x80: [0x31], 0x81: [0x01]}).result(3))
+    try: # 1フレームに収まらない要求
+        co.get(el.LOCAL_ADDR, [0x02, 0x90, 0x01], list(range(0, 256)))
+    except ValueError as e:
+        print(e)
+    print(co.stats, el.stats)
+    el.stop()
@@ -0,0 +1,64 @@
+#!/usr/bin/python3
+"""!
+@file ELDecoder.py
+@brief ECHONET Liteフレームの受信バッファをそのまま解釈するデコーダ
+@author SUGIMURA Hiroshi, Kanagawa Institute of Technology
+@date 2023年度
+@details 受信データをlistに変換せず、bytes/memoryviewをオフセットで読む。
+ヘッダ12byteは struct.unpack_from 一回で取り出し、EPC,PDC,EDT部分は位置だけを返す
+"""
+import struct
+
+HEADER = struct.Struct('>HHHBHBBB') # EHD, TID, SEOJ[0:2], SEOJ[2], DEOJ[0:2], DEOJ[2], ESV, OPC
+HEADER_SIZE = 12 # EHD1からOPCまで
+EHD = 0x1081 # EHD1=0x10, EHD2=0x81
+
+
+def decodeHeader(buf) -> tuple[int, int, int, int, int] | None:
+    """!
+    @brief ヘッダ部分を解釈する
+    @param buf (bytes | bytearray | memoryview)
+    @return tuple[int, int, int, int, int] | None  (tid, seoj, deoj, esv, opc)、EOJは24bit、TIDは16bitのint。異常ならNone
+    """
+    if len(buf) <= HEADER_SIZE: # EPCが最低1byte必要
+        return None
+    ehd, tid, seoj_h, seoj_l, deoj_h, deoj_l, esv, opc = HEADER.unpack_from(buf, 0)
+    if ehd != EHD:
+        return None
+    return tid, (seoj_h << 8) | seoj_l, (deoj_h << 8) | deoj_l, esv, opc
+
+
+def scanProperties(buf, offset:int, opc:int) -> tuple[list[tuple[int, int, int]], int] | None:
+    """!
+    @brief offsetからopc個のEPC,PDC,EDTを辿る
+    @param buf (bytes | bytearray | memoryview)
+    @param offset int 最初のEPCの位置
+    @param opc int
+    @return tuple[list[tuple[int, int, int]], int] | None  ([(epc, PDCの位置, EDTの終端)], 次の位置)、サイズを超えたらNone
+    @note buf[PDCの位置:EDTの終端] がPDC+EDTとなる
+    """
+    size = len(buf)
+    props = []
+    for _ in range(0, opc):
+        pos = offset + 1 # PDCの位置
+        if pos >= size:
+            return None
+        offset = pos + 1 + buf[pos]
+        if offset > size:
+            return None
+        props.append( (buf[pos - 1], pos, offset) )
+    return props, offset
+
+
+if __name__ == '__main__':
+    print("===== ELDecoder.py 単体テスト")
+    data = bytes([0x10, 0x81, 0x00, 0x01, 0x05, 0xff, 0x01, 0x0e, 0xf0, 0x01, 0x62, 0x02, 0x80, 0x00, 0xd6, 0x01, 0x30])
+    head = decodeHeader(data)
+    print(head)
+    print(head == (0x0001, 0x05ff01, 0x0ef001, 0x62, 0x02))
+    view = memoryview(data)
+    props, end = scanProperties(view, HEADER_SIZE, head[4])
+    print(props, end)
+    print([bytes(view[s:e]) for _, s, e in props])
+    print(scanProperties(view, HEADER_SIZE, 3)) # 不足ならNone
+    print(decodeHeader(bytes([0x10, 0x82]) + data[2:])) # EHD異常ならNone
@@ -0,0 +1,260 @@
+#!/usr/bin/python3
+"""!
+@file ELDiscovery.py
+@brief 機器の発見を段階ごとに進める
+@author SUGIMURA Hiroshi, Kanagawa Institute of Technology
+@date 2023年度
+@details ノードの探索(D6のマルチキャスト)、インスタンスリスト(D5, D6)、プロパティマップ(9D, 9E, 9F)、
+プロパティの初期値(GETプロパティマップのすべて)の順に進める。
+調べている途中か調べ終わった(ip, EOJ)は、D5, D6の通知が繰り返し来ても同じ処理を走らせない。
+応答がなかった(ip, EOJ)は、次にD5, D6で名前が挙がった時に最初から調べ直す
+"""
+import threading
+import collections
+
+if __name__ == '__main__' and not __package__:  # unit test
+    from EchonetLite import EchonetLite
+    from PDCEDT import PDCEDT
+    from ELFrame import ELFrame
+    from ELSendScheduler import fixedInterval
+    import ELPropertyMap
+else:
+    from EchonetLite.EchonetLite import EchonetLite
+    from EchonetLite.PDCEDT import PDCEDT
+    from EchonetLite.ELFrame import ELFrame
+    from EchonetLite.ELSendScheduler import fixedInterval
+    from EchonetLite import ELPropertyMap
+
+
+class ELDeviceInfo():
+    """!
+    @brief 発見した機器オブジェクト1つ分
+    """
+    __slots__ = ('ip', 'eoj', 'infMap', 'setMap', 'getMap', 'props', 'pending', 'state')
+
+    def __init__(self, ip:str, eoj:int):
+        """!
+        @brief コンストラクタ
+        @param ip str
+        @param eoj int 24bit
+        """
+        self.ip = ip
+        self.eoj = eoj
+        self.infMap:int = 0 # プロパティマップ、ELPropertyMapのbitset
+        self.setMap:int = 0
+        self.getMap:int = 0
+        self.props:dict[int, PDCEDT] = {} # 初期値、取れなかったものは入らない
+        self.pending:int = 0   # 応答待ちのGETの数
+        self.state:str = 'maps' # 'maps', 'props', 'done', 'timeout'
+
+    def __repr__(self) -> str:
+        return 'ELDeviceInfo(%s, %06x, %s, props=%d)' % (self.ip, self.eoj, self.state, len(self.props))
+
+
+class ELDiscovery():
+    """!
+    @brief ELDiscoveryクラス
+    @details 段階ごとに実行待ちの列と同時実行数の上限を持つ。要求はEchonetLite.get()でELSendSchedulerを通して送り、送信の間隔はそちらに任せる
+    @note 応答と通知はEchonetLite.addListener()で受け取り、送信の予約に受信ループを使うので、begin()してから使う
+    """
+    MAPS = (0x9d, 0x9e, 0x9f)
+    STAGES = ('maps', 'props')
+
+    def __init__(self, el:EchonetLite, concurrency:int = 8, interval:float = 0.005, timeout:float = 3.0, retries:int = 1, window:float = 3.0, chunk:int = 16, onDevice = None, scheduler = None, priority:int = 2):
+        """!
+        @brief コンストラクタ
+        @param el EchonetLite
+        @param concurrency int = 8 段階ごとに同時に応答を待つ数
+        @param interval float = 0.005 schedulerを指定しない時の送信の間隔、秒。段階をまたいで共有する
+        @param timeout float = 3.0 1回の応答を待つ秒数
+        @param retries int = 1 応答がない時に送り直す回数
+        @param window float = 3.0 ノードの探索で応答を待つ秒数、この間は完了にしない
+        @param chunk int = 16 初期値の取得で1フレームに入れるEPCの数
+        @param onDevice func(info:ELDeviceInfo) = None  機器オブジェクト1つの初期値まで取れたら呼ぶ
+        @param scheduler ELSendScheduler|None = None 指定すればこれを通して送る、Noneならintervalの間隔で送る専用のものを作る
+        @param priority int = 2  schedulerに渡す優先度、ELSendScheduler.LOW
+        """
+        self.el = el
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.window = window
+        self.chunk = chunk
+        self.onDevice = onDevice
+        self.scheduler = scheduler if scheduler != None else fixedInterval(el, interval)
+        self.priority = priority
+        self.nodes:dict[str, tuple[int, ...]] = {} # ip -> EOJ(24bit)のtuple、ノードプロファイルを含む
+        self.devices:dict[tuple[str, int], ELDeviceInfo] = {} # (ip, EOJ) -> ELDeviceInfo
+        self.queues:dict[str, collections.deque] = {stage: collections.deque() for stage in ELDiscovery.STAGES}
+        self.inflight:dict[str, int] = {stage: 0 for stage in ELDiscovery.STAGES}
+        self.searching = False # ノードの探索中
+        self.lock = threading.Lock()
+        self.complete = threading.Event()
+        self.stats:dict[str, int] = {'announces': 0, 'duplicates': 0, 'retries': 0, 'requests': 0, 'timeouts': 0}
+
+    def start(self):
+        """!
+        @brief 発見を始める。応答と通知の受け取りを始め、ノードの探索を送る
+        @note stop()するまで、後から来たD5, D6の通知でも新しい機器を調べる
+        """
+        with self.lock:
+            self.searching = True
+            self.complete.clear()
+        self.el.addListener(self.receive)
+        self.el.sendFrame(EchonetLite.MULTICAST_GROUP, self.el.nextTid(), 0x0ef001, 0x0ef001, EchonetLite.GET, [(0xd6, b'')])
+        self.el.eventLoop.callLater(self.window, self.endSearch)
+
+    def stop(self):
+        """!
+        @brief 応答と通知の受け取りをやめる。応答待ちのものはそのまま終わらせる
+        """
+        self.el.removeListener(self.receive)
+
+    def wait(self, timeout:float|None = None) -> bool:
+        """!
+        @brief 発見が終わるのを待つ
+        @param timeout float|None = None
+        @return bool  終わったらTrue
+        """
+        return self.complete.wait(timeout)
+
+    def endSearch(self):
+        """!
+        @brief ノードの探索の時間が過ぎた時の内部関数
+        """
+        with self.lock:
+            self.searching = False
+        self.check()
+
+    def receive(self, frame:ELFrame):
+        """!
+        @brief 応答と通知からインスタンスリストを拾う内部関数
+        @param frame ELFrame
+        """
+        if (frame.seoj >> 8) != 0x0ef0:
+            return
+        details = frame.details['GET' if frame.esv == EchonetLite.INFC else 'INF'] # INFCは要求なのでGETの部分に入っている
+        for epc in (0xd5, 0xd6):
+            pdcedt = details.get(epc)
+            if pdcedt != None and pdcedt.pdc > 0:
+                edt = pdcedt.edtBytes
+                self.addNode(frame.ip, [int.from_bytes(edt[i:i + 3], 'big') for i in range(1, min(len(edt) - 2, 1 + edt[0] * 3), 3)])
+
+    def addNode(self, ip:str, eojs:list[int]):
+        """!
+        @brief ノードを登録し、新しい機器オブジェクトと応答のなかった機器オブジェクトをプロパティマップの取得に回す
+        @param ip str
+        @param eojs list[int]  EOJ(24bit)、インスタンスリストの中身
+        @note 応答のなかったものも、初期値の取得がまだ応答待ちなら、終わるまで調べ直さない
+        """
+        with self.lock:
+            self.stats['announces'] += 1
+            queued = 0
+            for eoj in [0x0ef001] + eojs:
+                info = self.devices.get( (ip, eoj) )
+                if info == None:
+                    self.nodes[ip] = self.nodes.get(ip, ()) + (eoj,)
+                elif info.state == 'timeout' and info.pending == 0: # 再起動したノードなど
+                    self.stats['retries'] += 1
+                else: # 調べている途中か、調べ終わった
+                    continue
+                self.devices[(ip, eoj)] = ELDeviceInfo(ip, eoj)
+                self.queues['maps'].append( (ip, eoj, ELDiscovery.MAPS) )
+                queued += 1
+            if queued == 0:
+                self.stats['duplicates'] += 1
+                return
+            self.complete.clear()
+        self.pump('maps')
+
+    def pump(self, stage:str):
+        """!
+        @brief 上限まで実行待ちを送信に回す内部関数
+        @param stage str
+        """
+        items = []
+        with self.lock:
+            queue = self.queues[stage]
+            while queue and self.inflight[stage] < self.concurrency:
+                items.append(queue.popleft())
+                self.inflight[stage] += 1
+        for item in items:
+            self.run(stage, item)
+
+    def run(self, stage:str, item:tuple):
+        """!
+        @brief GETを送る内部関数
+        @param stage str
+        @param item tuple (ip, eoj, epcs)
+        """
+        ip, eoj, epcs = item
+        with self.lock:
+            self.stats['requests'] += 1
+        future = self.el.get(ip, eoj, list(epcs), timeout=self.timeout, retries=self.retries, scheduler=self.scheduler, priority=self.priority)
+        future.add_done_callback(lambda f: self.finish(stage, item, f))
+
+    def finish(self, stage:str, item:tuple, future):
+        """!
+        @brief 応答を受けて次の段階に回す内部関数
+        @param stage str
+        @param item tuple (ip, eoj, epcs)
+        @param future concurrent.futures.Future
+        """
+        ip, eoj, epcs = item
+        error = future.exception()
+        found = None
+        with self.lock:
+            self.inflight[stage] -= 1
+            info = self.devices[(ip, eoj)]
+            if error != None:
+                self.stats['timeouts'] += isinstance(error, TimeoutError)
+                info.state = 'timeout'
+                if stage == 'props':
+                    info.pending -= 1
+            elif stage == 'maps':
+                details = future.result()
+                maps = [ELPropertyMap.decode(details[epc].edtBytes) if epc in details else 0 for epc in ELDiscovery.MAPS]
+                info.infMap, info.setMap, info.getMap = maps
+                targets = [epc for epc in ELPropertyMap.toList(info.getMap) if epc not in ELDiscovery.MAPS]
+                for i in range(0, len(targets), self.chunk):
+                    self.queues['props'].append( (ip, eoj, tuple(targets[i:i + self.chunk])) )
+                    info.pending += 1
+                info.state = 'props'
+            else:
+                info.props.update({epc: pdcedt for epc, pdcedt in future.result().items() if pdcedt.pdc > 0})
+                info.pending -= 1
+            if info.state == 'props' and info.pending == 0:
+                info.state = 'done'
+                found = info
+        if found != None and self.onDevice != None:
+            self.onDevice(found)
+        self.pump(stage)
+        if stage == 'maps':
+            self.pump('props')
+        self.check()
+
+    def check(self):
+        """!
+        @brief 探索の時間が過ぎ、実行待ちも応答待ちもなければ完了にする内部関数
+        """
+        with self.lock:
+            if self.searching or any(self.queues.values()) or any(self.inflight.values()):
+                return
+        self.complete.set()
+
+
+if __name__ == '__main__':
+    print("===== ELDiscovery.py 単体テスト")
+    el = EchonetLite([[0x02, 0x90, 0x01], [0x02, 0x90, 0x02]])
+    el.begin(None)
+    d = ELDiscovery(el, timeout=0.3, retries=0, window=0.5, onDevice=print)
+    d.start()
+    print(d.wait(5), d.nodes)
+    el.announce() # 同じインスタンスリストなので何もしない
+    print(d.wait(5), d.stats)
+    d.addNode('192.0.2.250', [0x029001]) # 応答がない
+    print(d.wait(5), d.devices[('192.0.2.250', 0x029001)])
+    d.addNode('192.0.2.250', [0x029001]) # 通知し直したので調べ直す
+    print(d.wait(5), d.stats)
+    d.stop()
+    el.stop()
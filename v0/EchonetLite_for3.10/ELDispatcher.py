@@ -0,0 +1,134 @@
+#!/usr/bin/python3
+"""!
+@file ELDispatcher.py
+@brief ユーザのコールバックを受信スレッドから切り離して実行する
+@author SUGIMURA Hiroshi, Kanagawa Institute of Technology
+@date 2023年度
+@details スレッドプールかプロセスプールで実行する。同じkeyの処理は投入順に一つずつ実行し、keyが違えば並列に実行する
+"""
+import pickle
+import threading
+import traceback
+import collections
+import concurrent.futures
+
+
+class ELDispatcher():
+    """!
+    @brief ELDispatcherクラス
+    @details keyごとに実行待ちの列を持ち、実行中の処理が終わってから次を投入する
+    @note プロセスプールでは関数と引数をpickleして渡すので、関数はモジュールの関数であること。
+    また別プロセスなので、EchonetLiteのオブジェクトは更新できない
+    """
+
+    def __init__(self, workers:int = 4, process:bool = False):
+        """!
+        @brief コンストラクタ
+        @param workers int = 4 並列数
+        @param process bool = False Trueならプロセスプール
+        """
+        self.process = process
+        if process:
+            self.executor = concurrent.futures.ProcessPoolExecutor(workers)
+        else:
+            self.executor = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix='ELDispatcher')
+        self.chains:dict[object, collections.deque] = {} # key -> 実行待ち、実行中のkeyだけ持つ
+        self.lock = threading.Condition()
+        self.stats:dict[str, int] = {'submitted': 0, 'completed': 0, 'errors': 0}
+
+    def submit(self, key, func, *args):
+        """!
+        @brief func(*args)を投入する
+        @param key hashable 順序を守る単位、機器など
+        @param func 呼ぶ関数
+        """
+        with self.lock:
+            self.stats['submitted'] += 1
+            chain = self.chains.get(key)
+            if chain != None: # 同じkeyが実行中なら後ろに並ぶ
+                chain.append( (func, args) )
+                return
+            self.chains[key] = collections.deque()
+        self.run(key, func, args)
+
+    def check(self, func):
+        """!
+        @brief funcをこのプールに投入できるか調べる
+        @param func 呼ぶ関数
+        @exception TypeError プロセスプールなのにpickleできない(モジュールの関数でない)
+        """
+        if not self.process:
+            return
+        try:
+            pickle.dumps(func)
+        except Exception as e:
+            raise TypeError('ELDispatcher: a process pool needs a picklable module-level function, got %r (%s)' % (func, e)) from None
+
+    def run(self, key, func, args:tuple):
+        """!
+        @brief プールに投入する内部関数
+        @param key hashable
+        @param func 呼ぶ関数
+        @param args tuple
+        """
+        future = self.executor.submit(func, *args)
+        future.add_done_callback(lambda f: self.done(key, f))
+
+    def done(self, key, future:concurrent.futures.Future):
+        """!
+        @brief 一つ終わったら同じkeyの次を投入する内部関数
+        @param key hashable
+        @param future concurrent.futures.Future
+        """
+        error = future.exception()
+        if error != None:
+            traceback.print_exception(error)
+        with self.lock:
+            self.stats['completed'] += 1
+            if error != None:
+                self.stats['errors'] += 1
+            self.lock.notify_all()
+            chain = self.chains.get(key)
+            if chain == None: # shutdown済み
+                return
+            if len(chain) == 0:
+                del self.chains[key]
+                return
+            func, args = chain.popleft()
+        self.run(key, func, args)
+
+    def pending(self) -> int:
+        """!
+        @brief 投入したが終わっていない数
+        @return int
+        """
+        with self.lock:
+            return self.stats['submitted'] - self.stats['completed']
+
+    def shutdown(self, wait:bool = True):
+        """!
+        @brief プールを止める
+        @param wait bool = True 実行待ちの処理まで全部終わるのを待つか
+        @note waitがFalseなら、実行待ちの列に残っている処理は捨てる
+        """
+        with self.lock:
+            if wait:
+                self.lock.wait_for(lambda: self.stats['submitted'] == self.stats['completed'])
+            self.chains.clear()
+        self.executor.shutdown(wait)
+
+
+if __name__ == '__main__':
+    print("===== ELDispatcher.py 単体テスト")
+    import time
+    got = []
+    def work(key, n):
+        time.sleep(0.01 * (3 - n))
+        got.append((key, n))
+    d = ELDispatcher(4)
+    for n in range(0, 3):
+        d.submit('a', work, 'a', n)
+        d.submit('b', work, 'b', n)
+    time.sleep(0.2)
+    print([n for k, n in got if k == 'a'], [n for k, n in got if k == 'b'], d.pending(), d.stats)
+    d.shutdown()
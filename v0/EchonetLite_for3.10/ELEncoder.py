@@ -0,0 +1,162 @@
+#!/usr/bin/python3
+"""!
+@file ELEncoder.py
+@brief ECHONET Liteフレームを直接バイナリで組み立てるエンコーダ
+@author SUGIMURA Hiroshi, Kanagawa Institute of Technology
+@date 2023年度
+@details 16進数文字列を経由せず、使い回すbytearrayにEHD, TID, SEOJ, DEOJ, ESV, OPC, EPC, PDC, EDTを書き込む
+"""
+
+if __name__ == '__main__' and not __package__:  # unit test
+    from PDCEDT import PDCEDT
+    from ELDecoder import HEADER, HEADER_SIZE, EHD
+elif __name__ == 'ELEncoder':  # EchonetLite.py test
+    from PDCEDT import PDCEDT
+    from ELDecoder import HEADER, HEADER_SIZE, EHD
+else:
+    from EchonetLite.PDCEDT import PDCEDT
+    from EchonetLite.ELDecoder import HEADER, HEADER_SIZE, EHD
+
+
+def toInt(value:int|list[int]|str) -> int:
+    """!
+    @brief TID, EOJ, ESV, EPCなどをintに変換する
+    @param value (int | list[int] | str)  list[int]は上位byteから、strは16進数文字列
+    @return int
+    """
+    if type(value) is int:
+        return value
+    if type(value) is str:
+        return int(value, 16)
+    n = 0
+    for v in value:
+        n = (n << 8) | v
+    return n
+
+
+def toPDCEDT(value:PDCEDT|list[int]|str|bytes) -> bytes:
+    """!
+    @brief PDCEDTをPDC+EDTのbytesに変換する
+    @param value (PDCEDT | list[int] | str | bytes)  list[int], str, bytesはPDCを含む
+    @return bytes
+    """
+    if type(value) is PDCEDT:
+        return value.raw
+    if type(value) is str:
+        return bytes.fromhex(value)
+    return bytes(value)
+
+
+class ELEncoder():
+    """!
+    @brief ELEncoderクラス
+    @details 内部のbytearrayを使い回してフレームを組み立てる。スレッドセーフではないので、利用側で排他すること
+    """
+
+    def __init__(self, size:int = 1500):
+        """!
+        @brief コンストラクタ
+        @param size int = 1500 初期バッファサイズ、足りなければ伸ばす
+        """
+        self.buf = bytearray(size)
+        self.length:int = 0
+        self.opc:int = 0
+        self.opcPos:int = HEADER_SIZE - 1 # 書き込み中のOPCの位置
+
+    def begin(self, tid:int, seoj:int, deoj:int, esv:int):
+        """!
+        @brief ヘッダを書き込んでフレームの組み立てを開始する
+        @param tid int 16bit
+        @param seoj int 24bit
+        @param deoj int 24bit
+        @param esv int
+        """
+        HEADER.pack_into(self.buf, 0, EHD, tid, seoj >> 8, seoj & 0xff, deoj >> 8, deoj & 0xff, esv, 0)
+        self.length = HEADER_SIZE
+        self.opc = 0
+        self.opcPos = HEADER_SIZE - 1
+
+    def reserve(self, size:int) -> int:
+        """!
+        @brief 書き込み領域を確保する内部関数
+        @param size int
+        @return int 書き込み開始位置
+        """
+        pos = self.length
+        self.length += size
+        if self.length > len(self.buf):
+            self.buf.extend(bytes(self.length - len(self.buf)))
+        return pos
+
+    def add(self, epc:int, edt:bytes = b''):
+        """!
+        @brief EPCとEDTを追加する、PDCは自動計算
+        @param epc int
+        @param edt bytes = b''  GETなどEDTなしなら省略
+        """
+        pdc = len(edt)
+        pos = self.reserve(pdc + 2)
+        self.buf[pos] = epc
+        self.buf[pos + 1] = pdc
+        self.buf[pos + 2:self.length] = edt
+        self.opc += 1
+
+    def addPDCEDT(self, epc:int, pdcedt:bytes):
+        """!
+        @brief EPCとPDC+EDTを追加する
+        @param epc int
+        @param pdcedt bytes  PDCを含む
+        """
+        pos = self.reserve(len(pdcedt) + 1)
+        self.buf[pos] = epc
+        self.buf[pos + 1:self.length] = pdcedt
+        self.opc += 1
+
+    def nextSection(self):
+        """!
+        @brief OPCを書き込み、次のOPCから始まる部分に移る。SETGET系のOPCSet, OPCGet用
+        """
+        self.buf[self.opcPos] = self.opc
+        self.opcPos = self.reserve(1)
+        self.opc = 0
+
+    def end(self) -> memoryview:
+        """!
+        @brief OPCを書き込んでフレームを完成させる
+        @return memoryview 内部バッファのビュー、次のbeginまで有効
+        """
+        self.buf[self.opcPos] = self.opc
+        return memoryview(self.buf)[:self.length]
+
+    def encode(self, tid:int, seoj:int, deoj:int, esv:int, props) -> memoryview:
+        """!
+        @brief int, bytes指定の高速API、一度にフレームを組み立てる
+        @param tid int 16bit
+        @param seoj int 24bit
+        @param deoj int 24bit
+        @param esv int
+        @param props iterable[tuple[int, bytes]]  (epc, edt)の並び
+        @return memoryview 内部バッファのビュー、次のbeginまで有効
+        """
+        self.begin(tid, seoj, deoj, esv)
+        for epc, edt in props:
+            self.add(epc, edt)
+        return self.end()
+
+
+if __name__ == '__main__':
+    print("===== ELEncoder.py 単体テスト")
+    enc = ELEncoder()
+    print(bytes(enc.encode(0x0001, 0x05ff01, 0x0ef001, 0x62, [(0x80, b''), (0xd6, b'')])).hex())
+    enc.begin(toInt([0x00, 0x02]), toInt('05ff01'), toInt([0x02, 0x90, 0x01]), toInt('61'))
+    enc.addPDCEDT(0x80, toPDCEDT(PDCEDT([0x01, 0x30])))
+    enc.addPDCEDT(0xb0, toPDCEDT('0141'))
+    print(bytes(enc.end()).hex())
+    enc.begin(4, 0x029001, 0x05ff01, 0x7e) # SETGET_RES
+    enc.add(0x80)
+    enc.nextSection()
+    enc.add(0x80, b'\x30')
+    enc.add(0x81, b'\x00')
+    print(bytes(enc.end()).hex())
+    big = ELEncoder(16)
+    print(bytes(big.encode(3, 0x05ff01, 0x029001, 0x72, [(0x83, bytes(17))])).hex())
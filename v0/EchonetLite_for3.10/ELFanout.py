@@ -0,0 +1,141 @@
+#!/usr/bin/python3
+"""!
+@file ELFanout.py
+@brief 多数の機器から同じプロパティを一度に取得する
+@author SUGIMURA Hiroshi, Kanagawa Institute of Technology
+@date 2023年度
+@details 同時に応答を待つ数を上限で抑え、ELSendSchedulerで送信の間隔を空けながらGETを投げる。
+応答は(ip, EOJ)ごとにまとめ、時間切れとGET_SNAも機器ごとに返す
+"""
+import time
+import threading
+import collections
+import concurrent.futures
+
+if __name__ == '__main__' and not __package__:  # unit test
+    from EchonetLite import EchonetLite
+    from PDCEDT import PDCEDT
+    from ELEncoder import toInt
+    from ELSendScheduler import fixedInterval
+else:
+    from EchonetLite.EchonetLite import EchonetLite
+    from EchonetLite.PDCEDT import PDCEDT
+    from EchonetLite.ELEncoder import toInt
+    from EchonetLite.ELSendScheduler import fixedInterval
+
+
+class ELFanoutResult():
+    """!
+    @brief 一斉取得の結果、キーはすべて(ip, EOJ(24bit))
+    """
+    __slots__ = ('values', 'sna', 'timeouts', 'errors', 'elapsed')
+
+    def __init__(self):
+        """!
+        @brief コンストラクタ
+        """
+        self.values:dict[tuple[str, int], dict[int, PDCEDT]] = {} # 応答のあった機器 -> EPC -> PDCEDT、取れなかったものはPDC=0
+        self.sna:dict[tuple[str, int], list[int]] = {}  # GET_SNAを返した機器 -> 取れなかったEPC
+        self.timeouts:list[tuple[str, int]] = []        # 応答のなかった機器
+        self.errors:dict[tuple[str, int], Exception] = {} # 送信できなかった機器
+        self.elapsed:float = 0.0                        # 秒
+
+    def __repr__(self) -> str:
+        return 'ELFanoutResult(values=%d, sna=%d, timeouts=%d, errors=%d, elapsed=%.2f)' % (len(self.values), len(self.sna), len(self.timeouts), len(self.errors), self.elapsed)
+
+
+class ELFanout():
+    """!
+    @brief ELFanoutクラス
+    @details 要求はEchonetLite.request()で送るので、TIDの割り当て、時間切れ、送り直しはそちらに従う
+    @note 送信の予約と応答待ちにEchonetLiteの受信ループを使うので、begin()してから使う
+    """
+
+    def __init__(self, el:EchonetLite, concurrency:int|None = None, interval:float = 0.005, timeout:float = 3.0, retries:int = 1, scheduler = None, priority:int = 2):
+        """!
+        @brief コンストラクタ
+        @param el EchonetLite
+        @param concurrency int|None = None 同時に応答を待つ機器の数、Noneなら上限なし。送信の間隔はschedulerが守り、応答待ちの時間は送った時から数えるので、上限がなくても時間切れは増えない
+        @param interval float = 0.005 schedulerを指定しない時の送信の間隔、秒。同じELFanoutの一斉取得すべてで共有する
+        @param timeout float = 3.0 1回の応答を待つ秒数
+        @param retries int = 1 応答がない時に送り直す回数
+        @param scheduler ELSendScheduler|None = None 指定すればこれを通して送る、Noneならintervalの間隔で送る専用のものを作る
+        @param priority int = 2  schedulerに渡す優先度、ELSendScheduler.LOW
+        """
+        self.el = el
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.scheduler = scheduler if scheduler != None else fixedInterval(el, interval)
+        self.priority = priority
+        self.lock = threading.Lock()
+
+    def get(self, targets, epcs:list[int], seoj:int|list[int]|str = EchonetLite.EOJ_Controller) -> concurrent.futures.Future:
+        """!
+        @brief 機器すべてにGETを送る
+        @param targets iterable[tuple[str, (int | list[int] | str)]]  (ip, EOJ)の並び
+        @param epcs list[int]
+        @param seoj (int | list[int] | str) = EOJ_Controller
+        @return concurrent.futures.Future  結果はELFanoutResult、すべての機器が終わったら返る
+        """
+        seoj = toInt(seoj)
+        props = [(epc, b'') for epc in epcs]
+        pending = collections.deque((ip, toInt(eoj)) for ip, eoj in targets)
+        inflight = [0]
+        result = ELFanoutResult()
+        future = concurrent.futures.Future()
+        start = time.monotonic()
+
+        def fill():
+            keys = []
+            with self.lock:
+                while pending and (self.concurrency == None or inflight[0] < self.concurrency):
+                    keys.append(pending.popleft())
+                    inflight[0] += 1
+            for key in keys:
+                send(key)
+
+        def send(key:tuple[str, int]):
+            f = self.el.request(key[0], seoj, key[1], EchonetLite.GET, props, self.timeout, self.retries, self.scheduler, self.priority)
+            f.add_done_callback(lambda f: done(key, f))
+
+        def done(key:tuple[str, int], f:concurrent.futures.Future):
+            error = f.exception()
+            with self.lock:
+                if error == None:
+                    frame = f.result()
+                    details = frame.details['INF']
+                    result.values[key] = details
+                    if frame.esv == EchonetLite.GET_SNA:
+                        result.sna[key] = [epc for epc in epcs if epc not in details or details[epc].pdc == 0]
+                elif isinstance(error, TimeoutError):
+                    result.timeouts.append(key)
+                else:
+                    result.errors[key] = error
+                inflight[0] -= 1
+                finished = not pending and inflight[0] == 0
+            if finished:
+                result.elapsed = time.monotonic() - start
+                future.set_result(result)
+            else:
+                fill()
+
+        if not pending:
+            future.set_result(result)
+        else:
+            fill()
+        return future
+
+
+if __name__ == '__main__':
+    print("===== ELFanout.py 単体テスト")
+    el = EchonetLite([[0x02, 0x90, 0x01], [0x02, 0x90, 0x02]])
+    el.begin(None)
+    fan = ELFanout(el, concurrency=2, timeout=0.3, retries=0)
+    targets = [(el.LOCAL_ADDR, [0x02, 0x90, 0x01]), (el.LOCAL_ADDR, [0x02, 0x90, 0x02]), ('192.0.2.250', [0x02, 0x90, 0x01])]
+    res = fan.get(targets, [0x80, 0x81, 0xb0]).result(5)
+    print(res, res.sna, res.timeouts)
+    targets = [('192.0.2.%d' % n, [0x02, 0x90, 0x01]) for n in range(200, 250)] # 応答しない50台
+    res = ELFanout(el, timeout=0.3, retries=0).get(targets, [0x80]).result(5) # 上限なしなら、ほぼ時間切れ1回＋間隔×台数
+    print(res)
+    el.stop()
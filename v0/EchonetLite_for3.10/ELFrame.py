@@ -0,0 +1,128 @@
+#!/usr/bin/python3
+"""!
+@file ELFrame.py
+@brief 受信したECHONET Liteフレーム
+@author SUGIMURA Hiroshi, Kanagawa Institute of Technology
+@date 2023年度
+@details 受信から返信、ユーザのコールバックまでこのオブジェクト一つで受け渡す。
+TIDは16bit、EOJは24bitのintで持ち、EPCの表は必要になった時に作る
+"""
+
+if __name__ == '__main__' and not __package__:  # unit test
+    from PDCEDT import PDCEDT
+elif __name__ == 'ELFrame':  # EchonetLite.py test
+    from PDCEDT import PDCEDT
+else:
+    from EchonetLite.PDCEDT import PDCEDT
+
+
+class ELFrame():
+    """!
+    @brief ELFrameクラス
+    @details 受信バッファとEPC,PDC,EDTの位置だけを保持し、detailsは初回アクセス時に作る
+    """
+    __slots__ = ('ip', 'tid', 'seoj', 'deoj', 'esv', 'opc', 'data', 'props', '_details')
+
+    def __init__(self, ip:str, data, tid:int, seoj:int, deoj:int, esv:int, opc:int, props:tuple = ((), (), ())):
+        """!
+        @brief コンストラクタ
+        @param ip str 送信元
+        @param data (bytes | memoryview) 受信フレーム全体
+        @param tid int 16bit
+        @param seoj int 24bit
+        @param deoj int 24bit
+        @param esv int
+        @param opc int
+        @param props tuple  SET, GET, INFそれぞれの [(epc, PDCの位置, EDTの終端)]
+        """
+        self.ip = ip
+        self.tid = tid
+        self.seoj = seoj
+        self.deoj = deoj
+        self.esv = esv
+        self.opc = opc
+        self.data = data
+        self.props = props
+        self._details = None
+
+    def copy(self, deoj:int) -> 'ELFrame':
+        """!
+        @brief DEOJだけを差し替えたフレームを作る。インスタンス0宛の展開に使う
+        @param deoj int 24bit
+        @return ELFrame  受信バッファと作成済みのdetailsは共有する
+        """
+        frame = ELFrame(self.ip, self.data, self.tid, self.seoj, deoj, self.esv, self.opc, self.props)
+        frame._details = self._details
+        return frame
+
+    def detach(self) -> 'ELFrame':
+        """!
+        @brief 受信バッファから切り離したフレームを作る。別スレッド、別プロセスに渡す時に使う
+        @return ELFrame  dataがbytesならそのまま自身を返す
+        """
+        if type(self.data) is bytes:
+            return self
+        frame = ELFrame(self.ip, bytes(self.data), self.tid, self.seoj, self.deoj, self.esv, self.opc, self.props)
+        frame._details = self._details
+        return frame
+
+    @property
+    def details(self) -> dict[str, dict[int, PDCEDT]]:
+        """!
+        @brief EPCの表 {'SET':dict[int,PDCEDT], 'GET':dict[int,PDCEDT], 'INF':dict[int,PDCEDT]}
+        @return dict
+        @note 初回アクセス時に作り、以降は使い回す
+        """
+        if self._details == None:
+            data = self.data
+            sprops, gprops, iprops = self.props
+            self._details = {
+                'SET': {epc: PDCEDT(data[pdc:end]) for epc, pdc, end in sprops},
+                'GET': {epc: PDCEDT(data[pdc:end]) for epc, pdc, end in gprops},
+                'INF': {epc: PDCEDT(data[pdc:end]) for epc, pdc, end in iprops} }
+        return self._details
+
+    @property
+    def tidList(self) -> list[int]:
+        """!
+        @brief 従来形式のTID
+        @return list[int] size 2
+        """
+        return [self.tid >> 8, self.tid & 0xff]
+
+    @property
+    def seojList(self) -> list[int]:
+        """!
+        @brief 従来形式のSEOJ
+        @return list[int] size 3
+        """
+        return [self.seoj >> 16, (self.seoj >> 8) & 0xff, self.seoj & 0xff]
+
+    @property
+    def deojList(self) -> list[int]:
+        """!
+        @brief 従来形式のDEOJ
+        @return list[int] size 3
+        """
+        return [self.deoj >> 16, (self.deoj >> 8) & 0xff, self.deoj & 0xff]
+
+    def printString(self) -> str:
+        """!
+        @brief ログ用の文字列を返す
+        @return str
+        """
+        return '%s TID:%04x SEOJ:%06x DEOJ:%06x ESV:%02x OPC:%02x %s' % (
+            self.ip, self.tid, self.seoj, self.deoj, self.esv, self.opc, bytes(self.data[12:]).hex())
+
+
+if __name__ == '__main__':
+    print("===== ELFrame.py 単体テスト")
+    data = memoryview(bytes([0x10, 0x81, 0x00, 0x01, 0x05, 0xff, 0x01, 0x02, 0x90, 0x00, 0x61, 0x01, 0x80, 0x01, 0x31]))
+    f = ELFrame('192.168.0.2', data, 0x0001, 0x05ff01, 0x029000, 0x61, 1, (((0x80, 13, 15),), (), ()))
+    print(f.printString())
+    print(f.tidList, f.seojList, f.deojList)
+    f.details['SET'][0x80].println()
+    g = f.copy(0x029001)
+    print(g.deojList, g.details is f.details)
+    h = g.detach()
+    print(type(h.data), h.detach() is h, h.details is f.details)
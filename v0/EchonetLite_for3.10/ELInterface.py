@@ -0,0 +1,105 @@
+#!/usr/bin/python3
+"""!
+@file ELInterface.py
+@brief ECHONET Liteで使うネットワークインタフェース
+@author SUGIMURA Hiroshi, Kanagawa Institute of Technology
+@date 2023年度
+@details インタフェースごとに送信ソケットを持ち、マルチキャストの送信元もそのインタフェースに固定する。
+受信したインタフェースはIP_PKTINFOが使えればそれで知り、使えなければ相手のIPアドレスがどのインタフェースのサブネットにあるかで決める
+"""
+import socket
+import struct
+import ipaddress
+
+
+IP_PKTINFO:int|None = getattr(socket, 'IP_PKTINFO', None) # 定数を持たないPythonではサブネットで決める
+PKTINFO:bool = IP_PKTINFO != None and hasattr(socket.socket, 'recvmsg') # 受信したインタフェースが分かるか、Windowsはrecvmsgがない
+_PKTINFO = struct.Struct('=I4s4s') # struct in_pktinfo: ipi_ifindex, ipi_spec_dst, ipi_addr
+PKTINFO_SPACE:int = socket.CMSG_SPACE(_PKTINFO.size) if PKTINFO else 0 # recvmsgの補助データの大きさ
+
+
+def arrivalAddress(ancdata:list) -> str | None:
+    """!
+    @brief recvmsgの補助データから、受信したインタフェースのアドレスを取り出す
+    @param ancdata list  recvmsgの2番目の返り値
+    @return str | None  IP_PKTINFOがなければNone
+    """
+    for level, kind, data in ancdata:
+        if level == socket.IPPROTO_IP and kind == IP_PKTINFO and len(data) >= _PKTINFO.size:
+            return socket.inet_ntoa(_PKTINFO.unpack_from(data)[1])
+    return None
+
+
+def localAddress() -> str:
+    """!
+    @brief 既定のインタフェースのIPアドレスを調べる
+    @return str
+    @note UDPソケットをconnectすると送信元アドレスが決まる、パケットは送らない。失敗したらホスト名から引く
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.connect(('224.0.23.0', 3610))
+        addr = sock.getsockname()[0]
+        if addr != '0.0.0.0':
+            return addr
+    except OSError:
+        pass
+    finally:
+        sock.close()
+    return socket.gethostbyname(socket.gethostname())
+
+
+class ELInterface():
+    """!
+    @brief ELInterfaceクラス
+    """
+
+    def __init__(self, spec:str):
+        """!
+        @brief コンストラクタ
+        @param spec str  'アドレス/プレフィックス長'、プレフィックス長を省略すると/24
+        """
+        if '/' not in spec:
+            spec += '/24'
+        iface = ipaddress.ip_interface(spec)
+        self.address:str = str(iface.ip)
+        self.network:ipaddress.IPv4Network = iface.network
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) # 送信用、ユニキャストもマルチキャストもこれで送る
+        self.sock.bind((self.address, 0))
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(self.address))
+
+    def __repr__(self) -> str:
+        return 'ELInterface(%s/%d)' % (self.address, self.network.prefixlen)
+
+    def contains(self, ip:str) -> bool:
+        """!
+        @brief IPアドレスがこのインタフェースのサブネットにあるか
+        @param ip str
+        @return bool
+        """
+        try:
+            return ipaddress.ip_address(ip) in self.network
+        except ValueError:
+            return False
+
+    def join(self, sock:socket.socket, group:str):
+        """!
+        @brief 受信ソケットで、このインタフェースのマルチキャストグループに参加する
+        @param sock socket.socket 受信ソケット
+        @param group str マルチキャストアドレス
+        """
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, socket.inet_aton(group) + socket.inet_aton(self.address))
+
+    def close(self):
+        """!
+        @brief 送信ソケットを閉じる
+        """
+        self.sock.close()
+
+
+if __name__ == '__main__':
+    print("===== ELInterface.py 単体テスト")
+    print(localAddress())
+    lo = ELInterface('127.0.0.1/8')
+    print(lo, lo.contains('127.1.2.3'), lo.contains('192.168.0.1'), lo.contains('host'))
+    lo.close()
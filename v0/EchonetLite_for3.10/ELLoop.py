@@ -0,0 +1,241 @@
+#!/usr/bin/python3
+"""!
+@file ELLoop.py
+@brief selectorsによる受信待ちとタイマのループ
+@author SUGIMURA Hiroshi, Kanagawa Institute of Technology
+@date 2023年度
+@details 登録したソケットが読めるようになった時と、タイマの期限、socketpairへの書き込みでだけ起きる。
+タイムアウトで定期的に起きることはなく、stop()ですぐに止まる
+"""
+import selectors
+import socket
+import threading
+import heapq
+import time
+import traceback
+
+
+class ELTimer():
+    """!
+    @brief callLaterの戻り値、cancel()で取り消す
+    """
+    __slots__ = ('when', 'func', 'args', 'cancelled')
+
+    def __init__(self, when:float, func, args:tuple):
+        """!
+        @brief コンストラクタ
+        @param when float time.monotonic()の時刻
+        @param func 呼ぶ関数
+        @param args tuple
+        """
+        self.when = when
+        self.func = func
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        """!
+        @brief 取り消す
+        """
+        self.cancelled = True
+
+
+class ELLoop():
+    """!
+    @brief ELLoopクラス
+    @details register, callLater, stopはどのスレッドから呼んでもよい。コールバックはループのスレッドで呼ばれる
+    """
+
+    def __init__(self):
+        """!
+        @brief コンストラクタ
+        """
+        self.selector = selectors.DefaultSelector()
+        self.wakeupRecv, self.wakeupSend = socket.socketpair() # 別スレッドからループを起こす
+        self.wakeupRecv.setblocking(False)
+        self.wakeupSend.setblocking(False)
+        self.selector.register(self.wakeupRecv, selectors.EVENT_READ, self.onWakeup)
+        self.timers:list[tuple[float, int, ELTimer]] = [] # heap
+        self.pending:list = [] # 別スレッドから頼まれた処理
+        self.seq:int = 0
+        self.lock = threading.Lock()
+        self.running:bool = False
+        self.thread:threading.Thread|None = None
+
+    def inLoop(self) -> bool:
+        """!
+        @brief ループのスレッドから呼ばれているか
+        @return bool
+        """
+        return self.thread != None and threading.current_thread() is self.thread
+
+    def register(self, fileobj, callback):
+        """!
+        @brief 読めるようになったら呼ぶファイルを登録する
+        @param fileobj (socket | int) fileno()を持つものかfd
+        @param callback func(fileobj)
+        """
+        self.callSoon(self.selector.register, fileobj, selectors.EVENT_READ, callback)
+
+    def unregister(self, fileobj):
+        """!
+        @brief 登録を外す
+        @param fileobj (socket | int)
+        """
+        self.callSoon(self.selector.unregister, fileobj)
+
+    def callLater(self, delay:float, func, *args) -> ELTimer:
+        """!
+        @brief delay秒後にfunc(*args)を呼ぶ
+        @param delay float 秒
+        @param func 呼ぶ関数
+        @return ELTimer
+        """
+        timer = ELTimer(time.monotonic() + delay, func, args)
+        with self.lock:
+            self.seq += 1
+            heapq.heappush(self.timers, (timer.when, self.seq, timer))
+            first = self.timers[0][2] is timer
+        if first and not self.inLoop():
+            self.wakeup()
+        return timer
+
+    def callSoon(self, func, *args):
+        """!
+        @brief ループのスレッドでfunc(*args)を呼ぶ。ループが動いていない、またはループのスレッドからならすぐ呼ぶ
+        @param func 呼ぶ関数
+        @note stop()の前に頼まれたものは、run()が戻る前に必ず呼ぶ
+        """
+        with self.lock: # run()の最後の後始末と入れ違わないよう、runningはlockの中で見る
+            queued = self.running and not self.inLoop()
+            if queued:
+                self.pending.append( (func, args) )
+        if not queued:
+            func(*args)
+            return
+        self.wakeup()
+
+    def wakeup(self):
+        """!
+        @brief ループを起こす内部関数
+        """
+        try:
+            self.wakeupSend.send(b'\x00')
+        except (BlockingIOError, OSError): # 起こす要求が溜まっているなら十分
+            pass
+
+    def onWakeup(self, sock:socket.socket):
+        """!
+        @brief 起こされた時の内部関数
+        @param sock socket.socket
+        """
+        try:
+            while sock.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+        with self.lock:
+            pending, self.pending = self.pending, []
+        for func, args in pending:
+            func(*args)
+
+    def run(self):
+        """!
+        @brief stop()まで回す。呼んだスレッドで動く
+        @note start()から呼ばれた時はrunningを立て直さないので、スレッドが動き出す前のstop()も効く。
+        戻る前に、callSoon()で頼まれたまま残っているものを呼ぶ
+        """
+        if threading.current_thread() is not self.thread: # start()を使わずに直接呼んだ
+            self.thread = threading.current_thread()
+            self.running = True
+        while self.running:
+            with self.lock:
+                timeout = max(0.0, self.timers[0][0] - time.monotonic()) if self.timers else None
+            for key, _ in self.selector.select(timeout):
+                try:
+                    key.data(key.fileobj)
+                except Exception:
+                    traceback.print_exc()
+            self.runTimers()
+        with self.lock:
+            pending, self.pending = self.pending, []
+        for func, args in pending:
+            try:
+                func(*args)
+            except Exception:
+                traceback.print_exc()
+
+    def runTimers(self):
+        """!
+        @brief 期限の来たタイマを呼ぶ内部関数
+        """
+        now = time.monotonic()
+        while True:
+            with self.lock:
+                if not self.timers or self.timers[0][0] > now:
+                    return
+                timer = heapq.heappop(self.timers)[2]
+            if not timer.cancelled:
+                try:
+                    timer.func(*timer.args)
+                except Exception:
+                    traceback.print_exc()
+
+    def start(self, name:str = 'ELLoop') -> threading.Thread:
+        """!
+        @brief スレッドを作ってrun()する
+        @param name str スレッド名
+        @return threading.Thread
+        """
+        self.running = True # start直後のregisterなどをループに回すため先に立てる。runningを立てるのはここだけ
+        self.thread = threading.Thread(target=self.run, name=name)
+        self.thread.start()
+        return self.thread
+
+    def stop(self):
+        """!
+        @brief ループを止める、すぐに戻る
+        """
+        self.running = False
+        self.wakeup()
+
+    def join(self, timeout:float|None = None):
+        """!
+        @brief ループのスレッドの終了を待つ
+        @param timeout float|None 秒
+        """
+        if self.thread != None and not self.inLoop():
+            self.thread.join(timeout)
+
+    def close(self):
+        """!
+        @brief 止めてから後始末する
+        """
+        self.stop()
+        self.join()
+        self.selector.close()
+        self.wakeupRecv.close()
+        self.wakeupSend.close()
+
+
+if __name__ == '__main__':
+    print("===== ELLoop.py 単体テスト")
+    loop = ELLoop()
+    a, b = socket.socketpair()
+    got = []
+    loop.register(a, lambda s: got.append(s.recv(100)))
+    start = time.monotonic()
+    loop.start()
+    loop.callLater(0.05, got.append, 'timer')
+    loop.callLater(0.02, got.append, 'cancelled').cancel()
+    b.send(b'data')
+    time.sleep(0.1)
+    loop.stop()
+    loop.join()
+    print(got, loop.thread.is_alive(), '%.2f' % (time.monotonic() - start))
+    loop.start() # 動き出す前のstop()と、残っていたcallSoon()
+    loop.callSoon(got.append, 'soon')
+    loop.stop()
+    loop.join(1)
+    print(got[-1], loop.thread.is_alive())
+    loop.close()
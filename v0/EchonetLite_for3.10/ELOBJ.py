@@ -6,44 +6,42 @@
 @date 2023年度
 @details PDCEDTをEPCと結びつけて管理することを主とする
 """
-from copy import deepcopy
 
-if __name__ == '__main__':  # unit test
+if __name__ == '__main__' and not __package__:  # unit test
     from PDCEDT import PDCEDT
+    import ELPropertyMap
 elif  __name__ == 'ELOBJ':  # EchonetLite.py test
     from PDCEDT import PDCEDT
+    import ELPropertyMap
 else:
     from .EchonetLite import PDCEDT
+    from . import ELPropertyMap
 
 
 class ELOBJ():
     """!
     @brief ELOBJクラス
-    @details PDCEDTをEPCと結びつけて管理することを主とする
+    @details PDCEDTをEPCと結びつけて管理することを主とする。
+    EPCをindexとする256要素の表でPDCEDTを持ち、プロパティマップは256bitのintで持つ
     """
+    __slots__ = ('pdcedts', 'infMap', 'setMap', 'getMap', 'version')
 
     def __init__(self, other = None):
         """!
         @brief コンストラクタ
         @param other (ELOBJ) = None
         """
-        self.pdcedts:dict[int, PDCEDT] = {}
-        self.inf_property_map_raw:list[int] = [] # 9d
-        self.set_property_map_raw:list[int] = [] # 9e
-        self.get_property_map_raw:list[int] = [] # 9f
-        # コピーコンストラクタの実現
+        self.pdcedts:list[PDCEDT | None] = [None] * 256 # EPCがindex
+        self.infMap:int = 0 # 9d, bit n がEPC n
+        self.setMap:int = 0 # 9e
+        self.getMap:int = 0 # 9f
+        self.version:int = 0 # プロパティを変更するたびに増える、返答キャッシュの無効化用。PDCEDTは不変なので、変更は必ずここのメソッドを通る
+        # コピーコンストラクタの実現、PDCEDTのbytesは共有する
         if type(other) is ELOBJ:
-            self.pdcedts = deepcopy(other.pdcedts)
-            self.inf_property_map_raw = deepcopy(other.inf_property_map_raw)
-            self.set_property_map_raw = deepcopy(other.set_property_map_raw)
-            self.get_property_map_raw = deepcopy(other.get_property_map_raw)
-
-    def __del__(self):
-        """!
-        @brief デストラクタ
-        """
-        # print("__del__")
-        return
+            self.pdcedts = [None if p == None else PDCEDT(p) for p in other.pdcedts]
+            self.infMap = other.infMap
+            self.setMap = other.setMap
+            self.getMap = other.getMap
 
     def __eq__(self, other):
         """!
@@ -55,9 +53,9 @@ class ELOBJ():
             return NotImplemented
 
         return (self.pdcedts == other.pdcedts and
-                self.inf_property_map_raw == other.inf_property_map_raw and
-                self.set_property_map_raw == other.set_property_map_raw and
-                self.get_property_map_raw == other.get_property_map_raw)
+                self.infMap == other.infMap and
+                self.setMap == other.setMap and
+                self.getMap == other.getMap)
 
     def __getitem__(self, epc:int) -> PDCEDT | None:
         """!
@@ -66,11 +64,7 @@ class ELOBJ():
         @return PDCEDT | None
         """
         # print('__getitem__ epc:', epc)
-        if epc in self.pdcedts:
-            # print('exist')
-            return self.pdcedts[epc]
-        else:
-            return None
+        return self.pdcedts[epc]
 
     def __setitem__(self, epc:int, pdcedt:PDCEDT) -> PDCEDT:
         """!
@@ -79,9 +73,33 @@ class ELOBJ():
         @return PDCEDT
         @note 新規EPCに対するアクセスはエラーとなる。新規EPCはSetPDCEDTまたはSetEDTを使うこと
         """
-        print('__setitem__')
         self.pdcedts[epc] = pdcedt
-        return self.pdcedts[epc]
+        self.version += 1
+        return pdcedt
+
+    @property
+    def inf_property_map_raw(self) -> list[int]:
+        """!
+        @brief 互換のため、INFプロパティマップをEPCのlistで返す
+        @return list[int]
+        """
+        return self.GetMyPropertyMap(0x9d)
+
+    @property
+    def set_property_map_raw(self) -> list[int]:
+        """!
+        @brief 互換のため、SETプロパティマップをEPCのlistで返す
+        @return list[int]
+        """
+        return self.GetMyPropertyMap(0x9e)
+
+    @property
+    def get_property_map_raw(self) -> list[int]:
+        """!
+        @brief 互換のため、GETプロパティマップをEPCのlistで返す
+        @return list[int]
+        """
+        return self.GetMyPropertyMap(0x9f)
 
     def GetPDCEDT(self, epc:int) -> PDCEDT | None:
         """!
@@ -89,11 +107,7 @@ class ELOBJ():
         @param epc int
         @return PDCEDT | None
         """
-        if epc in self.pdcedts:
-            # print('exist')
-            return self.pdcedts[epc]
-        else:
-            return None
+        return self.pdcedts[epc]
 
     def SetPDCEDT(self, epc:int, pdcedt:PDCEDT | list[int]) -> PDCEDT:
         """!
@@ -106,6 +120,7 @@ class ELOBJ():
             self.pdcedts[epc] = pdcedt
         elif type(pdcedt) is list:
             self.pdcedts[epc] = PDCEDT(pdcedt)
+        self.version += 1
         return self.pdcedts[epc]
 
     def SetEDT(self, epc:int, edt:list[int]) -> PDCEDT:
@@ -116,62 +131,53 @@ class ELOBJ():
         @return PDCEDT
         """
         # print('ELOBJ.SetEDT epc:', epc, 'edt', edt)
-        self.pdcedts[epc] = PDCEDT()
-        self.pdcedts[epc].setEDT(edt)
-        return self.pdcedts[epc]
+        pdcedt = PDCEDT.fromEDT(edt)
+        self.pdcedts[epc] = pdcedt
+        self.version += 1
+        return pdcedt
 
     def GetMyPropertyMap(self, epc:int) -> list[int] | None:
         """!
         @brief 自身のPropertyMapを取得する
         @param epc int 0x9d=INF, 0x9e=SET, 0x9f=GET
-        @return list[int] | None
+        @return list[int] | None  EPCの昇順
         """
         #print("GetMyPropertyMap")
         if epc == 0x9d:
-            return self.inf_property_map_raw
+            bits = self.infMap
         elif epc == 0x9e:
-            return self.set_property_map_raw
+            bits = self.setMap
         elif epc == 0x9f:
-            return self.get_property_map_raw
+            bits = self.getMap
         else:
             print("ELOBJ Error!! GetMyPropertyMap epc:", hex(epc))
             return None
+        return ELPropertyMap.toList(bits)
 
     def SetMyPropertyMap(self, epc:int, epcList:list[int]) -> PDCEDT | None:
         """!
         @brief 自身のPropertyMapを設定する
         @param epc int 0x9d=INF, 0x9e=SET, 0x9f=GET
-        @param epcList list[int]
+        @param epcList list[int]  変更はしない
         @return PDCEDT | None
         """
         # print("SetMyPropertyMap")
+        bits = ELPropertyMap.fromList(epcList)
         if epc == 0x9d:
-            self.inf_property_map_raw = epcList
+            self.infMap = bits
         elif epc == 0x9e:
-            self.set_property_map_raw = epcList
+            self.setMap = bits
         elif epc == 0x9f:
-            self.get_property_map_raw = epcList
+            self.getMap = bits
         else:
             print("ELOBJ Error!! SetMyPropertyMap epc:", hex(epc))
             return None
 
-        n:int = len(epcList)
-        if n < 16: # format 1
-            pdcedt = PDCEDT()
-            epcList.insert(0, n)
-            pdcedt.setEDT(epcList)
-            self.pdcedts[epc] = pdcedt
-        else: # format 2
-            temp_edt = [0] * 17
-            temp_edt[0] = n
-            for v in epcList:
-                i = (v & 0x0f) + 1
-                flag = 0x01 << ((v >> 4) -8)
-                temp_edt[i] += flag
-            pdcedt = PDCEDT()
-            pdcedt.setEDT(temp_edt)
-            self.pdcedts[epc] = pdcedt
-        return self.pdcedts[epc]
+        # 16個未満ならformat 1、16個以上ならformat 2
+        pdcedt = PDCEDT.fromEDT(ELPropertyMap.encode(bits))
+        self.pdcedts[epc] = pdcedt
+        self.version += 1
+        return pdcedt
 
     def hasInfProperty(self, epc:int) -> bool:
         """!
@@ -180,7 +186,7 @@ class ELOBJ():
         @return bool
         """
         # print("hasInfProperty")
-        return epc in self.inf_property_map_raw
+        return (self.infMap >> epc) & 1 == 1
 
     def hasSetProperty(self, epc:int) -> bool:
         """!
@@ -189,7 +195,7 @@ class ELOBJ():
         @return bool
         """
         # print("hasSetProperty")
-        return epc in self.set_property_map_raw
+        return (self.setMap >> epc) & 1 == 1
 
     def hasGetProperty(self, epc:int) -> bool:
         """!
@@ -198,15 +204,16 @@ class ELOBJ():
         @return bool
         """
         # print("hasGetProperty")
-        return epc in self.get_property_map_raw
+        return (self.getMap >> epc) & 1 == 1
 
     def println(self):
         """!
         @brief 格納しているEPC、PDCEDTをすべて表示する
         """
         # print("===== ELOBJ.print()")
-        for key in self.pdcedts:
-            print("EPC:", format(key,'02x'), ",", self.pdcedts[key].printString() )
+        for epc, pdcedt in enumerate(self.pdcedts):
+            if pdcedt != None:
+                print("EPC:", format(epc,'02x'), ",", pdcedt.printString() )
 
 
 if __name__ == '__main__':
@@ -235,7 +242,7 @@ if __name__ == '__main__':
     p = test2[0x82]
     if p != None:
         p.println()
-    test2[0x82].setEDT([0x31, 0x32])
+    test2.SetEDT(0x82, [0x31, 0x32])
     p = test2[0x82]
     if p != None:
         p.println()
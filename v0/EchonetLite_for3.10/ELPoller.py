@@ -0,0 +1,257 @@
+#!/usr/bin/python3
+"""!
+@file ELPoller.py
+@brief 機器のプロパティを定期的に取得する
+@author SUGIMURA Hiroshi, Kanagawa Institute of Technology
+@date 2023年度
+@details (ip, EOJ, EPC)ごとに間隔を持ち、タイマホイールで次の取得時刻を管理する。
+同じ時刻になった同じ機器のEPCは1つのGETにまとめる。次の時刻は間隔をjitterの割合だけずらし、
+応答のない機器は間隔を倍々に延ばす。INFプロパティマップ(0x9D)にあるEPCは機器が自分で通知するので取得しない
+"""
+import time
+import random
+import threading
+
+if __name__ == '__main__' and not __package__:  # unit test
+    from EchonetLite import EchonetLite
+    import ELPropertyMap
+else:
+    from EchonetLite.EchonetLite import EchonetLite
+    from EchonetLite import ELPropertyMap
+
+
+class ELPollItem():
+    """!
+    @brief 定期取得する(ip, EOJ, EPC)1つ分
+    """
+    __slots__ = ('ip', 'eoj', 'epc', 'interval', 'rounds', 'active')
+
+    def __init__(self, ip:str, eoj:int, epc:int, interval:float):
+        """!
+        @brief コンストラクタ
+        @param ip str
+        @param eoj int 24bit
+        @param epc int
+        @param interval float 秒
+        """
+        self.ip = ip
+        self.eoj = eoj
+        self.epc = epc
+        self.interval = interval
+        self.rounds:int = 0     # ホイールをあと何周待つか
+        self.active:bool = True # remove()されたか、INFで通知されるならFalse
+
+
+class ELPoller():
+    """!
+    @brief ELPollerクラス
+    @details ホイールはslots個の枠を持ち、tick秒ごとに1つ進む。1周より先の予定は周回数を持たせて同じ枠に入れる。
+    1回に見るのは今の枠だけなので、項目が数万あっても1回の処理は期限の来たものの数で決まる
+    @note 取得と時刻の管理にEchonetLiteの受信ループを使うので、begin()してから使う
+    """
+
+    def __init__(self, el:EchonetLite, tick:float = 0.1, slots:int = 1024, jitter:float = 0.1, maxBackoff:int = 5, timeout:float = 3.0, retries:int = 0, onResult = None, scheduler = None, priority:int = 2):
+        """!
+        @brief コンストラクタ
+        @param el EchonetLite
+        @param tick float = 0.1 ホイールが1つ進む秒数、時刻の細かさ
+        @param slots int = 1024 ホイールの枠の数
+        @param jitter float = 0.1 次の時刻を間隔の±何割ずらすか
+        @param maxBackoff int = 5 応答がない時に間隔を2の何乗まで延ばすか
+        @param timeout float = 3.0 1回の応答を待つ秒数
+        @param retries int = 0 応答がない時に送り直す回数
+        @param onResult func(ip:str, eoj:int, details:dict[int, PDCEDT]) = None  応答を受けたら呼ぶ
+        @param scheduler ELSendScheduler|None = None 指定すればこれを通して送る
+        @param priority int = 2  schedulerに渡す優先度、ELSendScheduler.LOW
+        """
+        self.el = el
+        self.tick = tick
+        self.jitter = jitter
+        self.maxBackoff = maxBackoff
+        self.timeout = timeout
+        self.retries = retries
+        self.onResult = onResult
+        self.scheduler = scheduler
+        self.priority = priority
+        self.wheel:list[list[ELPollItem]] = [[] for _ in range(0, slots)]
+        self.pos:int = 0
+        self.items:dict[tuple[str, int, int], ELPollItem] = {} # (ip, eoj, epc) -> ELPollItem
+        self.failures:dict[tuple[str, int], int] = {} # (ip, eoj) -> 続けて応答がなかった回数
+        self.infMaps:dict[tuple[str, int], int] = {}  # (ip, eoj) -> INFプロパティマップのbitset
+        self.lock = threading.Lock()
+        self.timer = None
+        self.started:float = 0.0
+        self.ticks:int = 0
+        self.stats:dict[str, int] = {'polls': 0, 'frames': 0, 'timeouts': 0, 'announced': 0}
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def add(self, ip:str, eoj:int, epc:int, interval:float = 60.0):
+        """!
+        @brief 定期取得を追加する。最初の取得は0からintervalの間のどこかにずらす
+        @param ip str
+        @param eoj int 24bit
+        @param epc int
+        @param interval float = 60.0 秒
+        @note 同じ(ip, EOJ, EPC)があれば間隔だけ変える。INFプロパティマップにあれば追加しない
+        """
+        key = (ip, eoj, epc)
+        with self.lock:
+            item = self.items.get(key)
+            if item != None:
+                item.interval = interval
+                return
+            if self.announced(ip, eoj, epc):
+                self.stats['announced'] += 1
+                return
+            item = self.items[key] = ELPollItem(ip, eoj, epc, interval)
+            self.schedule(item, random.uniform(0, interval))
+
+    def remove(self, ip:str, eoj:int, epc:int|None = None):
+        """!
+        @brief 定期取得をやめる
+        @param ip str
+        @param eoj int 24bit
+        @param epc int|None = None  Noneならその機器オブジェクトのすべて
+        @note ホイールからは次にその枠を見た時に外す
+        """
+        with self.lock:
+            keys = [key for key in self.items if key[0] == ip and key[1] == eoj and (epc == None or key[2] == epc)]
+            for key in keys:
+                self.items.pop(key).active = False
+
+    def setInfMap(self, ip:str, eoj:int, bits:int):
+        """!
+        @brief 機器のINFプロパティマップを教える。発見で取得済みの場合に使う
+        @param ip str
+        @param eoj int 24bit
+        @param bits int  ELPropertyMapのbitset
+        @note 教えなければ、その機器の最初の取得で0x9Dも一緒に取得する
+        """
+        with self.lock:
+            self.infMaps[(ip, eoj)] = bits
+
+    def announced(self, ip:str, eoj:int, epc:int) -> bool:
+        """!
+        @brief EPCが機器のINFプロパティマップにあるかを調べる内部関数
+        @param ip str
+        @param eoj int
+        @param epc int
+        @return bool
+        """
+        return (self.infMaps.get((ip, eoj), 0) >> epc) & 1 == 1
+
+    def start(self):
+        """!
+        @brief ホイールを回し始める
+        """
+        self.started = time.monotonic()
+        self.ticks = 0
+        self.timer = self.el.eventLoop.callLater(self.tick, self.turn)
+
+    def stop(self):
+        """!
+        @brief ホイールを止める。応答待ちのものはそのまま終わらせる
+        """
+        if self.timer != None:
+            self.timer.cancel()
+            self.timer = None
+
+    def schedule(self, item:ELPollItem, delay:float):
+        """!
+        @brief delay秒後の枠に入れる内部関数、lockを取った中で呼ぶ
+        @param item ELPollItem
+        @param delay float
+        """
+        ticks = max(1, round(delay / self.tick))
+        slots = len(self.wheel)
+        item.rounds = (ticks - 1) // slots
+        self.wheel[(self.pos + ticks) % slots].append(item)
+
+    def turn(self):
+        """!
+        @brief ホイールを1つ進め、期限の来たものを機器ごとにまとめて取得する内部関数
+        """
+        due:dict[tuple[str, int], list[ELPollItem]] = {}
+        with self.lock:
+            self.pos = (self.pos + 1) % len(self.wheel)
+            keep = []
+            for item in self.wheel[self.pos]:
+                if not item.active:
+                    continue
+                if item.rounds > 0:
+                    item.rounds -= 1
+                    keep.append(item)
+                    continue
+                due.setdefault((item.ip, item.eoj), []).append(item)
+            self.wheel[self.pos] = keep
+            requests = []
+            for device, items in due.items():
+                epcs = [item.epc for item in items]
+                asked = device not in self.infMaps
+                if asked:
+                    if 0x9d not in epcs:
+                        epcs.append(0x9d)
+                    self.infMaps[device] = 0 # 取得するまで、もう一度は聞かない
+                requests.append( (device, items, epcs, asked) )
+                self.stats['polls'] += len(items)
+            self.stats['frames'] += len(requests)
+        for device, items, epcs, asked in requests:
+            future = self.el.get(device[0], device[1], epcs, timeout=self.timeout, retries=self.retries, scheduler=self.scheduler, priority=self.priority)
+            future.add_done_callback(lambda f, device=device, items=items, asked=asked: self.done(device, items, asked, f))
+        # 遅れが溜まらないよう、始めた時刻から数える
+        self.ticks += 1
+        if self.timer != None:
+            self.timer = self.el.eventLoop.callLater(max(0.0, self.started + (self.ticks + 1) * self.tick - time.monotonic()), self.turn)
+
+    def done(self, device:tuple[str, int], items:list[ELPollItem], asked:bool, future):
+        """!
+        @brief 応答を受けて次の時刻を決める内部関数
+        @param device tuple (ip, eoj)
+        @param items list[ELPollItem]
+        @param asked bool  0x9Dも取得したか
+        @param future concurrent.futures.Future
+        """
+        error = future.exception()
+        details = None
+        with self.lock:
+            if error != None:
+                self.stats['timeouts'] += isinstance(error, TimeoutError)
+                failures = self.failures[device] = self.failures.get(device, 0) + 1
+                if asked and self.infMaps.get(device) == 0: # 次の取得でもう一度聞く
+                    del self.infMaps[device]
+            else:
+                details = future.result()
+                failures = 0
+                self.failures.pop(device, None)
+                pdcedt = details.get(0x9d)
+                if pdcedt != None and pdcedt.pdc > 0:
+                    self.infMaps[device] = ELPropertyMap.decode(pdcedt.edtBytes)
+            factor = 1 << min(failures, self.maxBackoff)
+            for item in items:
+                if not item.active:
+                    continue
+                if self.announced(item.ip, item.eoj, item.epc): # 機器が自分で通知する
+                    item.active = False
+                    self.items.pop((item.ip, item.eoj, item.epc), None)
+                    self.stats['announced'] += 1
+                    continue
+                self.schedule(item, item.interval * factor * random.uniform(1 - self.jitter, 1 + self.jitter))
+        if details != None and self.onResult != None:
+            self.onResult(device[0], device[1], details)
+
+
+if __name__ == '__main__':
+    print("===== ELPoller.py 単体テスト")
+    el = EchonetLite([[0x02, 0x90, 0x01]])
+    el.begin(None)
+    p = ELPoller(el, tick=0.05, slots=8, onResult=lambda ip, eoj, details: print(ip, hex(eoj), sorted(details.keys())))
+    for epc in (0x80, 0x81, 0x88):
+        p.add(el.LOCAL_ADDR, 0x029001, epc, 0.3)
+    p.add('192.0.2.250', 0x029001, 0x80, 0.2)
+    p.start()
+    time.sleep(1.5)
+    p.stop()
+    print(len(p), p.stats, p.failures)
+    el.stop()
@@ -0,0 +1,117 @@
+#!/usr/bin/python3
+"""!
+@file ELPropertyMap.py
+@brief プロパティマップ（EPC 0x9d, 0x9e, 0x9f）のエンコード、デコード
+@author SUGIMURA Hiroshi, Kanagawa Institute of Technology
+@date 2023年度
+@details プロパティマップのEDTと、bit n がEPC n を表す256bitのintを相互に変換する。
+byteごとの変換表をimport時に作っておき、bit単位のループはしない
+"""
+
+# byte値 -> 立っているbitの番号
+_BYTE_BITS:list[tuple[int, ...]] = [tuple(b for b in range(0, 8) if (v >> b) & 1) for v in range(0, 256)]
+# byte値 -> bit b を 16*b bit目に広げた値、format 2の1byteがbitsetのどこに当たるか
+_SPREAD:list[int] = [sum(1 << (b << 4) for b in bits) for bits in _BYTE_BITS]
+_UNSPREAD:dict[int, int] = {m: v for v, m in enumerate(_SPREAD)}
+_SPREAD_MASK:int = _SPREAD[0xff]
+# bitsetのk byte目の値 -> EPCのlist、k*8を足して使う
+_BYTE_EPCS:list[list[tuple[int, ...]]] = [[tuple((k << 3) + b for b in bits) for bits in _BYTE_BITS] for k in range(0, 32)]
+
+
+def fromList(epcs) -> int:
+    """!
+    @brief EPCのlistをbitsetにする
+    @param epcs iterable[int]
+    @return int
+    """
+    bits = 0
+    for epc in epcs:
+        bits |= 1 << epc
+    return bits
+
+
+def toList(bits:int) -> list[int]:
+    """!
+    @brief bitsetをEPCのlistにする
+    @param bits int
+    @return list[int] EPCの昇順
+    """
+    epcs = []
+    for k, v in enumerate(bits.to_bytes(32, 'little')):
+        if v:
+            epcs += _BYTE_EPCS[k][v]
+    return epcs
+
+
+def decode(edt:bytes|list[int]) -> int:
+    """!
+    @brief プロパティマップのEDTをbitsetにする
+    @param edt (bytes | list[int]) 先頭はプロパティの個数
+    @return int
+    """
+    if len(edt) == 0:
+        return 0
+    if edt[0] < 16: # format 1
+        return fromList(edt[1:edt[0] + 1])
+    bits = 0 # format 2
+    for i in range(0, min(16, len(edt) - 1)):
+        v = edt[i + 1]
+        if v:
+            bits |= _SPREAD[v] << (0x80 + i)
+    return bits
+
+
+def decodeList(edt:bytes|list[int]) -> list[int]:
+    """!
+    @brief プロパティマップのEDTをEPCのlistにする
+    @param edt (bytes | list[int]) 先頭はプロパティの個数
+    @return list[int]  format 1は並び順そのまま、format 2は昇順
+    """
+    if len(edt) == 0:
+        return []
+    if edt[0] < 16: # format 1
+        return list(edt[1:edt[0] + 1])
+    return toList(decode(edt))
+
+
+def encode(bits:int) -> bytes:
+    """!
+    @brief bitsetをプロパティマップのEDTにする
+    @param bits int
+    @return bytes  16個未満ならformat 1、16個以上ならformat 2
+    """
+    n = bits.bit_count()
+    if n < 16: # format 1
+        return bytes([n] + toList(bits))
+    edt = bytearray(17) # format 2
+    edt[0] = n
+    for i in range(0, 16):
+        edt[i + 1] = _UNSPREAD[(bits >> (0x80 + i)) & _SPREAD_MASK]
+    return bytes(edt)
+
+
+def decodeMany(maps:dict) -> dict:
+    """!
+    @brief 複数のプロパティマップをまとめてbitsetにする。発見した機器群の一括処理用
+    @param maps dict[key, bytes | list[int] | PDCEDT]  keyは(ip, eoj)など任意
+    @return dict[key, int]
+    """
+    res = {}
+    for key, edt in maps.items():
+        if hasattr(edt, 'edtBytes'): # PDCEDT
+            edt = edt.edtBytes
+        res[key] = decode(edt)
+    return res
+
+
+if __name__ == '__main__':
+    print("===== ELPropertyMap.py 単体テスト")
+    f1 = bytes([0x03, 0x80, 0x81, 0x9f])
+    print(hex(decode(f1)), toList(decode(f1)), encode(decode(f1)) == f1)
+    f2 = bytes([0x10] + [0x01] * 16)
+    print(toList(decode(f2)))
+    print(encode(decode(f2)) == f2)
+    epcs = [0x80, 0x81, 0x82, 0x83, 0x84, 0x90, 0x91, 0x92, 0x93, 0x94, 0xa1, 0xa2, 0xb1, 0xb2, 0xb3, 0xb4]
+    print(encode(fromList(epcs)).hex(','))
+    print(decodeList(encode(fromList(epcs))) == epcs)
+    print(decodeMany({('192.168.0.2', 0x029001): f1, ('192.168.0.3', 0x013001): f2}))
@@ -0,0 +1,120 @@
+#!/usr/bin/python3
+"""!
+@file ELRecvQueue.py
+@brief 受信とフレーム処理の間に置く上限付きの列
+@author SUGIMURA Hiroshi, Kanagawa Institute of Technology
+@date 2023年度
+@details 一杯の時は、古いものを捨てる、新しいものを捨てる、入れる側を止める、のいずれかにする。
+捨てた数と最大の長さを数えておき、バッファサイズの見積もりに使う
+"""
+import threading
+import collections
+
+
+class ELRecvQueue():
+    """!
+    @brief ELRecvQueueクラス
+    @note BLOCKでもput()は待たない。受信ループで待つとタイマも止まるので、一杯になったらpausedを立て、
+    入れる側はそれを見て読むのをやめる。lowWaterまで減ったらresume()を呼ぶので、そこで読むのを再開する
+    """
+    DROP_OLDEST = 'drop-oldest' # 一杯なら一番古いものを捨てて入れる
+    DROP_NEWEST = 'drop-newest' # 一杯なら入れようとしたものを捨てる
+    BLOCK = 'block'             # 一杯ならpausedを立て、lowWaterまで減るまで入れる側に止まってもらう
+    POLICIES = (DROP_OLDEST, DROP_NEWEST, BLOCK)
+
+    def __init__(self, size:int = 1024, policy:str = DROP_OLDEST, lowWater:int|None = None, resume = None):
+        """!
+        @brief コンストラクタ
+        @param size int = 1024 上限
+        @param policy str = DROP_OLDEST  DROP_OLDEST, DROP_NEWEST, BLOCK
+        @param lowWater int|None = None  BLOCKで止めた後、再開する長さ。Noneならsizeの半分
+        @param resume func() = None  BLOCKで止めた後、lowWaterまで減った時にget()したスレッドから呼ぶ
+        """
+        if policy not in ELRecvQueue.POLICIES:
+            raise ValueError('ELRecvQueue: unknown policy ' + str(policy))
+        self.size = size
+        self.policy = policy
+        self.lowWater = size // 2 if lowWater == None else lowWater
+        self.resume = resume
+        self.items = collections.deque()
+        self.cond = threading.Condition()
+        self.closed = False
+        self.paused = False # BLOCKで一杯になった、lowWaterまで減ったら下ろす
+        self.stats:dict[str, int] = {'enqueued': 0, 'dequeued': 0, 'dropped': 0, 'highWater': 0}
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def put(self, item) -> bool:
+        """!
+        @brief 入れる、待たない
+        @param item 任意
+        @return bool  入れたらTrue、捨てたか閉じていたらFalse
+        @note BLOCKでは一杯でも入れてpausedを立てる。pausedを見てすぐ止まれば、上限を超えるのは一度にまとめて入れた分だけ
+        """
+        with self.cond:
+            if self.closed:
+                return False
+            if len(self.items) >= self.size:
+                if self.policy == ELRecvQueue.DROP_NEWEST:
+                    self.stats['dropped'] += 1
+                    return False
+                if self.policy == ELRecvQueue.DROP_OLDEST:
+                    self.items.popleft()
+                    self.stats['dropped'] += 1
+            self.items.append(item)
+            self.stats['enqueued'] += 1
+            if len(self.items) > self.stats['highWater']:
+                self.stats['highWater'] = len(self.items)
+            if self.policy == ELRecvQueue.BLOCK and len(self.items) >= self.size:
+                self.paused = True
+            self.cond.notify_all()
+            return True
+
+    def get(self):
+        """!
+        @brief 取り出す、空なら入るまで待つ
+        @return 入れたもの、閉じられたらNone
+        """
+        with self.cond:
+            self.cond.wait_for(lambda: self.items or self.closed)
+            if self.closed:
+                return None
+            item = self.items.popleft()
+            self.stats['dequeued'] += 1
+            resume = self.paused and len(self.items) <= self.lowWater
+            if resume:
+                self.paused = False
+        if resume and self.resume != None:
+            self.resume()
+        return item
+
+    def close(self):
+        """!
+        @brief 閉じる、待っているput, getは戻る。残っているものは捨てる
+        """
+        with self.cond:
+            self.closed = True
+            self.paused = False
+            self.items.clear()
+            self.cond.notify_all()
+
+    def open(self):
+        """!
+        @brief close()の後に再び使えるようにする
+        """
+        with self.cond:
+            self.closed = False
+
+
+if __name__ == '__main__':
+    print("===== ELRecvQueue.py 単体テスト")
+    for policy in ELRecvQueue.POLICIES[:2]:
+        q = ELRecvQueue(3, policy)
+        print(policy, [q.put(n) for n in range(0, 5)], [q.get() for _ in range(0, 3)], q.stats)
+    q = ELRecvQueue(2, ELRecvQueue.BLOCK, 0, lambda: print('resume'))
+    print(q.put('a'), q.paused, q.put('b'), q.paused)
+    print(q.get(), q.paused)
+    print(q.get(), q.paused, q.stats)
+    q.close()
+    print(q.get(), q.put('c'))
@@ -0,0 +1,253 @@
+#!/usr/bin/python3
+"""!
+@file ELSendScheduler.py
+@brief 宛先ごとのトークンバケットで送信の間隔を調整する
+@author SUGIMURA Hiroshi, Kanagawa Institute of Technology
+@date 2023年度
+@details 宛先ごとと全体のトークンバケットがどちらも空いている時だけ送る。
+優先度の列を持ち、制御コマンドを定期取得より先に送る。同じ優先度の中では宛先を順番に回す。
+宛先ごとのバケットは満杯に戻ったら捨てるので、宛先が多くても最近送った分しか持たない
+"""
+import time
+import threading
+import traceback
+import collections
+
+if __name__ == '__main__' and not __package__:  # unit test
+    from EchonetLite import EchonetLite
+elif __name__ == 'ELSendScheduler':  # 他のモジュールの単体テスト
+    from EchonetLite import EchonetLite
+else:
+    from EchonetLite.EchonetLite import EchonetLite
+
+
+class ELTokenBucket():
+    """!
+    @brief トークンバケット
+    """
+    __slots__ = ('rate', 'burst', 'tokens', 'last')
+
+    def __init__(self, rate:float, burst:float):
+        """!
+        @brief コンストラクタ
+        @param rate float 1秒あたりのトークン
+        @param burst float 最大のトークン、連続して送れる数
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+
+    def wait(self, now:float) -> float:
+        """!
+        @brief トークンを補充し、1つ使えるまでの秒数を返す
+        @param now float time.monotonic()
+        @return float 0なら今使える
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        """!
+        @brief トークンを1つ使う、wait()が0の時に呼ぶ
+        """
+        self.tokens -= 1
+
+
+class ELSendScheduler():
+    """!
+    @brief ELSendSchedulerクラス
+    @note 送信はEchonetLiteの受信ループの上で行うので、begin()してから使う
+    """
+    HIGH = 0   # 制御コマンド
+    NORMAL = 1
+    LOW = 2    # 定期取得、発見
+    LANES = ('high', 'normal', 'low')
+
+    def __init__(self, el:EchonetLite, rate:float = 10.0, burst:float = 3.0, globalRate:float = 200.0, globalBurst:float = 20.0):
+        """!
+        @brief コンストラクタ
+        @param el EchonetLite
+        @param rate float = 10.0 宛先ごとの1秒あたりの送信数
+        @param burst float = 3.0 宛先ごとに連続して送れる数
+        @param globalRate float = 200.0 全体の1秒あたりの送信数
+        @param globalBurst float = 20.0 全体で連続して送れる数
+        """
+        self.el = el
+        self.rate = rate
+        self.burst = burst
+        self.globalBucket = ELTokenBucket(globalRate, globalBurst)
+        self.buckets:dict[str, ELTokenBucket] = {} # ip -> 宛先ごとのバケット
+        self.sweepAt:float = 0.0 # 次に満杯のバケットを捨てる時刻
+        self.lanes:list[collections.OrderedDict] = [collections.OrderedDict() for _ in ELSendScheduler.LANES] # ip -> deque[(bytes, sent)]
+        self.lock = threading.Lock()
+        self.scheduled = False # pumpを予約済みか
+        self.stats:dict[str, int] = {'queued': 0, 'sent': 0, 'maxDepth': 0}
+
+    def submit(self, ip:str, message:bytes, priority:int = NORMAL, sent = None):
+        """!
+        @brief 送信を予約する
+        @param ip str  MULTICAST_GROUPならマルチキャスト
+        @param message bytes フレーム全体
+        @param priority int = NORMAL  HIGH, NORMAL, LOW
+        @param sent func(error:OSError|None) = None  送った直後に受信ループで呼ぶ、送れなければerrorが入る
+        """
+        with self.lock:
+            lane = self.lanes[priority]
+            queue = lane.get(ip)
+            if queue == None:
+                queue = lane[ip] = collections.deque()
+            queue.append( (bytes(message), sent) )
+            self.stats['queued'] += 1
+            depth = self.stats['queued'] - self.stats['sent']
+            if depth > self.stats['maxDepth']:
+                self.stats['maxDepth'] = depth
+            if self.scheduled:
+                return
+            self.scheduled = True
+        self.el.eventLoop.callLater(0, self.pump)
+
+    def sendFrame(self, ip:str, tid:int, seoj:int, deoj:int, esv:int, props, priority:int = NORMAL, sent = None):
+        """!
+        @brief フレームを組み立てて送信を予約する。EchonetLite.sendFrameと同じ引数
+        @param ip str
+        @param tid int 16bit
+        @param seoj int 24bit
+        @param deoj int 24bit
+        @param esv int
+        @param props iterable[tuple[int, bytes]]  (epc, edt)の並び
+        @param priority int = NORMAL
+        @param sent func(error:OSError|None) = None  submit()と同じ
+        """
+        with self.el.encoderLock:
+            message = bytes(self.el.encoder.encode(tid, seoj, deoj, esv, props))
+        self.submit(ip, message, priority, sent)
+
+    def depth(self) -> dict[str, int]:
+        """!
+        @brief 送信待ちの数
+        @return dict[str, int]  {'high': n, 'normal': n, 'low': n, 'total': n}
+        """
+        with self.lock:
+            res = {name: sum(len(q) for q in lane.values()) for name, lane in zip(ELSendScheduler.LANES, self.lanes)}
+        res['total'] = sum(res.values())
+        return res
+
+    def pump(self):
+        """!
+        @brief 送れるものを送り、残りがあれば次に送れる時刻に予約する内部関数
+        @note 優先度の高い列から見る。宛先のバケットが空なら同じ列の別の宛先を見る
+        """
+        with self.lock:
+            self.scheduled = False
+        retry = None
+        while True:
+            now = time.monotonic()
+            wait = self.globalBucket.wait(now)
+            if wait > 0:
+                retry = wait
+                break
+            item = self.pick(now)
+            if item == None:
+                break
+            ip, message, sent, wait = item
+            if message == None: # 宛先がすべて待ち
+                retry = wait
+                break
+            self.globalBucket.take()
+            error = None
+            try:
+                if ip == EchonetLite.MULTICAST_GROUP:
+                    self.el.sendMulti(message)
+                else:
+                    self.el.send(ip, message)
+            except OSError as e: # stats['sendErrors']で数えている
+                error = e
+            if sent != None:
+                try:
+                    sent(error)
+                except Exception:
+                    traceback.print_exc()
+        if retry != None:
+            with self.lock:
+                if self.scheduled:
+                    return
+                self.scheduled = True
+            self.el.eventLoop.callLater(retry, self.pump)
+
+    def pick(self, now:float) -> tuple | None:
+        """!
+        @brief 次に送るものを選ぶ内部関数
+        @param now float time.monotonic()
+        @return tuple | None  (ip, message, sent, 0)、すべての宛先が待ちなら(None, None, None, 待つ秒数)、空ならNone
+        """
+        wait = None
+        with self.lock:
+            if now >= self.sweepAt:
+                self.sweep(now)
+            for lane in self.lanes:
+                for ip, queue in lane.items():
+                    bucket = self.buckets.get(ip)
+                    if bucket == None:
+                        bucket = self.buckets[ip] = ELTokenBucket(self.rate, self.burst)
+                    w = bucket.wait(now)
+                    if w > 0:
+                        wait = w if wait == None else min(wait, w)
+                        continue
+                    bucket.take()
+                    message, sent = queue.popleft()
+                    del lane[ip]
+                    if queue: # 残りがあれば後ろに回す
+                        lane[ip] = queue
+                    self.stats['sent'] += 1
+                    return ip, message, sent, 0
+        if wait == None:
+            return None
+        return None, None, None, wait
+
+    def sweep(self, now:float):
+        """!
+        @brief 満杯に戻ったバケットを捨てる内部関数、lockを取った中で呼ぶ
+        @param now float time.monotonic()
+        @note 満杯のバケットは新しく作るのと同じなので、捨てても送信の間隔は変わらない。空から満杯に戻る時間ごとに見る
+        """
+        self.buckets = {ip: bucket for ip, bucket in self.buckets.items() if bucket.tokens + (now - bucket.last) * bucket.rate < bucket.burst}
+        self.sweepAt = now + self.burst / self.rate
+
+
+def fixedInterval(el:EchonetLite, interval:float) -> ELSendScheduler:
+    """!
+    @brief 宛先によらずinterval秒に1つずつ送るスケジューラを作る。ELFanout、ELDiscoveryの既定
+    @param el EchonetLite
+    @param interval float 秒、0以下なら間隔を空けない
+    @return ELSendScheduler
+    """
+    rate = 1.0 / interval if interval > 0 else 1e9
+    return ELSendScheduler(el, rate, 1.0, rate, 1.0)
+
+
+if __name__ == '__main__':
+    print("===== ELSendScheduler.py 単体テスト")
+    el = EchonetLite([[0x02, 0x90, 0x01]])
+    el.begin(None)
+    s = ELSendScheduler(el, rate=20, burst=2)
+    start = time.monotonic()
+    for n in range(0, 10):
+        s.sendFrame(el.LOCAL_ADDR, n, 0x05ff01, 0x029001, EchonetLite.GET, [(0x80, b'')], ELSendScheduler.LOW)
+    s.sendFrame(el.LOCAL_ADDR, 100, 0x05ff01, 0x029001, EchonetLite.SETI, [(0x80, b'\x30')], ELSendScheduler.HIGH)
+    print(s.depth())
+    while s.depth()['total']:
+        time.sleep(0.01)
+    print('%.2f' % (time.monotonic() - start), s.stats)
+    for n in range(0, 100): # 宛先が多くても、満杯に戻ったバケットは捨てる
+        s.sendFrame('192.0.2.%d' % (n + 100), n, 0x05ff01, 0x029001, EchonetLite.GET, [(0x80, b'')], ELSendScheduler.LOW)
+    while s.depth()['total']:
+        time.sleep(0.01)
+    print(len(s.buckets), end=' ')
+    time.sleep(s.burst / s.rate + 0.05)
+    s.sendFrame(el.LOCAL_ADDR, 200, 0x05ff01, 0x029001, EchonetLite.GET, [(0x80, b'')], ELSendScheduler.LOW, lambda error: print('sent', error, len(s.buckets)))
+    time.sleep(0.05)
+    el.stop()
@@ -0,0 +1,365 @@
+#!/usr/bin/python3
+"""!
+@file ELStateStore.py
+@brief 受信した機器のプロパティ値を覚えておく
+@author SUGIMURA Hiroshi, Kanagawa Institute of Technology
+@date 2023年度
+@details 機器オブジェクト(ip, EOJ)ごとに一つのbytearray(スラブ)を持ち、先頭のEPCの索引の後ろに
+受信時刻、版、EDTのレコードを詰めて並べる。プロパティごとのPythonオブジェクトを作らないので、
+16進数文字列の入れ子のdictに比べて1プロパティあたりのメモリが数分の1で、更新に文字列の変換がいらない。
+値が変わった時だけ、条件の合う購読者に知らせる
+"""
+import time
+import socket
+import struct
+import threading
+
+if __name__ == '__main__' and not __package__:  # unit test
+    from EchonetLite import EchonetLite
+    from ELFrame import ELFrame
+else:
+    from EchonetLite.EchonetLite import EchonetLite
+    from EchonetLite.ELFrame import ELFrame
+
+
+def packKey(ip:str, eoj:int, epc:int) -> int:
+    """!
+    @brief (ip, EOJ, EPC)を一つのintにする
+    @param ip str  IPv4
+    @param eoj int 24bit
+    @param epc int
+    @return int  ip(32bit), EOJ(24bit), EPC(8bit)の順に並べた64bit
+    """
+    return (int.from_bytes(socket.inet_aton(ip), 'big') << 32) | (eoj << 8) | epc
+
+
+def unpackKey(key:int) -> tuple[str, int, int]:
+    """!
+    @brief packKey()の逆
+    @param key int
+    @return tuple[str, int, int]  (ip, eoj, epc)
+    """
+    return socket.inet_ntoa((key >> 32).to_bytes(4, 'big')), (key >> 8) & 0xffffff, key & 0xff
+
+
+_INDEX = struct.Struct('>128H') # EPC(0x80-0xFF) -> スラブ内のレコードの位置、0はなし
+_OFFSET = struct.Struct('>H')
+_ENTRY = struct.Struct('>dIB') # 受信時刻, 版, EDTの長さ、この後ろにEDTが続く
+
+def readEntry(slab:bytes, epc:int) -> tuple[bytes, float, int] | None:
+    """!
+    @brief スラブからEPC 1つ分の値を読む
+    @param slab (bytes | bytearray)  snapshot()の値
+    @param epc int  0x80-0xFF
+    @return tuple[bytes, float, int] | None  (EDT, 受信時刻, 版)、なければNone
+    """
+    pos = _OFFSET.unpack_from(slab, (epc - 0x80) * 2)[0]
+    if pos == 0:
+        return None
+    ts, version, size = _ENTRY.unpack_from(slab, pos)
+    start = pos + _ENTRY.size
+    return bytes(slab[start:start + size]), ts, version
+
+def unpackSlab(slab:bytes):
+    """!
+    @brief スラブの値をEPCの順に読む
+    @param slab (bytes | bytearray)  snapshot()の値
+    @return generator  (epc, EDT, 受信時刻, 版)
+    """
+    for i, pos in enumerate(_INDEX.unpack_from(slab)):
+        if pos != 0:
+            ts, version, size = _ENTRY.unpack_from(slab, pos)
+            start = pos + _ENTRY.size
+            yield 0x80 + i, bytes(slab[start:start + size]), ts, version
+
+
+class ELStateStore():
+    """!
+    @brief ELStateStoreクラス
+    @details 値が変わった時だけ版を1進める。受信時刻は同じ値でも更新する。
+    EDTの長さが変わった時だけレコードを詰め直し、後ろのレコードの位置をずらす。
+    購読は(ip, クラス, EPC)の組、Noneは何でもよい、をキーにした表に入れ、変化1つにつき表を8回引くだけで購読者を探す
+    @note 読み書きともlockで守る。まとめて読む時はsnapshot()を使う
+    """
+    ESVS = (EchonetLite.GET_RES, EchonetLite.GET_SNA, EchonetLite.INF, EchonetLite.INFC) # 値が入っている応答と通知
+
+    def __init__(self):
+        """!
+        @brief コンストラクタ
+        """
+        self.slabs:dict[int, bytearray] = {} # packKey(ip, eoj, 0) -> 索引(uint16 x 128), レコード(受信時刻 time.time()(double), 版(uint32), EDTの長さ(uint8), EDT)...
+        self.count:int = 0 # プロパティの数
+        self.ips:dict[str, int] = {} # ip -> packKeyの上位32bit、変換の使い回し
+        self.lock = threading.Lock()
+        self.el:EchonetLite|None = None
+        self.subscriptions:dict[tuple, list] = {} # (ip|None, クラス(16bit)|None, EPC|None) -> [func]
+
+    def __len__(self) -> int:
+        return self.count
+
+    def base(self, ip:str, eoj:int) -> int:
+        """!
+        @brief (ip, EOJ)部分のキー、スラブのキーを作る内部関数
+        @param ip str
+        @param eoj int 24bit
+        @return int
+        """
+        high = self.ips.get(ip)
+        if high == None:
+            high = self.ips[ip] = int.from_bytes(socket.inet_aton(ip), 'big') << 32
+        return high | (eoj << 8)
+
+    def attach(self, el:EchonetLite):
+        """!
+        @brief EchonetLiteの応答と通知を受け取って覚えるようにする
+        @param el EchonetLite
+        """
+        self.detach()
+        self.el = el
+        el.addListener(self.receive)
+
+    def detach(self):
+        """!
+        @brief attach()をやめる
+        """
+        if self.el != None:
+            self.el.removeListener(self.receive)
+            self.el = None
+
+    def receive(self, frame:ELFrame):
+        """!
+        @brief フレームの値を覚える。attach()していれば受信スレッドから呼ばれる
+        @param frame ELFrame
+        @note PDC=0のプロパティ(取れなかったもの)と、EPCが0x80未満のものは覚えない。
+        値の入っている部分はESV_TABLEのレイアウトで決まる、INFCは要求なのでGETの部分に入っている
+        """
+        if frame.esv not in ELStateStore.ESVS:
+            return
+        base = self.base(frame.ip, frame.seoj)
+        data = frame.data
+        now = time.time()
+        changes = []
+        with self.lock:
+            for section in EchonetLite.ESV_TABLE[frame.esv][0]:
+                for epc, pdc, end in frame.props[section]:
+                    if end > pdc + 1 and epc >= 0x80:
+                        edt = bytes(data[pdc + 1:end])
+                        version, old = self.put(base, epc, edt, now)
+                        if version != 0:
+                            changes.append( (epc, edt, old) )
+        if changes and self.subscriptions:
+            for epc, edt, old in changes:
+                self.notify(frame.ip, frame.seoj, epc, edt, old)
+
+    def update(self, ip:str, eoj:int, epc:int, edt:bytes, ts:float|None = None) -> int:
+        """!
+        @brief 値を1つ覚える
+        @param ip str
+        @param eoj int 24bit
+        @param epc int  0x80-0xFF
+        @param edt bytes  255バイトまで
+        @param ts float|None = None  受信時刻、Noneなら今
+        @return int 版
+        @exception ValueError  EPCかEDTの長さが範囲外
+        """
+        if not 0x80 <= epc <= 0xff or len(edt) > 0xff:
+            raise ValueError('ELStateStore: EPC must be 0x80-0xFF and EDT at most 255 bytes, got %02x (%d)' % (epc, len(edt)))
+        base = self.base(ip, eoj)
+        edt = bytes(edt)
+        with self.lock:
+            version, old = self.put(base, epc, edt, time.time() if ts == None else ts)
+            if version == 0:
+                return readEntry(self.slabs[base], epc)[2]
+        if self.subscriptions:
+            self.notify(ip, eoj, epc, edt, old)
+        return version
+
+    def put(self, base:int, epc:int, edt:bytes, ts:float) -> tuple[int, bytes | None]:
+        """!
+        @brief lockを取った中で値を覚える内部関数
+        @param base int  base()の値
+        @param epc int  0x80-0xFF
+        @param edt bytes  255バイトまで
+        @param ts float
+        @return tuple[int, bytes | None]  (新しい版, 前のEDT)、値が変わらなければ(0, None)
+        """
+        slab = self.slabs.get(base)
+        if slab == None:
+            slab = self.slabs[base] = bytearray(_INDEX.size)
+        at = (epc - 0x80) * 2
+        pos = _OFFSET.unpack_from(slab, at)[0]
+        if pos == 0: # 後ろに足す。レコードはすべて索引の後ろなので位置は0にならない
+            _OFFSET.pack_into(slab, at, len(slab))
+            slab += _ENTRY.pack(ts, 1, len(edt))
+            slab += edt
+            self.count += 1
+            return 1, None
+        _, version, size = _ENTRY.unpack_from(slab, pos)
+        start = pos + _ENTRY.size
+        old = bytes(slab[start:start + size])
+        if old == edt:
+            _ENTRY.pack_into(slab, pos, ts, version, size)
+            return 0, None
+        version += 1
+        if size == len(edt):
+            _ENTRY.pack_into(slab, pos, ts, version, size)
+            slab[start:start + size] = edt
+        else: # 長さが変わったので詰め直す
+            slab[pos:start + size] = _ENTRY.pack(ts, version, len(edt)) + edt
+            shift = len(edt) - size
+            _INDEX.pack_into(slab, 0, *[p + shift if p > pos else p for p in _INDEX.unpack_from(slab)])
+        return version, old
+
+    def subscribe(self, func, ip:str|None = None, cls:int|None = None, epc:int|None = None) -> tuple:
+        """!
+        @brief 値の変化を購読する
+        @param func func(ip:str, eoj:int, epc:int, edt:bytes, old:bytes|None)  oldは初めて受信した時None
+        @param ip str|None = None  Noneならすべての機器
+        @param cls int|None = None  クラス(EOJの上位16bit、0x0290など)、Noneならすべて
+        @param epc int|None = None  Noneならすべて
+        @return tuple  unsubscribe()に渡す
+        @note 受信スレッドで、lockを外してから呼ばれる
+        """
+        key = (ip, cls, epc)
+        with self.lock:
+            self.subscriptions[key] = self.subscriptions.get(key, []) + [func] # 知らせている間に書き換えないよう作り直す
+        return key, func
+
+    def unsubscribe(self, token:tuple):
+        """!
+        @brief subscribe()をやめる
+        @param token tuple  subscribe()の返り値
+        """
+        key, func = token
+        with self.lock:
+            funcs = [f for f in self.subscriptions.get(key, []) if f != func]
+            if funcs:
+                self.subscriptions[key] = funcs
+            else:
+                self.subscriptions.pop(key, None)
+
+    def notify(self, ip:str, eoj:int, epc:int, edt:bytes, old:bytes|None):
+        """!
+        @brief 条件の合う購読者に知らせる内部関数
+        @param ip str
+        @param eoj int
+        @param epc int
+        @param edt bytes
+        @param old bytes|None
+        """
+        subscriptions = self.subscriptions
+        cls = eoj >> 8
+        for i in (ip, None):
+            for c in (cls, None):
+                for e in (epc, None):
+                    funcs = subscriptions.get( (i, c, e) )
+                    if funcs != None:
+                        for func in funcs:
+                            func(ip, eoj, epc, edt, old)
+
+    def get(self, ip:str, eoj:int, epc:int) -> tuple[bytes, float, int] | None:
+        """!
+        @brief 値を1つ読む
+        @param ip str
+        @param eoj int 24bit
+        @param epc int
+        @return tuple[bytes, float, int] | None  (EDT, 受信時刻, 版)、知らなければNone
+        """
+        if not 0x80 <= epc <= 0xff:
+            return None
+        base = self.base(ip, eoj)
+        with self.lock:
+            slab = self.slabs.get(base)
+            return None if slab == None else readEntry(slab, epc)
+
+    def device(self, ip:str, eoj:int) -> dict[int, tuple[bytes, float, int]]:
+        """!
+        @brief 機器オブジェクト1つ分の値を読む
+        @param ip str
+        @param eoj int 24bit
+        @return dict[int, tuple[bytes, float, int]]  EPC -> (EDT, 受信時刻, 版)
+        """
+        base = self.base(ip, eoj)
+        with self.lock:
+            slab = self.slabs.get(base)
+            if slab == None:
+                return {}
+            return {epc: (edt, ts, version) for epc, edt, ts, version in unpackSlab(slab)}
+
+    def remove(self, ip:str, eoj:int|None = None):
+        """!
+        @brief 機器の値を忘れる
+        @param ip str
+        @param eoj int|None = None  Noneならそのipのすべて
+        """
+        high = self.base(ip, 0)
+        with self.lock:
+            if eoj == None:
+                keys = [key for key in self.slabs if (key >> 32) << 32 == high]
+            else:
+                keys = [high | (eoj << 8)]
+            for key in keys:
+                slab = self.slabs.pop(key, None)
+                if slab != None:
+                    self.count -= sum(1 for pos in _INDEX.unpack_from(slab) if pos != 0)
+
+    def snapshot(self) -> dict[int, bytes]:
+        """!
+        @brief その時点の値の写しを作る
+        @return dict[int, bytes]  packKey(ip, eoj, 0) -> スラブの写し、unpackSlab()かreadEntry()で読む
+        """
+        with self.lock:
+            return {base: bytes(slab) for base, slab in self.slabs.items()}
+
+    def items(self):
+        """!
+        @brief snapshot()を(ip, eoj, epc, edt, ts, version)で順に返す
+        @return generator
+        """
+        for base, slab in self.snapshot().items():
+            ip, eoj, _ = unpackKey(base)
+            for epc, edt, ts, version in unpackSlab(slab):
+                yield ip, eoj, epc, edt, ts, version
+
+
+if __name__ == '__main__':
+    print("===== ELStateStore.py 単体テスト")
+    s = ELStateStore()
+    print(hex(packKey('192.168.0.10', 0x029001, 0x80)), unpackKey(packKey('192.168.0.10', 0x029001, 0x80)))
+    print(s.update('192.168.0.10', 0x029001, 0x80, b'\x30'), s.update('192.168.0.10', 0x029001, 0x80, b'\x30'), s.update('192.168.0.10', 0x029001, 0x80, b'\x31'))
+    s.update('192.168.0.10', 0x029001, 0xb0, b'\x42')
+    s.update('192.168.0.11', 0x013001, 0x80, b'\x30')
+    print(s.device('192.168.0.10', 0x029001))
+    print(list(s.items()))
+    s.subscribe(lambda *args: print('changed', args), cls=0x0290, epc=0x80)
+    s.update('192.168.0.10', 0x029001, 0x80, b'\x31') # 変わらないので知らせない
+    s.update('192.168.0.10', 0x029001, 0x80, b'\x30')
+    s.update('192.168.0.10', 0x029001, 0xb0, b'\x43') # EPCが違う
+    # INFCの値も覚える、(EPC, PDCの位置, EDTの終端)はEchonetLite.scanLayout()と同じ
+    infc = bytes([0x10, 0x81, 0x00, 0x01, 0x02, 0x90, 0x01, 0x05, 0xff, 0x01, EchonetLite.INFC, 0x01, 0x80, 0x01, 0x31])
+    s.receive(ELFrame('192.168.0.10', infc, 1, 0x029001, 0x05ff01, EchonetLite.INFC, 1, ((), [(0x80, 13, 15)], ())))
+    print(s.device('192.168.0.10', 0x029001))
+    s.remove('192.168.0.10')
+    print(len(s))
+
+    # 機器800 x プロパティ32個で、16進数文字列の入れ子のdictとメモリを比べる
+    import tracemalloc
+    def addresses():
+        return ['192.168.%d.%d' % (i // 250, i % 250 + 1) for i in range(0, 800)]
+    tracemalloc.start()
+    facilities = {}
+    for i, ip in enumerate(addresses()):
+        props = facilities.setdefault(ip, {}).setdefault('029001', {})
+        for epc in range(0x80, 0xa0):
+            props['%02x' % epc] = '%08x' % (i * epc)
+    nested = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del facilities
+    tracemalloc.start()
+    s = ELStateStore()
+    for i, ip in enumerate(addresses()):
+        for epc in range(0x80, 0xa0):
+            s.update(ip, 0x029001, epc, (i * epc).to_bytes(4, 'big'))
+    slabs = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(len(s), 'dict: %.1f bytes/prop' % (nested / len(s)), 'ELStateStore: %.1f bytes/prop' % (slabs / len(s)))
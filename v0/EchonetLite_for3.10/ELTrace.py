@@ -0,0 +1,160 @@
+#!/usr/bin/python3
+"""!
+@file ELTrace.py
+@brief EchonetLiteの処理を観測するトレース機構
+@author SUGIMURA Hiroshi, Kanagawa Institute of Technology
+@date 2023年度
+@details 受信、検証、解析、振り分け、コールバック、送信の各メソッドを、インスタンス属性のラッパで置き換えてイベントを出す。
+installしなければEchonetLite側には何も入らないので、無効時のコストはない
+"""
+import logging
+import time
+
+
+def _frameFields(frame) -> dict:
+    return {'ip': frame.ip, 'tid': frame.tid, 'seoj': frame.seoj, 'deoj': frame.deoj, 'esv': frame.esv, 'opc': frame.opc}
+
+
+def _dispatchFields(name:str, args) -> dict:
+    details = args[1]
+    if 'SET' in details: # SETGETはdetails全体が渡る
+        details = details['SET'] | details['GET']
+    return _frameFields(args[0]) | {'epcs': list(details)}
+
+
+# トレース点 -> (対象メソッド名, イベントの項目を作る関数 func(メソッド名, 引数))
+POINTS:dict[str, tuple] = {
+    'receive':  (('returner',), lambda name, args: {'ip': args[0], 'size': len(args[1])}),
+    'verify':   (('verifyPacket', 'dropped'), lambda name, args: {'size': len(args[0])} if name == 'verifyPacket' else {'ip': args[0], 'size': len(args[1]), 'reason': args[2]}),
+    'parse':    (('scanLayout',), lambda name, args: {'layout': args[0], 'opc': args[1]}),
+    'dispatch': ((), _dispatchFields),
+    'callback': (('callUser',), lambda name, args: _frameFields(args[1]) | {'func': getattr(args[0], '__name__', repr(args[0])), 'epc': args[2]}),
+    'send':     (('send', 'sendMulti'), lambda name, args: {'size': len(args[0])} if name == 'sendMulti' else {'ip': args[0], 'size': len(args[1])}),
+    'setup':    ((), None), # 初期化の結果、置き換えるメソッドはなくEchonetLiteがemit()で出す
+}
+
+
+def logSink(logger:logging.Logger|None = None, level:int = logging.DEBUG):
+    """!
+    @brief loggingに流すsinkを作る
+    @param logger logging.Logger|None  Noneなら 'EchonetLite'
+    @param level int = logging.DEBUG
+    @return callable(event:dict)
+    @note イベントはextraの 'echonet' にも入れるので、Filterなどで構造のまま取り出せる
+    """
+    if logger == None:
+        logger = logging.getLogger('EchonetLite')
+    def sink(event:dict):
+        if logger.isEnabledFor(level):
+            logger.log(level, '%s %s() %s', event['point'], event['method'], event['fields'], extra={'echonet': event})
+    return sink
+
+
+def printSink(event:dict):
+    """!
+    @brief 標準出力に出すsink、options['debug']で使う
+    @param event dict
+    """
+    error = ' error=' + repr(event['error']) if 'error' in event else ''
+    print('# EchonetLite.%s() %s %s result=%r %.6fs%s' % (event['method'], event['point'], event['fields'], event['result'], event['elapsed'], error))
+
+
+class ELTrace():
+    """!
+    @brief ELTraceクラス
+    @details sinkには次のdictが渡る
+    {'point': str, 'method': str, 'fields': dict, 'result': any, 'time': float, 'elapsed': float[, 'error': Exception]}
+    """
+
+    def __init__(self, sink = None, points = None):
+        """!
+        @brief コンストラクタ
+        @param sink callable(event:dict)|None  NoneならlogSink()
+        @param points iterable[str]|None  有効にするトレース点、NoneならPOINTSすべて
+        """
+        self.sink = sink if sink != None else logSink()
+        self.points = tuple(POINTS) if points == None else tuple(points)
+        self.installed:list[str] = []
+
+    def install(self, el):
+        """!
+        @brief EchonetLiteのメソッドをラッパで置き換える
+        @param el EchonetLite
+        @note 'dispatch'はESV_TABLEに登録された返答処理すべてが対象
+        """
+        self.uninstall(el)
+        for point in self.points:
+            names, fields = POINTS[point]
+            if point == 'dispatch':
+                names = sorted(set(rule[1] for rule in el.ESV_TABLE.values() if rule[1] != None))
+            for name in names:
+                setattr(el, name, self.wrap(point, name, getattr(type(el), name).__get__(el), fields))
+                self.installed.append(name)
+
+    def uninstall(self, el):
+        """!
+        @brief installしたラッパを外し、クラスのメソッドに戻す
+        @param el EchonetLite
+        """
+        for name in self.installed:
+            el.__dict__.pop(name, None)
+        self.installed = []
+
+    def emit(self, point:str, name:str, fields:dict):
+        """!
+        @brief メソッドを置き換えずに、イベントを1つ出す
+        @param point str トレース点、有効でなければ何もしない
+        @param name str メソッド名
+        @param fields dict
+        """
+        if point in self.points:
+            self.sink({'point': point, 'method': name, 'fields': fields, 'result': None, 'time': time.time(), 'elapsed': 0.0})
+
+    def wrap(self, point:str, name:str, method, fields):
+        """!
+        @brief メソッドの前後でイベントを出すラッパを作る内部関数
+        @param point str トレース点
+        @param name str メソッド名
+        @param method 束縛済みメソッド
+        @param fields func(name, args) 引数からイベントの項目を作る関数
+        @return callable
+        """
+        sink = self.sink
+        def traced(*args, **kwargs):
+            start = time.perf_counter()
+            event = {'point': point, 'method': name, 'fields': fields(name, args), 'result': None, 'time': time.time()}
+            try:
+                event['result'] = method(*args, **kwargs)
+                return event['result']
+            except Exception as e:
+                event['error'] = e
+                raise
+            finally:
+                event['elapsed'] = time.perf_counter() - start
+                sink(event)
+        return traced
+
+
+if __name__ == '__main__':
+    print("===== ELTrace.py 単体テスト")
+    class Dummy():
+        ESV_TABLE = {0x62: ((1,), 'replyGetDetail', 'GET')}
+        def send(self, ip, message):
+            return len(message)
+        def sendMulti(self, message, everywhere=False):
+            return len(message)
+        def replyGetDetail(self, frame, details):
+            return True
+    events = []
+    d = Dummy()
+    trace = ELTrace(events.append, ['send', 'dispatch'])
+    trace.install(d)
+    d.send('192.168.0.2', b'\x10\x81')
+    d.sendMulti(b'\x10\x81\x00')
+    d.sendMulti(b'\x10\x81', True) # 引数の数でなくメソッド名で項目を決める
+    trace.emit('setup', '__init__', {'localAddress': '192.168.0.1'}) # 有効にしていないので出ない
+    print([(e['point'], e['method'], e['fields'], e['result']) for e in events])
+    printSink(events[0])
+    trace.uninstall(d)
+    d.send('192.168.0.2', b'')
+    print(len(events), 'send' in d.__dict__)
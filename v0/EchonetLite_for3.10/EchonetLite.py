@@ -10,19 +10,49 @@
 import platform
 import socket
 import binascii
-if platform.system() == 'Linux':
-    import ipget  #  インストール必要, for Linux
 import threading
+import traceback
 import struct
 import uuid
+import concurrent.futures
 import re
 
-if __name__ == '__main__':
+if __name__ == '__main__' and not __package__:  # unit test
+    from PDCEDT import PDCEDT
+    from ELOBJ import ELOBJ
+    from ELDecoder import decodeHeader, scanProperties
+    from ELEncoder import ELEncoder, toInt, toPDCEDT
+    from ELFrame import ELFrame
+    from ELTrace import ELTrace, printSink
+    from ELLoop import ELLoop
+    from ELDispatcher import ELDispatcher
+    from ELRecvQueue import ELRecvQueue
+    from ELInterface import ELInterface, localAddress, arrivalAddress, PKTINFO, PKTINFO_SPACE, IP_PKTINFO
+    import ELPropertyMap
+elif __name__ == 'EchonetLite':  # 他のモジュールの単体テスト
     from PDCEDT import PDCEDT
     from ELOBJ import ELOBJ
+    from ELDecoder import decodeHeader, scanProperties
+    from ELEncoder import ELEncoder, toInt, toPDCEDT
+    from ELFrame import ELFrame
+    from ELTrace import ELTrace, printSink
+    from ELLoop import ELLoop
+    from ELDispatcher import ELDispatcher
+    from ELRecvQueue import ELRecvQueue
+    from ELInterface import ELInterface, localAddress, arrivalAddress, PKTINFO, PKTINFO_SPACE, IP_PKTINFO
+    import ELPropertyMap
 else:
     from EchonetLite.PDCEDT import PDCEDT
     from EchonetLite.ELOBJ import ELOBJ
+    from EchonetLite.ELDecoder import decodeHeader, scanProperties
+    from EchonetLite.ELEncoder import ELEncoder, toInt, toPDCEDT
+    from EchonetLite.ELFrame import ELFrame
+    from EchonetLite.ELTrace import ELTrace, printSink
+    from EchonetLite.ELLoop import ELLoop
+    from EchonetLite.ELDispatcher import ELDispatcher
+    from EchonetLite.ELRecvQueue import ELRecvQueue
+    from EchonetLite.ELInterface import ELInterface, localAddress, arrivalAddress, PKTINFO, PKTINFO_SPACE, IP_PKTINFO
+    from EchonetLite import ELPropertyMap
 
 
 class EchonetLite():
@@ -35,6 +65,9 @@ class EchonetLite():
     MULTICAST_GROUP='224.0.23.0' # マルチキャストアドレス
     ECHONETport = 3610 # ECHONET Liteの規格port
     BUFFER_SIZE = 1500 # 受信バッファサイズ 、UDP なので1500あればよいでしょう
+    RECV_BURST = 64 # 受信ループが一度に読む最大数、タイマなどを待たせすぎないため
+    MAX_PEERS = 4096 # peers, routesに覚える相手の最大数、超えたら古いものから忘れる
+    GET_CACHE_SIZE = 256 # GET返答キャッシュの最大エントリ数、超えたら全部捨てる
     EHD1 = 0			# EHD1
     EHD2 = 1			# EHD2
     TID = 2			    # TID 2 byte
@@ -69,30 +102,64 @@ class EchonetLite():
         """!
         @brief コンストラクタ
         @param eojs eoj[3]の配列、指定がなければコントローラとする
-        @param options デフォルトNone, future reserved
+        @param options デフォルトNone, {'debug': bool, 'frame': bool, 'trace': bool|callable, 'batch': int, 'dispatch': str|ELDispatcher, 'workers': int, 'queue': int, 'policy': str, 'rcvbuf': int, 'interfaces': list[str]}
         @note eojsは一つの場合でも次のように配列として定義する [ EchonetLite.EOJ_Controller ]
+        @note 'frame'をTrueにすると、ユーザのコールバックは func(frame:ELFrame, epc:int, pdcedt:PDCEDT) の形で呼ばれる
+        @note 'batch'に個数を指定すると、その数の受信バッファを確保し、溜まっている受信データをまとめて読む。
+        この場合ELFrame.dataは受信バッファを指すので、コールバックの外で使うならコピーすること
+        @note 'dispatch'に'thread'か'process'かELDispatcherを指定すると、ユーザのコールバックは受信スレッドでなくプールで実行する（'workers'は並列数）。
+        同じ送信元(ip, SEOJ)からのフレームのコールバックは受信順に実行する。この場合SETの返答はコールバックを待たず、SETプロパティマップで決める
+        @note 'queue'に上限を指定すると、受信と解析の間に列を置き、解析は別スレッドで行う。'policy'は一杯の時の扱いで
+        'drop-oldest'(既定), 'drop-newest', 'block'。'block'では一杯になったら受信ソケットを読むのをやめ、半分まで減ったら再開する(その間はOSの受信バッファに溜まる)。
+        統計はrqueue.stats。'rcvbuf'は受信ソケットのSO_RCVBUF
+        @note 'interfaces'に ['192.168.1.10/24', '10.0.0.5/16'] のようにインタフェースのアドレスを並べると、それぞれでマルチキャストに参加し、
+        相手のサブネットに合うインタフェースから送る。省略すると既定のインタフェースだけを使う
+        @note 'trace'をTrueにするとloggingに、関数を渡すとその関数にトレースイベントを渡す。'debug'は標準出力に出す
         """
         # optionsを内部に保持
         self.debug = False
+        self.frameCallback = False
+        self.rpool:list[bytearray] = [] # まとめて受信する時の受信バッファ
+        self.dispatcher:ELDispatcher|None = None # コールバックを実行するプール、Noneなら受信スレッドで実行
+        self.rqueue:ELRecvQueue|None = None # 受信と解析の間の列、Noneなら受信スレッドで解析
+        rcvbuf = 0
+        self.tracer:ELTrace|None = None
         if options:
-            if options["debug"] == True:
+            if options.get("debug") == True:
                 self.debug = True
-
-        print("# EchonetLite.init()") if self.debug else '' # debug
+            if options.get("frame") == True:
+                self.frameCallback = True
+            if options.get("batch"):
+                self.rpool = [bytearray(EchonetLite.BUFFER_SIZE) for _ in range(0, options["batch"])]
+            dispatch = options.get("dispatch")
+            if isinstance(dispatch, ELDispatcher):
+                self.dispatcher = dispatch
+            elif dispatch == 'thread' or dispatch == 'process':
+                self.dispatcher = ELDispatcher(options.get("workers", 4), dispatch == 'process')
+            if options.get("queue"):
+                self.rqueue = ELRecvQueue(options["queue"], options.get("policy", ELRecvQueue.DROP_OLDEST), resume=self.onQueueDrained)
+            rcvbuf = options.get("rcvbuf", 0)
 
         # ip 設定
-        if platform.system() == 'Linux': # for Linux
-            localIP = ipget.ipget()
-            # print(localIP.ipaddr("wlan0"))
-            self.LOCAL_ADDR = str(localIP.ipaddr("wlan0")).split('/')[0] # for Linux
-        elif platform.system() == 'Darwin': # mac
-            self.LOCAL_ADDR = socket.gethostbyname(socket.gethostname()) # for mac
+        self.interfaces:list[ELInterface] = [ELInterface(spec) for spec in (options.get("interfaces") or [] if options else [])]
+        self.peers:dict[str, ELInterface|None] = {} # 受信した相手のIP -> インタフェース、interfaces指定時のみ。自分自身はNone。MAX_PEERSまで
+        self.routes:dict[str, ELInterface|None] = {} # 送信先のIP -> インタフェース、受信したインタフェースか調べた結果を覚えておく。MAX_PEERSまで
+        self.byAddress:dict[str, ELInterface] = {iface.address: iface for iface in self.interfaces}
+        self.pktinfo:bool = False # 受信したインタフェースをIP_PKTINFOで知るか
+        self.activeInterfaces:list[ELInterface] = [] # ECHONET Liteの相手がいるインタフェース
+        if self.interfaces:
+            self.LOCAL_ADDR = self.interfaces[0].address
         else:
-            self.LOCAL_ADDR = socket.gethostbyname(socket.gethostname()) # for windows
+            self.LOCAL_ADDR = localAddress()
 
-        print("# Local IP:", self.LOCAL_ADDR) if self.debug else '' # debug
         self.mac:list[int] = self.getHwAddr()
         self.tid:list[int] = [0,0]
+        self.tidLock = threading.RLock() # tidの更新用、複数スレッドから要求を送ってよい
+        self.encoder = ELEncoder(EchonetLite.BUFFER_SIZE) # 送信フレームの組み立て用、使い回す
+        self.encoderLock = threading.Lock()
+        self.responseHooks:dict[int, object] = {} # TID -> func(frame:ELFrame)、要求以外(応答、通知)を受けた時に呼ぶ。応答待ち用
+        self.listeners:list = [] # func(frame:ELFrame)、応答と通知(INFCも)のフレームをすべて渡す。発見など用、addListener()で追加する
+        self.getCache:dict[tuple, tuple[bytearray, ELOBJ, int]] = {} # (DEOJ, EPCのtuple) -> (返答フレーム, ELOBJ, ELOBJ.version)、encoderLockで保護
         self.devices:Dict[str, ELOBJ] = {}
         self.userSetFunc = self.dummyFuncion
         self.userGetFunc = self.dummyFuncion
@@ -139,42 +206,151 @@ class EchonetLite():
         self.devices[k].SetMyPropertyMap(0x9e, [0x80])																			# set property map
         self.devices[k].SetMyPropertyMap(0x9f, [0x80, 0x82, 0x83, 0x88, 0x8a, 0x9d, 0x9e, 0x9f, 0xd3, 0xd4, 0xd5, 0xd6, 0xd7]) # get property map
 
-        self.println() if self.debug else '' # debug
+        self.objects:dict[int, ELOBJ] = {}  # EOJ(24bit) -> ELOBJ
+        self.classIndex:dict[int, tuple[int, ...]] = {}  # クラス(16bit) -> EOJのtuple、インスタンス0宛の展開用
+        self.buildRegistry()
+
+        # トレース、指定がなければ何も差し込まない
+        trace = options.get("trace") if options else None
+        if trace == True:
+            self.setTrace(ELTrace())
+        elif callable(trace):
+            self.setTrace(ELTrace(trace))
+        elif self.debug:
+            self.setTrace(ELTrace(printSink))
+        if self.tracer != None: # 初期化の結果もトレースと同じ経路で出す
+            self.tracer.emit('setup', '__init__', {'localAddress': self.LOCAL_ADDR, 'interfaces': [str(iface) for iface in self.interfaces],
+                'objects': {'%06x' % eoj: {'%02x' % epc: pdcedt.getString() for epc, pdcedt in enumerate(obj.pdcedts) if pdcedt != None} for eoj, obj in self.objects.items()}})
 
         # 受信ソケットの準備
         self.rsock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.group = socket.inet_aton(EchonetLite.MULTICAST_GROUP)
-        self.mreq = struct.pack('4sL', self.group, socket.INADDR_ANY)
-        self.rsock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, self.mreq)
+        if self.interfaces:
+            for iface in self.interfaces:
+                iface.join(self.rsock, EchonetLite.MULTICAST_GROUP)
+        else:
+            self.mreq = struct.pack('4sL', self.group, socket.INADDR_ANY)
+            self.rsock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, self.mreq)
         self.rsock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.interfaces and PKTINFO:
+            try:
+                self.rsock.setsockopt(socket.IPPROTO_IP, IP_PKTINFO, 1)
+                self.pktinfo = True
+            except OSError: # 使えなければサブネットで決める
+                pass
+        if rcvbuf:
+            self.rsock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+
+        # 送信ソケットの準備、使い回す。sendtoは複数スレッドから同時に呼んでよい
+        self.ssock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.msock:socket.socket|None = None # interfaces指定時はインタフェースごとの送信ソケットを使う
+        if not self.interfaces:
+            self.msock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.msock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(self.LOCAL_ADDR))
+        self.stats:dict[str, int] = {'sent': 0, 'multiSent': 0, 'sentBytes': 0, 'sendErrors': 0} # 通信の統計
+        self.statsLock = threading.Lock()
+
+        # 受信ループ、begin()で動かす。利用者もregister, callLaterで使ってよい
+        self.eventLoop = ELLoop()
+        self.thread:threading.Thread|None = None
+        self.worker:threading.Thread|None = None # rqueueを使う場合の解析スレッド
+        self.receiving:bool = False # 受信ソケットを受信ループに登録しているか、受信ループのスレッドでだけ変える
 
     #  デストラクタ
     def __del__(self):
         """!
         @brief デストラクタ
         """
-        print("# EchonetLite.del()") if self.debug else '' # debug
         #  受信設定
+        self.eventLoop.close()
+        if self.dispatcher != None:
+            self.dispatcher.shutdown(False)
         self.rsock.close()
+        self.ssock.close()
+        if self.msock != None:
+            self.msock.close()
+        for iface in self.interfaces:
+            iface.close()
 
-    def dummyFuncion(self, ip:str, tid:list[int], seoj:list[int], deoj:list[int], esv:int, opc:int, epc:int, pdcedt:PDCEDT):
+    def dummyFuncion(self, *args):
         """!
         @brief ユーザのコールバックが指定されない場合のダミー関数
-        @param ip (str)
-        @param tid list[int]
-        @param seoj list[int]
-        @param deoj list[int]
-        @param esv int
-        @param opc int
-        @param epc int
-        @param pdcedt PDCEDT
+        @param args (ip, tid, seoj, deoj, esv, opc, epc, pdcedt) または (frame, epc, pdcedt)
         @return bool True固定
         """
-        print("# EchonetLite.dummyFunction()") if self.debug else '' # debug
-        if self.debug:
-            print('dummyFunction ', ip, tid, seoj, deoj, esv, opc, epc, pdcedt.printString())
         return True
 
+    def setTrace(self, tracer:ELTrace|None):
+        """!
+        @brief トレースを差し替える
+        @param tracer ELTrace|None  Noneならトレースを外す
+        """
+        if self.tracer != None:
+            self.tracer.uninstall(self)
+        self.tracer = tracer
+        if tracer != None:
+            tracer.install(self)
+
+    def dropped(self, ip:str, data, reason:str):
+        """!
+        @brief 受信フレームを捨てた時に呼ばれる内部関数、トレースの検証点
+        @param ip str
+        @param data memoryview
+        @param reason str  'HEADER', 'ESV', 'DEOJ', 'OPC'
+        """
+        pass
+
+    def callUser(self, func, frame:ELFrame, epc:int, pdcedt:PDCEDT):
+        """!
+        @brief ユーザのコールバックを呼ぶ内部関数
+        @param func ユーザ関数
+        @param frame ELFrame
+        @param epc int
+        @param pdcedt PDCEDT
+        @return ユーザ関数の戻り値、プールに投げた場合はNone
+        @note options['frame']がFalseなら従来通り8引数、list[int]で呼ぶ
+        """
+        if self.dispatcher != None:
+            if func == self.dummyFuncion: # 何もしないので投げない、プロセスプールではpickleもできない
+                return None
+            if self.frameCallback:
+                self.dispatcher.submit((frame.ip, frame.seoj), func, frame.detach(), epc, pdcedt)
+            else:
+                self.dispatcher.submit((frame.ip, frame.seoj), func, frame.ip, frame.tidList, frame.seojList, frame.deojList, frame.esv, frame.opc, epc, pdcedt)
+            return None
+        if self.frameCallback:
+            return func(frame, epc, pdcedt)
+        return func(frame.ip, frame.tidList, frame.seojList, frame.deojList, frame.esv, frame.opc, epc, pdcedt)
+
+    def checkCallbacks(self, *funcs):
+        """!
+        @brief ユーザのコールバックをプールに投入できるか調べる内部関数
+        @param funcs 調べる関数、Noneは飛ばす
+        @exception TypeError プロセスプールなのにモジュールの関数でない
+        """
+        if self.dispatcher == None:
+            return
+        for func in funcs:
+            if func != None:
+                self.dispatcher.check(func)
+
+    def acceptSet(self, frame:ELFrame, epc:int, pdcedt:PDCEDT) -> bool:
+        """!
+        @brief SET要求の1プロパティをユーザのコールバックに渡し、受け付けたかを返す内部関数
+        @param frame ELFrame
+        @param epc int
+        @param pdcedt PDCEDT
+        @return bool
+        @note コールバックをプールで実行する場合は結果を待たず、SETプロパティマップにあれば受け付けたとする
+        """
+        if self.userSetFunc == None:
+            return True
+        res = self.callUser(self.userSetFunc, frame, epc, pdcedt)
+        if self.dispatcher != None:
+            return self.objects[frame.deoj].hasSetProperty(epc)
+        return res != False
+
+
 
     def begin(self, sfunc, gfunc=None, ifunc=None):
         """!
@@ -183,26 +359,155 @@ class EchonetLite():
         @param gfunc Getの時に呼ばれる関数、設定しないならNoneでよい。省略すればNone
         @param ifunc 通知関係を受信した時に呼ばれる関数、設定しないならNoneでよい。省略すればNone
         """
-        print("# EchonetLite.begin()") if self.debug else '' # debug
+        self.checkCallbacks(sfunc, gfunc, ifunc)
         if sfunc != None:
             self.userSetFunc = sfunc
         if gfunc != None:
             self.userGetFunc = gfunc
         if ifunc != None:
             self.userInfFunc = ifunc
-        # 受信設定
-        self.rsock.bind(('', self.ECHONETport))
-        self.rsock.settimeout(1)
-        def recv():
-            while True:
-                try:
-                    data, ip = self.rsock.recvfrom(EchonetLite.BUFFER_SIZE)
-                    # bytesを16進数文字列に変換する
-                    self.returner(ip[0], list(data))
-                except socket.timeout:
-                    continue
-        self.thread = threading.Thread(target=recv, args=())
-        self.thread.start() #  受信スレッド開始
+        # 受信設定、stop()の後に再開する場合はbind済み
+        if self.rsock.getsockname()[1] == 0:
+            self.rsock.bind(('', self.ECHONETport))
+        self.rsock.setblocking(False)
+        self.eventLoop.join() # stop()した前の受信スレッドが後始末を終えるのを待つ
+        if self.rqueue != None:
+            self.rqueue.open()
+            self.worker = threading.Thread(target=self.processQueue, name='EchonetLite-worker')
+            self.worker.start() # 解析スレッド開始
+        self.receiving = True
+        self.eventLoop.register(self.rsock, self.onReceive)
+        self.thread = self.eventLoop.start('EchonetLite') #  受信スレッド開始
+        self.announce()
+
+
+    def stop(self):
+        """!
+        @brief 受信停止、受信スレッドはすぐに終わる。begin()で再開できる
+        """
+        self.eventLoop.callSoon(self.pauseReceive)
+        self.eventLoop.stop()
+        if self.rqueue != None:
+            self.rqueue.close()
+
+    def join(self, timeout:float|None = None):
+        """!
+        @brief 受信スレッド、解析スレッドの終了を待つ
+        @param timeout float|None 秒
+        """
+        self.eventLoop.join(timeout)
+        if self.worker != None:
+            self.worker.join(timeout)
+
+    def onReceive(self, sock:socket.socket):
+        """!
+        @brief 受信ソケットが読めるようになった時に受信ループから呼ばれる内部関数
+        @param sock socket.socket
+        @note 一度に処理するのは受信バッファの数かRECV_BURSTまで、残りは次に起きた時に処理する
+        """
+        rqueue = self.rqueue
+        if self.rpool:
+            batch = self.recvBatch()
+            if rqueue == None:
+                self.returnBatch(batch)
+            else: # 受信バッファは使い回すのでコピーして渡す
+                for ip, data in batch:
+                    rqueue.put( (ip, bytes(data)) )
+                if rqueue.paused:
+                    self.pauseReceive()
+            return
+        pktinfo = self.pktinfo
+        for _ in range(0, EchonetLite.RECV_BURST):
+            try:
+                if pktinfo:
+                    data, ancdata, _, ip = sock.recvmsg(EchonetLite.BUFFER_SIZE, PKTINFO_SPACE)
+                    if ip[0] not in self.peers:
+                        self.noteArrival(ip[0], ancdata)
+                else:
+                    data, ip = sock.recvfrom(EchonetLite.BUFFER_SIZE)
+            except (BlockingIOError, InterruptedError):
+                return
+            # bytesのまま解析する
+            if rqueue == None:
+                self.returner(ip[0], data)
+            else:
+                rqueue.put( (ip[0], data) )
+                if rqueue.paused: # 'block'で一杯になった、減るまで読まない
+                    self.pauseReceive()
+                    return
+
+    def pauseReceive(self):
+        """!
+        @brief 受信ソケットを受信ループから外す内部関数、受信ループのスレッドで呼ぶ
+        """
+        if self.receiving:
+            self.receiving = False
+            self.eventLoop.unregister(self.rsock)
+
+    def resumeReceive(self):
+        """!
+        @brief rqueueが減ったら受信ソケットを受信ループに戻す内部関数、受信ループのスレッドで呼ぶ
+        """
+        if not self.receiving and self.eventLoop.running and not self.rqueue.paused:
+            self.receiving = True
+            self.eventLoop.register(self.rsock, self.onReceive)
+
+    def onQueueDrained(self):
+        """!
+        @brief 'block'で止めた後、rqueueがlowWaterまで減った時に解析スレッドから呼ばれる内部関数
+        """
+        self.eventLoop.callSoon(self.resumeReceive)
+
+    def processQueue(self):
+        """!
+        @brief rqueueから取り出して解析する、解析スレッドの本体
+        @note rqueueが閉じられたら終わる
+        """
+        while True:
+            item = self.rqueue.get()
+            if item == None:
+                return
+            try:
+                self.returner(item[0], item[1])
+            except Exception:
+                traceback.print_exc()
+
+
+    def recvBatch(self) -> list[tuple[str, memoryview]]:
+        """!
+        @brief 受信ソケットに溜まっているデータを、受信バッファの数まで読む内部関数
+        @return list[tuple[str, memoryview]]  [(ip, data)]、dataは受信バッファのビュー
+        @note 受信ソケットはノンブロッキングにしておくこと。dataは次のrecvBatchで上書きされる
+        """
+        batch = []
+        pktinfo = self.pktinfo
+        for buf in self.rpool:
+            try:
+                if pktinfo:
+                    size, ancdata, _, addr = self.rsock.recvmsg_into([buf], PKTINFO_SPACE)
+                    if addr[0] not in self.peers:
+                        self.noteArrival(addr[0], ancdata)
+                else:
+                    size, addr = self.rsock.recvfrom_into(buf)
+            except (BlockingIOError, InterruptedError):
+                break
+            batch.append( (addr[0], memoryview(buf)[:size]) )
+        return batch
+
+    def returnBatch(self, batch:list[tuple[str, memoryview]]):
+        """!
+        @brief まとめて受信したデータを順に解析する内部関数
+        @param batch list[tuple[str, memoryview]]  [(ip, data)]
+        """
+        returner = self.returner
+        for ip, data in batch:
+            returner(ip, data)
+
+
+    def announce(self):
+        """!
+        @brief 起動時の通知、ノードプロファイルの動作状態とインスタンスリストをマルチキャストする
+        """
         # インスタンスリスト通知 D5
         seoj = self.EOJ_NodeProfile
         deoj = self.EOJ_NodeProfile
@@ -210,50 +515,129 @@ class EchonetLite():
             self.sendMultiOPC1(seoj, deoj, self.INF, 0x80, self.devices['0ef001'][0x80]) # ON通知
         if self.devices['0ef001'][0xd5] != None:
             self.sendMultiOPC1(seoj, deoj, self.INF, 0xd5, self.devices['0ef001'][0xd5]) # オブジェクトリスト通知
-        print("# EchonetLite.begin() end.") if self.debug else '' # debug
 
 
-    def update(self, obj:list[int]|str, epc:int, edt:list[int]):
+    def update(self, obj:list[int]|str|int, epc:int, edt:list[int]):
         """!
         @brief 保持しているオブジェクトのEPCに対応するEDTを更新する。更新した結果、INFプロパティならマルチキャスト送信もする
-        @param obj list[int]|str
+        @param obj list[int]|str|int
         @param epc int
         @param edt list[int]
         """
-        if type(obj) is list[int]:
-            obj = self.getHexString(obj)
-        elif type(obj) is list:
-            obj = self.getHexString(obj)
+        obj = toInt(obj)
 
         if epc == 0x9d or epc == 0x9e or epc == 0x9f:
-            self.devices[obj].SetMyPropertyMap(epc, edt)
+            self.objects[obj].SetMyPropertyMap(epc, edt)
         else:
-            self.devices[obj].SetEDT(epc, edt)
+            self.objects[obj].SetEDT(epc, edt)
             self.checkInfAndSend(obj, epc)
-        print("# EchonetLite.update() end.") if self.debug else '' # debug
+
 
 
     #  送信
     def send(self, ip:str, message:bytes| list[int]| str):
         """!
         @brief ECHOENT Lite のデータ送信
-        @param buffer (bytes|list[int]|str)
+        @param buffer (bytes|bytearray|memoryview|list[int]|str)
+        @note interfacesを指定していれば、相手から受信したインタフェースか、相手のサブネットに合うインタフェースから送る
         """
-        print("# EchonetLite.send()") if self.debug else '' # debug
-
         if type(message) is list:
             buffer = bytes(message)
         elif type(message) is str:
             buffer = binascii.unhexlify(message)
-        elif type(message) is bytes:
+        elif isinstance(message, (bytes, bytearray, memoryview)):
             buffer = message
         else:
             return
 
-        ssock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        ssock.sendto(buffer, (ip, self.ECHONETport))
-        ssock.close()
-        print("# EchonetLite.send() end.") if self.debug else '' # debug
+        sock = self.ssock
+        if self.interfaces:
+            iface = self.interfaceFor(ip)
+            if iface != None:
+                sock = iface.sock
+        self.sendto(sock, buffer, (ip, self.ECHONETport), 'sent')
+
+    def interfaceFor(self, ip:str) -> ELInterface | None:
+        """!
+        @brief 相手のIPアドレスに使うインタフェースを返す。受信したインタフェースが分かっていればそれ、なければサブネットで決める
+        @param ip str
+        @return ELInterface | None  どのサブネットにも合わなければNone
+        """
+        iface = self.routes.get(ip, False)
+        if iface == False:
+            iface = None
+            for i in self.interfaces:
+                if i.contains(ip):
+                    iface = i
+                    break
+            self.remember(self.routes, ip, iface)
+        return iface
+
+    def noteArrival(self, ip:str, ancdata:list):
+        """!
+        @brief IP_PKTINFOで分かった受信インタフェースを、その相手への経路として覚える内部関数
+        @param ip str
+        @param ancdata list  recvmsgの補助データ
+        @note 分からなければ何もしない。interfaceFor()がサブネットで決める
+        """
+        iface = self.byAddress.get(arrivalAddress(ancdata))
+        if iface != None and self.routes.get(ip) is not iface:
+            self.remember(self.routes, ip, iface)
+
+    def remember(self, table:dict, ip:str, iface:ELInterface|None) -> ELInterface|None|bool:
+        """!
+        @brief peers, routesに覚える内部関数、MAX_PEERSを超えたら一番古いものを忘れる
+        @param table dict
+        @param ip str
+        @param iface ELInterface|None
+        @return (ELInterface | None | bool)  忘れたもののインタフェース、忘れなかったらFalse
+        """
+        evicted = False
+        if len(table) >= EchonetLite.MAX_PEERS and ip not in table:
+            try:
+                evicted = table.pop(next(iter(table)))
+            except (KeyError, RuntimeError, StopIteration): # 他のスレッドが同時に書き換えた
+                pass
+        table[ip] = iface
+        return evicted
+
+    def notePeer(self, ip:str):
+        """!
+        @brief ECHONET Liteの相手を見つけた時に、どのインタフェースにいるかを覚える内部関数
+        @param ip str
+        @note 古い相手を忘れたら、そのインタフェースにまだ相手がいるか調べ直し、いなければactiveInterfacesから外す
+        """
+        if ip in self.byAddress: # 自分のマルチキャストが戻ってきた
+            self.remember(self.peers, ip, None)
+            return
+        iface = self.interfaceFor(ip)
+        evicted = self.remember(self.peers, ip, iface)
+        if isinstance(evicted, ELInterface) and evicted is not iface:
+            active = set(self.peers.values())
+            self.activeInterfaces = [i for i in self.activeInterfaces if i in active]
+        if iface != None and iface not in self.activeInterfaces:
+            self.activeInterfaces = self.activeInterfaces + [iface]
+
+
+
+    def sendto(self, sock:socket.socket, buffer, address:tuple[str, int], counter:str):
+        """!
+        @brief 送信ソケットで送り、統計を数える内部関数
+        @param sock socket.socket
+        @param buffer (bytes | bytearray | memoryview)
+        @param address tuple[str, int]
+        @param counter str  成功時に数えるstatsのキー
+        @note 送信エラーはstats['sendErrors']を数えてから、そのまま例外を上げる
+        """
+        try:
+            size = sock.sendto(buffer, address)
+        except OSError:
+            with self.statsLock:
+                self.stats['sendErrors'] += 1
+            raise
+        with self.statsLock:
+            self.stats[counter] += 1
+            self.stats['sentBytes'] += size
 
 
     def sendOPC1TID(self, ip:str, tid:list[int]| str, seoj:list[int] | str, deoj:list[int]| str, esv:int|str, epc:int| str, pdcedt:PDCEDT| str):
@@ -268,31 +652,11 @@ class EchonetLite():
         @param pdcedt (PDCEDT|str)
         @note detailsはkey=epc:int、value=PDCEDT()のdict
         """
-        print("# EchonetLite.sendOPC1TID()") if self.debug else '' # debug
-
-        if type(tid) is list:
-            tid = self.getHexString(tid)
+        with self.encoderLock:
+            self.encoder.begin(toInt(tid), toInt(seoj), toInt(deoj), toInt(esv))
+            self.encoder.addPDCEDT(toInt(epc), toPDCEDT(pdcedt))
+            self.send(ip, self.encoder.end())
 
-        if type(seoj) is list:
-            seoj = self.getHexString(seoj)
-
-        if type(deoj) is list:
-            deoj = self.getHexString(deoj)
-
-        if type(esv) is int:
-            esv = self.getHexString(esv)
-
-        if type(epc) is int:
-            epc = self.getHexString(epc)
-
-        if type(pdcedt) is PDCEDT:
-            pdcedt = pdcedt.getString()
-        elif type(pdcedt) is list:
-            pdcedt = self.getHexString(pdcedt)
-
-        smsg:str = '1081' + tid + seoj + deoj + esv + '01' + epc + pdcedt
-        self.send(ip, smsg)
-        print("# EchonetLite.send() sendOPC1TID.") if self.debug else '' # debug
 
     def sendOPC1(self, ip:str, seoj:list[int]|str, deoj:list[int]|str, esv:int|str, epc:int|str, pdcedt:PDCEDT|str):
         """!
@@ -305,9 +669,7 @@ class EchonetLite():
         @param pdcedt (PDCEDT|str)
         @note detailsはkey=epc:int、value=PDCEDT()のdict
         """
-        print("# EchonetLite.sendOPC1()") if self.debug else '' # debug
-        self.sendOPC1TID(ip, self.getTidString(), seoj, deoj, esv, epc, pdcedt)
-        print("# EchonetLite.sendOPC1() end.") if self.debug else '' # debug
+        self.sendOPC1TID(ip, self.tid, seoj, deoj, esv, epc, pdcedt)
 
 
     def sendDetails(self, ip:str, tid:list[int]|str, seoj:list[int]|str, deoj:list[int]|str, esv:int|str, opc:int|str, details:dict[int,PDCEDT]):
@@ -318,56 +680,61 @@ class EchonetLite():
         @param seoj (list[int]|str)
         @param deoj (list[int]|str)
         @param esv (int|str)
-        @param opc (int|str)
+        @param opc (int|str) 互換のため残している、実際はdetailsの個数を使う
         @param details (Dict[int,PDCEDT])
         @note detailsはkey=epc:int、value=PDCEDT()のdict
         """
-        print("# EchonetLite.sendDetails()") if self.debug else '' # debug
-        if type(tid) == list:
-            tid = self.getHexString(tid)
-
-        if type(seoj) == list:
-            seoj = self.getHexString(seoj)
-
-        if type(deoj) == list:
-            deoj = self.getHexString(deoj)
-
-        if type(esv) == int:
-            esv = self.getHexString(esv)
-
-        if type(opc) == int:
-            opc = self.getHexString(opc)
-
-        smsg = '1081' + tid + seoj + deoj + esv + opc
+        with self.encoderLock:
+            self.encoder.begin(toInt(tid), toInt(seoj), toInt(deoj), toInt(esv))
+            for epc in details:
+                self.encoder.addPDCEDT(epc, toPDCEDT(details[epc]))
+            buffer = self.encoder.end()
+
+            if ip == self.MULTICAST_GROUP:
+                self.sendMulti(buffer)
+            else:
+                self.send(ip, buffer)
 
-        for epc in details:
-            smsg += format(epc,'02x') + details[epc].getString()
+    def sendFrame(self, ip:str, tid:int, seoj:int, deoj:int, esv:int, props):
+        """!
+        @brief int, bytes指定の高速な送信API
+        @param ip str  MULTICAST_GROUPならマルチキャスト
+        @param tid int 16bit
+        @param seoj int 24bit
+        @param deoj int 24bit
+        @param esv int
+        @param props iterable[tuple[int, bytes]]  (epc, edt)の並び、EDTなしならb''
+        """
+        with self.encoderLock:
+            buffer = self.encoder.encode(tid, seoj, deoj, esv, props)
+            if ip == self.MULTICAST_GROUP:
+                self.sendMulti(buffer)
+            else:
+                self.send(ip, buffer)
 
-        if ip == self.MULTICAST_GROUP:
-            self.sendMulti(smsg)
-        else:
-            self.send(ip, smsg)
-        print("# EchonetLite.send() sendDetails.") if self.debug else '' # debug
 
-    def sendMulti(self, message:bytes|list[int]|str):
+    def sendMulti(self, message:bytes|list[int]|str, everywhere:bool = False):
         """!
         @brief マルチキャストの送信
-        @param message (bytes | list[int] | str)
+        @param message (bytes | bytearray | memoryview | list[int] | str)
+        @param everywhere bool = False  interfaces指定時、Trueならすべてのインタフェースから送る
+        @note interfaces指定時は、ECHONET Liteの相手がいるインタフェースからだけ送る。まだ誰もいなければすべてから送る
         """
-        print("# EchonetLite.sendMulti()") if self.debug else '' # debug
         if type(message) == list:
             buffer = bytes(message)
         elif type(message) == str:
             buffer = binascii.unhexlify(message)
-        elif type(message) == bytes:
+        elif isinstance(message, (bytes, bytearray, memoryview)):
             buffer = message
         else:
             return
 
-        ssock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        ssock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(self.LOCAL_ADDR))
-        ssock.sendto(buffer, (EchonetLite.MULTICAST_GROUP, EchonetLite.ECHONETport))
-        ssock.close()
+        if not self.interfaces:
+            self.sendto(self.msock, buffer, (EchonetLite.MULTICAST_GROUP, EchonetLite.ECHONETport), 'multiSent')
+            return
+        for iface in (self.interfaces if everywhere or not self.activeInterfaces else self.activeInterfaces):
+            self.sendto(iface.sock, buffer, (EchonetLite.MULTICAST_GROUP, EchonetLite.ECHONETport), 'multiSent')
+
 
 
     def sendMultiOPC1TID(self, tid:list[int]|str, seoj:list[int]|str, deoj:list[int]|str, esv:int|str, epc:int|str, pdcedt:PDCEDT|list[int]|str):
@@ -382,30 +749,11 @@ class EchonetLite():
         @param pdcedt (PDCEDT|str)
         @note detailsはkey=epc:int、value=PDCEDT()のdict
         """
-        print("# EchonetLite.sendMultiOPC1TID()") if self.debug else '' # debug
-        if type(tid) == list:
-            tid = self.getHexString(tid)
-
-        if type(seoj) == list:
-            seoj = self.getHexString(seoj)
-
-        if type(deoj) == list:
-            deoj = self.getHexString(deoj)
-
-        if type(esv) == int:
-            esv = self.getHexString(esv)
+        with self.encoderLock:
+            self.encoder.begin(toInt(tid), toInt(seoj), toInt(deoj), toInt(esv))
+            self.encoder.addPDCEDT(toInt(epc), toPDCEDT(pdcedt))
+            self.sendMulti(self.encoder.end())
 
-        if type(epc) == int:
-            epc = self.getHexString(epc)
-
-        if type(pdcedt) == PDCEDT:
-            pdcedt = pdcedt.getString()
-        elif type(pdcedt) == list:
-            pdcedt = self.getHexString(pdcedt)
-
-        smsg:str = '1081' + tid + seoj + deoj + esv + '01' + epc + pdcedt
-        self.sendMulti(smsg)
-        print("# EchonetLite.sendMultiOPC1TID() end.") if self.debug else '' # debug
 
 
     def sendMultiOPC1(self, seoj:list[int]|str, deoj:list[int]|str, esv:int|str, epc:int|str, pdcedt:PDCEDT|str):
@@ -419,11 +767,7 @@ class EchonetLite():
         @param pdcedt (PDCEDT|str)
         @note detailsはkey=epc:int、value=PDCEDT()のdict
         """
-        print("# EchonetLite.sendMultiOPC1()") if self.debug else '' # debug
-        tid = self.getTidString()
-        self.tidAutoIncrement()
-        self.sendMultiOPC1TID( tid, seoj, deoj, esv, epc, pdcedt)
-        print("# EchonetLite.sendMultiOPC1() end.") if self.debug else '' # debug
+        self.sendMultiOPC1TID( self.nextTid(), seoj, deoj, esv, epc, pdcedt)
 
     def sendGetPropertyMap(self, ip:str, eoj:list[int]|str):
         """!
@@ -438,97 +782,210 @@ class EchonetLite():
             pdcedts[0x9d] = PDCEDT([0])
             pdcedts[0x9e] = PDCEDT([0])
             pdcedts[0x9f] = PDCEDT([0])
-            self.sendDetails( ip, self.getTidString(), EchonetLite.EOJ_NodeProfile, eoj, EchonetLite.GET, 0x04, pdcedts)
+            self.sendDetails( ip, self.nextTid(), EchonetLite.EOJ_NodeProfile, eoj, EchonetLite.GET, 0x04, pdcedts)
         else:
             # デバイスオブジェクト
             pdcedts[0x9d] = PDCEDT([0])
             pdcedts[0x9e] = PDCEDT([0])
             pdcedts[0x9f] = PDCEDT([0])
-            self.sendDetails( ip, self.getTidString(), EchonetLite.EOJ_NodeProfile, eoj, EchonetLite.GET, 0x03, pdcedts)
-        self.tidAutoIncrement()
-        print("# EchonetLite.sendGetPropertyMap() end.") if self.debug else '' # debug
+            self.sendDetails( ip, self.nextTid(), EchonetLite.EOJ_NodeProfile, eoj, EchonetLite.GET, 0x03, pdcedts)
 
-    def replyGetDetail(self, ip:str, tid:list[int], seoj:list[int], deoj:list[int], esv:int, opc:int, details:dict):
+    def request(self, ip:str, seoj:int|list[int]|str, deoj:int|list[int]|str, esv:int|str, props, timeout:float = 3.0, retries:int = 2, scheduler = None, priority:int = 1) -> concurrent.futures.Future:
         """!
-        @brief Getに対して複数OPCに対応して返答する内部関数
-        @param ip (str)
-        @param tid (list[int])
-        @param seoj (list[int])
-        @param deoj (list[int])
-        @param esv (list[int])
-        @param opc (int)
-        @param details (dict)
-        @return bool
+        @brief 要求を送り、同じTIDの応答をFutureで受け取る
+        @param ip str  IPアドレス、MULTICAST_GROUPなら最初の応答を返す
+        @param seoj (int | list[int] | str)
+        @param deoj (int | list[int] | str)
+        @param esv (int | str)
+        @param props iterable[tuple[int, bytes]]  (epc, edt)の並び、EDTなしならb''
+        @param timeout float = 3.0 1回の応答を待つ秒数
+        @param retries int = 2 応答がない時に送り直す回数、同じTIDで送る
+        @param scheduler ELSendScheduler|None = None 指定すればこれを通して送る。応答待ちの時間は実際に送った時から数える
+        @param priority int = 1  schedulerに渡す優先度、ELSendScheduler.NORMAL
+        @return concurrent.futures.Future  結果はELFrame(SNAも含む)、応答がなければTimeoutError
+        @note 応答待ちに受信ループを使うので、begin()してから使う。結果はdetachしたフレーム
         """
-        print("# EchonetLite.replyGetDetail()") if self.debug else '' # debug
-        success = True
-        rep_details = {}  # 返信用のEPC,PDC,EDT[PDC]をすべて並べる
+        tid = self.nextTid()
+        seoj = toInt(seoj)
+        deoj = toInt(deoj)
+        esv = toInt(esv)
+        props = [(epc, bytes(edt)) for epc, edt in props]
+        future = concurrent.futures.Future()
+        timer = [None]
+        left = [retries]
+        def hook(frame:ELFrame):
+            if ip != EchonetLite.MULTICAST_GROUP and frame.ip != ip:
+                return
+            if self.responseHooks.pop(tid, None) is not hook: # 時間切れと同時に来た
+                return
+            if timer[0] != None: # schedulerで送った直後に来た
+                timer[0].cancel()
+            future.set_result(frame.detach())
+        def expire():
+            if self.responseHooks.get(tid) is not hook:
+                return
+            if left[0] > 0:
+                left[0] -= 1
+                send()
+                return
+            if self.responseHooks.pop(tid, None) is hook:
+                future.set_exception(TimeoutError('EchonetLite: no response from ' + ip))
+        def sent(error:OSError|None):
+            if error == None:
+                if self.responseHooks.get(tid) is hook:
+                    timer[0] = self.eventLoop.callLater(timeout, expire)
+            elif self.responseHooks.pop(tid, None) is hook:
+                future.set_exception(error)
+        def send():
+            if scheduler != None:
+                scheduler.sendFrame(ip, tid, seoj, deoj, esv, props, priority, sent)
+                return
+            timer[0] = self.eventLoop.callLater(timeout, expire)
+            try:
+                self.sendFrame(ip, tid, seoj, deoj, esv, props)
+            except OSError as e:
+                timer[0].cancel()
+                sent(e)
+        self.responseHooks[tid] = hook
+        send()
+        return future
+
+    def get(self, ip:str, deoj:int|list[int]|str, epcs:list[int], seoj:int|list[int]|str = EOJ_Controller, timeout:float = 3.0, retries:int = 2, scheduler = None, priority:int = 1) -> concurrent.futures.Future:
+        """!
+        @brief GETを送り、応答のプロパティをFutureで受け取る
+        @param ip str
+        @param deoj (int | list[int] | str)
+        @param epcs list[int]
+        @param seoj (int | list[int] | str) = EOJ_Controller
+        @param timeout float = 3.0
+        @param retries int = 2
+        @param scheduler ELSendScheduler|None = None
+        @param priority int = 1
+        @return concurrent.futures.Future  結果はdict[int, PDCEDT]、GET_SNAで取れなかったプロパティはPDC=0
+        """
+        return self.then(self.request(ip, seoj, deoj, EchonetLite.GET, [(epc, b'') for epc in epcs], timeout, retries, scheduler, priority), lambda frame: frame.details['INF'])
 
-        for epc in details:
-            devProp = self.replyGetDetail_sub(deoj, epc)
-            if devProp == None:
-                rep_details[epc] = PDCEDT([0]) # GetのエラーはPDC=0
-                success = False
+    def set(self, ip:str, deoj:int|list[int]|str, props:dict, seoj:int|list[int]|str = EOJ_Controller, timeout:float = 3.0, retries:int = 2, scheduler = None, priority:int = 1) -> concurrent.futures.Future:
+        """!
+        @brief SETCを送り、応答をFutureで受け取る
+        @param ip str
+        @param deoj (int | list[int] | str)
+        @param props dict[int, (list[int] | bytes)]  EPC -> EDT
+        @param seoj (int | list[int] | str) = EOJ_Controller
+        @param timeout float = 3.0
+        @param retries int = 2
+        @param scheduler ELSendScheduler|None = None
+        @param priority int = 1
+        @return concurrent.futures.Future  結果はbool、SET_RESならTrue、SETC_SNAならFalse
+        @note どのプロパティが受け付けられなかったかは request() のELFrameで見る。PDC=0が受け付けられたもの
+        """
+        return self.then(self.request(ip, seoj, deoj, EchonetLite.SETC, props.items(), timeout, retries, scheduler, priority), lambda frame: frame.esv == EchonetLite.SET_RES)
+
+    def addListener(self, func):
+        """!
+        @brief 応答と通知(INFCも含む)のフレームを受け取る関数を追加する
+        @param func func(frame:ELFrame)  受信スレッドで呼ばれる。frameを後で使うならdetach()すること
+        """
+        self.listeners = self.listeners + [func] # 受信スレッドが回している間に書き換えないよう作り直す
+
+    def removeListener(self, func):
+        """!
+        @brief addListener()で追加した関数を外す
+        @param func
+        """
+        self.listeners = [f for f in self.listeners if f != func]
+
+    def then(self, future:concurrent.futures.Future, func) -> concurrent.futures.Future:
+        """!
+        @brief futureの結果をfuncで変換したFutureを返す内部関数
+        @param future concurrent.futures.Future
+        @param func 変換する関数
+        @return concurrent.futures.Future
+        """
+        res = concurrent.futures.Future()
+        def done(f:concurrent.futures.Future):
+            error = f.exception()
+            if error != None:
+                res.set_exception(error)
             else:
-                rep_details[epc] = devProp
+                res.set_result(func(f.result()))
+        future.add_done_callback(done)
+        return res
 
-        if success == True:
-            esv = EchonetLite.GET_RES
-        else:
-            esv = EchonetLite.GET_SNA
+    def replyGetDetail(self, frame:ELFrame, details:dict) -> bool:
+        """!
+        @brief Getに対して複数OPCに対応して返答する内部関数
+        @param frame ELFrame  DEOJは返答するオブジェクトに展開済み
+        @param details dict
+        @return bool
+        """
+        key = (frame.deoj, tuple(details))
+        obj = self.objects[frame.deoj]
+        version = obj.version
+
+        with self.encoderLock:
+            cache = self.getCache.get(key)
+            if cache == None or cache[1] is not obj or cache[2] != version: # 未作成か、オブジェクトが差し替えられたか、対象のプロパティが変更された
+                self.encoder.begin(0, frame.deoj, 0, EchonetLite.GET_RES) # TIDとDEOJは後で埋める
+                for epc in details:
+                    devProp = self.replyGetDetail_sub(frame.deoj, epc)
+                    if devProp == None:
+                        self.encoder.add(epc) # GetのエラーはPDC=0
+                        self.encoder.buf[EchonetLite.ESV] = EchonetLite.GET_SNA
+                    else:
+                        self.encoder.addPDCEDT(epc, devProp.raw)
+                if len(self.getCache) >= EchonetLite.GET_CACHE_SIZE:
+                    self.getCache.clear()
+                cache = (bytearray(self.encoder.end()), obj, version)
+                self.getCache[key] = cache
+
+            # TIDと、DEOJ（要求元のSEOJ）だけ差し替える
+            buffer = cache[0]
+            struct.pack_into('>H', buffer, EchonetLite.TID, frame.tid)
+            struct.pack_into('>HB', buffer, EchonetLite.DEOJ, frame.seoj >> 8, frame.seoj & 0xff)
+            self.send(frame.ip, buffer)
+            success = buffer[EchonetLite.ESV] == EchonetLite.GET_RES
 
-        # SEOJとDEOJが入れ替わる
-        self.sendDetails(ip, tid, deoj, seoj, esv, opc, rep_details)
-        print("# EchonetLite.replyGetDetail() end.") if self.debug else '' # debug
         return success
 
-    def replyGetDetail_sub(self, eoj:list[int], epc:int) -> PDCEDT|None:
+
+    def replyGetDetail_sub(self, eoj:int|list[int], epc:int) -> PDCEDT|None:
         """!
         @brief EOJとEPCを指定した時、そのプロパティがあるかチェックする内部関数
-        @param ip str
-        @param seoj list[int]
+        @param eoj int|list[int]
         @param epc int
         @return PDCEDT | None そのプロパティのPDCEDT、存在しなければNone
         """
-        print("# EchonetLite.replyGetDetail_sub()") if self.debug else '' # debug
-        if( eoj==self.EOJ_NodeProfile ):
-            return self.devices['0ef001'][epc]
-        else:
-            for i in range(0, self.instanceNumber):
-                if eoj==self.eojs[i]:
-                    return self.devices[self.getHexString(eoj)][epc]
+        obj = self.objects.get(eoj if type(eoj) is int else toInt(eoj))
+        if obj == None:
             return None
+        return obj[epc]
 
 
-    def replySetDetail(self, ip:str, tid:list[int], seoj:list[int], deoj:list[int], esv:int, opc:int, details:dict):
+
+    def replySetDetail(self, frame:ELFrame, details:dict) -> bool:
         """!
         @brief Setに対して複数OPCに対応して返答する内部関数
-        @param ip (str)
-        @param tid (list[int])
-        @param seoj (list[int])
-        @param deoj (list[int])
-        @param esv (int)
-        @param opc (int)
-        @param details (dict)
+        @param frame ELFrame  DEOJは返答するオブジェクトに展開済み
+        @param details dict
         @return bool
         """
-        print("# EchonetLite.replySetDetail()") if self.debug else '' # debug
         success = True
         rep_details = {}  # 返信用のEPC,PDC,EDT[PDC]をすべて並べる
 
         for epc in details:
-            devProp = self.replySetDetail_sub(deoj, epc)
+            devProp = self.replySetDetail_sub(frame.deoj, epc)
             if devProp == None: # プロパティ無し
                 rep_details[epc] = details[epc] # Setのエラーは、元データを返却する
                 success = False
             else: # プロパティあり
-                if self.userSetFunc != None:
-                    if self.userSetFunc(ip, tid, seoj, deoj, esv, opc, epc, details[epc] ) == False:
-                        success = False
-                        rep_details[epc] = details[epc] # Setの失敗は要求の値を返却する
-                    else:
-                        rep_details[epc] = PDCEDT([0]) # Setの成功はPDC=0
+                if self.acceptSet(frame, epc, details[epc]) == False:
+                    success = False
+                    rep_details[epc] = details[epc] # Setの失敗は要求の値を返却する
+                else:
+                    rep_details[epc] = PDCEDT([0]) # Setの成功はPDC=0
 
+        esv = frame.esv
         if success == False and esv == self.SETI:
             esv = EchonetLite.SETI_SNA
         elif success == False and esv == self.SETC:
@@ -540,47 +997,37 @@ class EchonetLite():
             esv = EchonetLite.SET_RES
 
         # 返信用データはSEOJとDEOJが反転する
-        self.sendDetails(ip, tid, deoj, seoj, esv, opc, rep_details)
-        print("# EchonetLite.replySetDetail() end.") if self.debug else '' # debug
+        self.sendDetails(frame.ip, frame.tid, frame.deoj, frame.seoj, esv, frame.opc, rep_details)
         return success
 
 
-    def replySetDetail_sub(self, eoj:list[int], epc:int) -> PDCEDT | None:
+
+    def replySetDetail_sub(self, eoj:int|list[int], epc:int) -> PDCEDT|None:
         """!
         @brief EOJとEPCを指定した時、そのプロパティがあるかチェックする内部関数
-        @param ip (str)
-        @param eoj list[int]
+        @param eoj int|list[int]
         @param epc int
-        @return そのプロパティのPDCEDT、存在しなければNone
+        @return PDCEDT | None そのプロパティのPDCEDT、存在しなければNone
         """
-        print("# EchonetLite.replySetDetail_sub()") if self.debug else '' # debug
-        if( eoj==EchonetLite.EOJ_NodeProfile ):
-            return self.devices['0ef001'][epc]
-        else:
-            for i in range(0, self.instanceNumber):
-                if eoj==self.eojs[i]:
-                    return self.devices[self.getHexString(eoj)][epc]
+        obj = self.objects.get(eoj if type(eoj) is int else toInt(eoj))
+        if obj == None:
             return None
+        return obj[epc]
 
 
-    def replyInfreqDetail(self, ip:str, tid:list[int], seoj:list[int], deoj:list[int], esv:int, opc:int, details:dict):
+
+    def replyInfreqDetail(self, frame:ELFrame, details:dict) -> bool:
         """!
         @brief Inf_Reqに対して複数OPCに対応して返答する内部関数
-        @param ip (str)
-        @param tid list[int]
-        @param seoj list[int]
-        @param deoj list[int]
-        @param esv int
-        @param opc int
+        @param frame ELFrame  DEOJは返答するオブジェクトに展開済み
         @param details dict
         @return bool
         """
-        print("# EchonetLite.replyInfreqDetail()") if self.debug else '' # debug
         success = True
         rep_details = {}  # 返信用のEPC,PDC,EDT[PDC]をすべて並べる
 
         for epc in details:
-            devProp = self.replyInfreqDetail_sub(deoj, epc)
+            devProp = self.replyInfreqDetail_sub(frame.deoj, epc)
             if devProp == None:
                 rep_details[epc] = PDCEDT([0]) # GetのエラーはPDC=0
                 success = False
@@ -591,90 +1038,93 @@ class EchonetLite():
         if success == True:
             # 成功したらマルチキャストでINF
             esv = EchonetLite.INF
-            self.sendDetails(EchonetLite.MULTICAST_GROUP, tid, deoj, seoj, esv, opc, rep_details)
+            self.sendDetails(EchonetLite.MULTICAST_GROUP, frame.tid, frame.deoj, frame.seoj, esv, frame.opc, rep_details)
         else:
             # 失敗したらユニキャストでINF_SNA
             esv = EchonetLite.INF_SNA
-            self.sendDetails(ip, tid, deoj, seoj, esv, opc, rep_details)
-        print("# EchonetLite.replyInfreqDetail() end.") if self.debug else '' # debug
+            self.sendDetails(frame.ip, frame.tid, frame.deoj, frame.seoj, esv, frame.opc, rep_details)
 
         return success
 
 
-    def replyInfreqDetail_sub(self, eoj:list[int], epc:int) -> PDCEDT | None:
+
+    def replyInfreqDetail_sub(self, eoj:int|list[int], epc:int) -> PDCEDT|None:
         """!
         @brief EOJとEPCを指定した時、そのプロパティがあるかチェックする内部関数
-        @param ip (str)
-        @param seoj list[int]
+        @param eoj int|list[int]
         @param epc int
-        @return そのプロパティのPDCEDT、存在しなければNone
+        @return PDCEDT | None そのプロパティのPDCEDT、存在しなければNone
         """
-        print("# EchonetLite.replyInfreqDetail_sub()") if self.debug else '' # debug
-        if( eoj==EchonetLite.EOJ_NodeProfile ):
-            return self.devices['0ef001'][epc]
-        else:
-            for i in range(0, self.instanceNumber):
-                if eoj==self.eojs[i]:
-                    return self.devices[self.getHexString(eoj)][epc]
+        obj = self.objects.get(eoj if type(eoj) is int else toInt(eoj))
+        if obj == None:
             return None
+        return obj[epc]
 
 
 
-    def replySetgetDetail(self, ip:str, tid:list[int], seoj:list[int], deoj:list[int], esv:int, opc:int, details:dict):
+
+    def replySetgetDetail(self, frame:ELFrame, details:dict) -> bool:
         """!
         @brief SETGETに対して複数OPCに対応して返答する内部関数
-        @param ip (str)
-        @param tid list[int]
-        @param seoj list[int]
-        @param deoj list[int]
-        @param esv int
-        @param opc int
-        @param details dict
+        @param frame ELFrame  DEOJは返答するオブジェクトに展開済み
+        @param details dict  'SET'と'GET'を使う
         @return bool
+        @note SETを処理してからGETを読むので、GETには更新後の値が入る
         """
-        print("# EchonetLite.replySetgetDetail()") if self.debug else '' # debug
         success = True
-        rep_details = {}  # 返信用のEPC,PDC,EDT[PDC]をすべて並べる
+        set_details = {}  # 返信用のSET部分
+        get_details = {}  # 返信用のGET部分
 
-        for epc in details:
-            devProp = self.replyInfreqDetail_sub(deoj, epc)
+        for epc, pdcedt in details['SET'].items():
+            devProp = self.replySetDetail_sub(frame.deoj, epc)
+            if devProp == None: # プロパティ無し
+                set_details[epc] = pdcedt # Setのエラーは、元データを返却する
+                success = False
+            elif self.acceptSet(frame, epc, pdcedt) == False:
+                set_details[epc] = pdcedt # Setの失敗は要求の値を返却する
+                success = False
+            else:
+                set_details[epc] = PDCEDT([0]) # Setの成功はPDC=0
+
+        for epc in details['GET']:
+            devProp = self.replyGetDetail_sub(frame.deoj, epc)
             if devProp == None:
-                rep_details[epc] = PDCEDT([0]) # GetのエラーはPDC=0
+                get_details[epc] = PDCEDT([0]) # GetのエラーはPDC=0
                 success = False
             else:
-                rep_details[epc]=devProp
+                get_details[epc] = devProp
 
-        # SEOJとDEOJが入れ替わる
         if success == True:
-            # 成功したらマルチキャストでINF
-            esv = EchonetLite.INF
-            self.sendDetails(EchonetLite.MULTICAST_GROUP, tid, deoj, seoj, esv, opc, rep_details)
+            esv = EchonetLite.SETGET_RES
         else:
-            # 失敗したらユニキャストでINF_SNA
-            esv = EchonetLite.INF_SNA
-            self.sendDetails(ip, tid, deoj, seoj, esv, opc, rep_details)
-        print("# EchonetLite.replySetgetDetail() end.") if self.debug else '' # debug
+            esv = EchonetLite.SETGET_SNA
+
+        # SEOJとDEOJが入れ替わる、OPCSetとOPCGetの2部構成
+        with self.encoderLock:
+            self.encoder.begin(frame.tid, frame.deoj, frame.seoj, esv)
+            for epc, pdcedt in set_details.items():
+                self.encoder.addPDCEDT(epc, pdcedt.raw)
+            self.encoder.nextSection()
+            for epc, pdcedt in get_details.items():
+                self.encoder.addPDCEDT(epc, pdcedt.raw)
+            self.send(frame.ip, self.encoder.end())
         return success
 
 
-    def replyInfcDetail(self, ip:str, tid:list[int], seoj:list[int], deoj:list[int], esv:int, opc:int, details:dict):
+
+
+    def replyInfcDetail(self, frame:ELFrame, details:dict) -> bool:
         """!
         @brief INFCに対して複数OPCに対応して返答する内部関数
-        @param ip (str)
-        @param tid list[int]
-        @param seoj list[int]
-        @param deoj list[int]
-        @param esv int
-        @param opc int
+        @param frame ELFrame  DEOJは返答するオブジェクトに展開済み
         @param details dict
         @return bool
         """
-        print("# EchonetLite.replyInfcDetail()") if self.debug else '' # debug
         success = True
         rep_details = {}  # 返信用のEPC,PDC,EDT[PDC]をすべて並べる
 
         for epc in details:
-            devProp = self.replyInfreqDetail_sub(deoj, epc)
+            devProp = self.replyInfreqDetail_sub(frame.deoj, epc)
             if devProp == None:
                 rep_details[epc] = PDCEDT([0]) # GetのエラーはPDC=0
                 success = False
@@ -685,152 +1135,139 @@ class EchonetLite():
         if success == True:
             # 成功したらマルチキャストでINF
             esv = EchonetLite.INFC_RES
-            self.sendDetails(ip, tid, deoj, seoj, esv, opc, rep_details)
+            self.sendDetails(frame.ip, frame.tid, frame.deoj, frame.seoj, esv, frame.opc, rep_details)
         else:
             # 失敗したらユニキャストでINF_SNA
             esv = EchonetLite.INF_SNA
-            self.sendDetails(ip, tid, deoj, seoj, esv, opc, rep_details)
-        print("# EchonetLite.replyInfcDetail() end.") if self.debug else '' # debug
+            self.sendDetails(frame.ip, frame.tid, frame.deoj, frame.seoj, esv, frame.opc, rep_details)
         return success
 
 
+
     def returner(self, ip:str, data):
         """!
         @brief 受信データは内部で解析して、ライブラリユーザにコールバックする
         @param ip str
-        @param data list[int]
+        @param data (bytes | bytearray | memoryview | list[int])
         @return boolean  True=成功, False=失敗
+        @note ESVはESV_TABLEを一度引くだけで、検証と解析は一回の走査で済ませる
         """
-        print("# EchonetLite.returner()") if self.debug else '' # debug
-        if self.verifyPacket(data) == False: # これ以降の解析をする価値があるか？
-            # print("# returner() recv invalid data:", data) if self.debug else '' # debug
-            return # 解析する価値なし、Drop
-        # print("# returner() recv verified data:", data) if self.debug else '' # debug
-
-        # 受信データをまずは意味づけしておく
-        tid = data[EchonetLite.TID:EchonetLite.SEOJ]
-        seoj = data[EchonetLite.SEOJ:EchonetLite.DEOJ]
-        deoj = data[EchonetLite.DEOJ:EchonetLite.ESV]
-        esv = data[EchonetLite.ESV]
-        opc = data[EchonetLite.OPC]
-        details = self.parseDetails( esv, opc, data[EchonetLite.EPC:])
-
-        # print("tid:",tid, ", seoj:", seoj, ", deoj:", deoj, ", esv:", esv, ", opc:", opc)
-
-        # インスタンス0対応
-        instance_min = deoj[2]
-        instance_max = deoj[2] + 1
+        if type(data) is list:
+            data = bytes(data)
+        data = memoryview(data) # 以降スライスしてもコピーしない
+
+        #  パケットサイズが最小サイズを満たさない、EHDがおかしいならDrop
+        head = decodeHeader(data)
+        if head == None:
+            self.dropped(ip, data, 'HEADER')
+            return
+        tid, seoj, deoj, esv, opc = head
 
-        if deoj[2] == 0:
-            instance_min = 1
-            instance_max = self.instanceNumber + 1 # rangeは (min..<max) のようです
+        # 知らないESVならDrop
+        rule = EchonetLite.ESV_TABLE.get(esv)
+        if rule == None:
+            self.dropped(ip, data, 'ESV')
+            return
 
-        for i in range(instance_min, instance_max):
-            deoj[2] = i
+        # EPC部分が壊れていればDrop
+        props = self.scanLayout(rule[0], opc, data, EchonetLite.EPC)
+        if props == None:
+            self.dropped(ip, data, 'OPC')
+            return
+        if self.interfaces and ip not in self.peers: # 解析できたものだけ相手として覚える
+            self.notePeer(ip)
+        frame = ELFrame(ip, data, tid, seoj, deoj, esv, opc, props)
+        handler = rule[1]
+
+        # 応答待ちがあれば先に渡す、DEOJは問わない。INFCは返答も要るが通知なのでlistenersには渡す
+        if handler == None or esv == EchonetLite.INFC:
+            if handler == None and self.responseHooks:
+                hook = self.responseHooks.get(tid)
+                if hook != None:
+                    hook(frame)
+            for listener in self.listeners:
+                listener(frame)
+
+        # EOJ もってなければDrop、インスタンス0は保持しているオブジェクトに展開する
+        targets = self.resolveEOJ(deoj)
+        if len(targets) == 0:
+            self.dropped(ip, data, 'DEOJ')
+            return
+        details = frame.details
 
-            # デバイスオブジェクトあるか
-            if self.devices[ self.getHexString( deoj )] == None:
-                # ないのでDrop
-                print("# returner() invalid DEOJ:", deoj) if self.debug else '' # debug
-                continue
-            print("# returner() valid DEOJ:", deoj) if self.debug else '' # debug
+        for target_eoj in targets:
+            target = frame if target_eoj == deoj else frame.copy(target_eoj)
 
             # あればユーザ関数呼ぶ
             # SetはreplySetDetailの中で個別対応している
             if self.userGetFunc != None:
                 for epc in details['GET']:
-                    self.userGetFunc(ip, tid, seoj, deoj, esv, opc, epc, details['GET'][epc] )
+                    self.callUser(self.userGetFunc, target, epc, details['GET'][epc])
             if self.userInfFunc != None:
                 for epc in details['INF']:
-                    self.userInfFunc(ip, tid, seoj, deoj, esv, opc, epc, details['INF'][epc] )
-
-            if esv == EchonetLite.SETI:
-                #print('### SETI ###')
-                self.replySetDetail(ip, tid, seoj, deoj, esv, opc, details['SET'])
-            elif esv == EchonetLite.SETC:
-                #print('### SETC ###')
-                self.replySetDetail(ip, tid, seoj, deoj, esv, opc, details['SET'])
-            elif esv == EchonetLite.GET:
-                #print('### GETI ###')
-                self.replyGetDetail(ip, tid, seoj, deoj, esv, opc, details['GET'])
-            elif esv == EchonetLite.INF_REQ:
-                #print('### INF_REQ ###')
-                self.replyInfreqDetail(ip, tid, seoj, deoj, esv, opc, details['GET'])
-            elif esv == EchonetLite.SETGET:
-                #print('### SETGET ###')
-                self.replySetgetDetail(ip, tid, seoj, deoj, esv, opc, details)
-            elif esv == EchonetLite.INFC:
-                #print('### INFC ###')
-                self.replyInfcDetail(ip, tid, seoj, deoj, esv, opc, details['GET'])
-            #else:
-                # print('### Other ###')
-
-
-    def parseDetails(self, esv:int, opc:int, details:list[int]) -> dict:
+                    self.callUser(self.userInfFunc, target, epc, details['INF'][epc])
+
+            # 要求なら返答する
+            if handler != None:
+                getattr(self, handler)(target, details if rule[2] == None else details[rule[2]])
+
+
+
+
+    def scanLayout(self, layout:tuple[int, ...], opc:int, data, offset:int) -> tuple | None:
+        """!
+        @brief 解析レイアウトに従ってepc, pdc, edt部分の位置を調べる
+        @param layout tuple[int, ...]  格納先(0=SET, 1=GET, 2=INF)の並び、2つ目以降はOPCが前に付く
+        @param opc (int) 最初の部分のOPC
+        @param data (bytes | memoryview)  受信フレーム、またはEPC以下
+        @param offset (int) dataの中でEPCが始まる位置
+        @return tuple  SET, GET, INFそれぞれの [(epc, PDCの位置, EDTの終端)]、壊れていればNone
+        """
+        res = ([], [], [])
+        for n, section in enumerate(layout):
+            if n != 0: # SETGET系のOPCGet
+                if offset >= len(data):
+                    return None
+                opc = data[offset]
+                offset += 1
+            scanned = scanProperties(data, offset, opc)
+            if scanned == None:
+                return None
+            props, offset = scanned
+            res[section].extend(props)
+        return res
+
+    def scanDetails(self, esv:int, opc:int, data, offset:int = 0) -> tuple | None:
+        """!
+        @brief opcを見ながらepc, pdc, edt部分の位置を調べる
+        @param esv (int)
+        @param opc (int)
+        @param data (bytes | memoryview)  受信フレーム、またはEPC以下
+        @param offset (int) dataの中でEPCが始まる位置、デフォルト0
+        @return tuple  SET, GET, INFそれぞれの [(epc, PDCの位置, EDTの終端)]、壊れているか知らないESVならNone
+        """
+        rule = EchonetLite.ESV_TABLE.get(esv)
+        if rule == None:
+            return None
+        return self.scanLayout(rule[0], opc, data, offset)
+
+
+    def parseDetails(self, esv:int, opc:int, details, offset:int = 0) -> dict | None:
         """!
         @brief opcを見ながらepc, pdc, edt部分を解釈
         @param esv (int)
         @param opc (int)
-        @param details (list[byte])  EPC以下
-        @return list(pdcedt)
-        """
-        print("# EchonetLite.parseDetails()") if self.debug else '' # debug
-        sres = {} # set details
-        gres = {} # get details
-        ires = {} # inf details
-
-        if( esv == EchonetLite.GET or
-           esv == EchonetLite.INF_REQ or
-           esv == EchonetLite.INFC ):
-            i = 0
-            for _ in range(0,opc):
-                epc = details[i]
-                pdc = details[i+1]
-                gres[epc] = PDCEDT(details[i+1:i+pdc+2])
-                i += pdc+2
-        elif( esv == EchonetLite.SETI or
-           esv == EchonetLite.SETC or
-           esv == EchonetLite.SETC ):
-            i = 0
-            for _ in range(0,opc):
-                epc = details[i]
-                pdc = details[i+1]
-                sres[epc] = PDCEDT(details[i+1:i+pdc+2])
-                i += pdc+2
-        elif( esv == EchonetLite.SETGET ): # OPC計算おかしい
-            i = 0
-            for _ in range(0,opc):
-                epc = details[i]
-                pdc = details[i+1]
-                sres[epc] = PDCEDT(details[i+1:i+pdc+2])
-                i += pdc+2
-            for _ in range(0,opc):
-                epc = details[i]
-                pdc = details[i+1]
-                gres[epc] = PDCEDT(details[i+1:i+pdc+2])
-                i += pdc+2
-        elif(  esv == EchonetLite.SETGET_RES or
-                esv == EchonetLite.SETGET_SNA):
-            i = 0
-            for _ in range(0,opc):
-                epc = details[i]
-                pdc = details[i+1]
-                ires[epc] = PDCEDT(details[i+1:i+pdc+2])
-                i += pdc+2
-            for _ in range(0,opc):
-                epc = details[i]
-                pdc = details[i+1]
-                ires[epc] = PDCEDT(details[i+1:i+pdc+2])
-                i += pdc+2
-        else: # *_SNA, *_RES, INF,
-            i = 0
-            for _ in range(0,opc):
-                epc = details[i]
-                pdc = details[i+1]
-                ires[epc] = PDCEDT(details[i+1:i+pdc+2])
-                i += pdc+2
-        print("# EchonetLite.parseDetails() end.") if self.debug else '' # debug
-        return {'SET': sres, 'GET':gres, 'INF':ires}
+        @param details (bytes | memoryview | list[int])  受信フレーム、またはEPC以下
+        @param offset (int) detailsの中でEPCが始まる位置、デフォルト0
+        @return dict {'SET':dict[int,PDCEDT], 'GET':dict[int,PDCEDT], 'INF':dict[int,PDCEDT]}、壊れていればNone
+        """
+        if type(details) is list:
+            details = bytes(details)
+        props = self.scanDetails(esv, opc, details, offset)
+        if props == None:
+            return None
+        return ELFrame('', details, 0, 0, 0, esv, opc, props).details
+
 
 
 
@@ -839,129 +1276,88 @@ class EchonetLite():
         @brief EPC 0x9d, 0x9e, 0x9fのプロパティマップに関してedt部分を解釈
         @param pdcedt PDCEDT
         @return List[int]
+        @note bitsetで扱いたい場合や、まとめて解釈する場合はELPropertyMapを使う
         """
-        print("# EchonetLite.parsePropertyMap()") if self.debug else '' # debug
-        #pdcedt.println()
-        edt = pdcedt.edt
-        profNum = edt[0]
-        profs = []
+        return ELPropertyMap.decodeList(pdcedt.edtBytes)
 
-        if profNum < 16:
-            # format 1ならそのままの形式、ただし 個数+epc Listは pdcedt[1] に相当する
-            profs = edt[1:]
-        else:
-            # format 2
-            for bit in range(0, 8):
-                for i in range(1, 17):
-                    # print('bit', bit, 'i', i, 'edt', edt[i])
-                    exist = ((edt[i] >> bit) & 0x01) == 1
-                    if exist:
-                        # 上位 (bit + 7) << 4
-                        # 下位 i-1
-                        epc = ((bit + 8) << 4) + (i - 1)
-                        profs.append( epc )
-        print("# EchonetLite.parsePropertyMap() end.") if self.debug else '' # debug
-        return profs
-
-
-    def hasEOJs(self, eoj:list[int]) -> bool:
+
+
+    def hasEOJs(self, eoj:int|list[int]) -> bool:
         """!
         @brief 指定のEOJがあるかチェック
-        @param eoj List[int]
+        @param eoj int|List[int]
         @return bool
         @note インスタンス0は一つでもあればTrue
         """
-        print("# EchonetLite.hasEOJs()") if self.debug else '' # debug
-        if (eoj == [0x0e,0xf0,0x00] or
-            eoj == [0x0e,0xf0,0x01] or
-            eoj == [0x0e,0xf0,0x02]):
+        if type(eoj) is not int:
+            eoj = toInt(eoj)
+        if 0x0ef000 <= eoj <= 0x0ef002:
             return True
+        if eoj & 0xff == 0:
+            return (eoj >> 8) in self.classIndex
+        return eoj in self.objects
+
+    def resolveEOJ(self, eoj:int) -> tuple[int, ...]:
+        """!
+        @brief 宛先EOJを保持しているオブジェクトのEOJに展開する
+        @param eoj int 24bit
+        @return tuple[int, ...]  インスタンス0なら同じクラスのすべて、なければ空
+        """
+        if eoj & 0xff == 0:
+            return self.classIndex.get(eoj >> 8, ())
+        if eoj in self.objects:
+            return (eoj,)
+        return ()
+
+    def buildRegistry(self):
+        """!
+        @brief devicesからEOJをキーにした表とクラスの索引を作り直す
+        @note devicesを直接書き換えた場合は呼ぶこと
+        """
+        self.objects = {int(k, 16): obj for k, obj in self.devices.items()}
+        index:dict[int, list[int]] = {}
+        for eoj in sorted(self.objects):
+            index.setdefault(eoj >> 8, []).append(eoj)
+        self.classIndex = {c: tuple(v) for c, v in index.items()}
+        with self.encoderLock: # 差し替えられたオブジェクトの返答を返さない
+            self.getCache.clear()
 
-        for v in self.eojs:
-            # print(eoj, "=?=", v)
-            if eoj[2] == 0:
-                if v[0:2] == eoj[0:2]:
-                    # print("True")
-                    return True
-            else:
-                if v == eoj:
-                    # print("True")
-                    return True
-        return False
 
-    def checkInfAndSend(self, obj:list[int]|str, epc:int):
+    def checkInfAndSend(self, obj:list[int]|str|int, epc:int):
         """!
         @brief INFプロパティならマルチキャストで送信
-        @param obj List[int]|str
+        @param obj List[int]|str|int
         @param epc int
         """
-        print("# EchonetLite.checkInfAndSend()") if self.debug else '' # debug
-        if type(obj) == list:
-            obj = self.getHexString(obj)
+        obj = toInt(obj)
+        dev = self.objects[obj]
+        if dev.hasInfProperty(epc):
+            self.sendMultiOPC1(obj,EchonetLite.EOJ_Controller,EchonetLite.INF,epc,dev[epc])
 
-        if self.devices[obj].hasInfProperty(epc):
-            self.sendMultiOPC1(obj,EchonetLite.EOJ_Controller,EchonetLite.INF,epc,self.devices[obj][epc])
 
 
-    def verifyPacket(self, data:list) -> bool:
+    def verifyPacket(self, data) -> bool:
         """!
         @brief 受信パケットの正常性チェック
-        @param data (list)
+        @param data (bytes | memoryview | list[int])
         @return bool
+        @note returner()は同じ検証を解析と一緒に行うので、これを呼ばない
         """
-        print("# EchonetLite.verifyPacket()") if self.debug else '' # debug
-        packetSize = len(data)
-        #  パケットサイズが最小サイズを満たさないならDrop
-        if packetSize < EchonetLite.MINIMUM_FRAME:
-            # print("# verifyPacket() droped reason = packetSize:", packetSize) if self.debug else '' # debug
-            return False
-
-        # EHDがおかしいならDrop
-        if data[EchonetLite.EHD1:EchonetLite.TID] != [0x10, 0x81]:
-            # print("# verifyPacket() droped reason = EHD:", data[EchonetLite.EHD1:EchonetLite.TID]) if self.debug else '' # debug
+        if type(data) is list:
+            data = bytes(data)
+        #  パケットサイズが最小サイズを満たさない、EHDがおかしいならDrop
+        head = decodeHeader(data)
+        if head == None:
             return False
+        _, _, deoj, esv, opc = head
 
         # EOJ もってなければDrop
-        deoj = data[EchonetLite.DEOJ:EchonetLite.ESV]
         if self.hasEOJs(deoj) == False:
-            # print("# verifyPacket() droped reason = DEOJ:", data[EchonetLite.DEOJ:EchonetLite.ESV]) if self.debug else '' # debug
             return False
 
-        esv = data[EchonetLite.ESV]
-        opc = data[EchonetLite.OPC]
-        o = 0 # now opc
-        i = EchonetLite.PDC # data へのindex 、PDC から開始
-
-        if (esv == EchonetLite.SETI_SNA or
-            esv == EchonetLite.SETC_SNA or
-            esv == EchonetLite.GET_SNA or
-            esv == EchonetLite.INF_SNA or
-            esv == EchonetLite.SETI or
-            esv == EchonetLite.SETC or
-            esv == EchonetLite.GET or
-            esv == EchonetLite.INF_REQ or
-            esv == EchonetLite.SET_RES or
-            esv == EchonetLite.GET_RES or
-            esv == EchonetLite.INF or
-            esv == EchonetLite.INFC or
-            esv ==  EchonetLite.INFC_RES ):
-            # ここから慎重にメモリアクセス
-            # OPC
-            while o < opc:
-                if i > packetSize: # サイズ超えた
-                    print("# verifyPacket() droped reason = OPC:", opc) if self.debug else '' # debug
-                    return False # 異常パケット
-                i += 2 + data[i] # 2 byte 固定(EPC,PDC) + edtでindex更新
-                o += 1
-        elif ( esv == EchonetLite.SETGET or
-            esv == EchonetLite.SETGET_SNA or
-            esv == EchonetLite.SETGET_RES ):
-            print("# verifyPacket() SETGET noticed") if self.debug else '' # debug
-            return True
-        else:
-            print("# verifyPacket() droped reason = unknown:", data) if self.debug else '' # debug
-            return False
-        return True
+        # 知らないESV、EPC部分が壊れているならDrop
+        return self.scanDetails(esv, opc, data, EchonetLite.EPC) != None
+
 
     def println(self):
         """!
@@ -980,15 +1376,25 @@ class EchonetLite():
         @brief 内部のTIDを1進める
         @note getTidString() の前に利用することを想定
         """
-        print("# EchonetLite.tidAutoIncrement()") if self.debug else '' # debug
-        if self.tid[0] == 0xff and self.tid[1] == 0xff:
-            self.tid[0] = 0
-            self.tid[1] = 0
-        elif self.tid[1] == 0xff:
-            self.tid[0] += 1
-            self.tid[1] = 0
-        else:
-            self.tid[1] += 1
+        with self.tidLock:
+            if self.tid[0] == 0xff and self.tid[1] == 0xff:
+                self.tid[0] = 0
+                self.tid[1] = 0
+            elif self.tid[1] == 0xff:
+                self.tid[0] += 1
+                self.tid[1] = 0
+            else:
+                self.tid[1] += 1
+
+    def nextTid(self) -> int:
+        """!
+        @brief 内部のTIDを取り出して1進める。複数スレッドから呼んでも同じTIDは返さない
+        @return int 16bit
+        """
+        with self.tidLock:
+            tid = (self.tid[0] << 8) | self.tid[1]
+            self.tidAutoIncrement()
+            return tid
 
     def getTidString(self) -> str:
         """!
@@ -1004,7 +1410,6 @@ class EchonetLite():
         @param value (int | list[int])
         @return str
         """
-        print("# EchonetLite.getHexString()") if self.debug else '' # debug
         if type(value) == list:
             hexArr = [format(i,'02x') for i in value]
             return "".join(hexArr).lower()
@@ -1017,7 +1422,6 @@ class EchonetLite():
         @param value (list[list[int]])
         @return list[int]
         """
-        print("# EchonetLite.getInstanceList()") if self.debug else '' # debug
         num = len(value)
         flat:list[int] = sum(value, [])  # flatten
         flat.insert(0, num)
@@ -1029,7 +1433,6 @@ class EchonetLite():
         @param value (list[list[int]])
         @return list[int]
         """
-        print("# EchonetLite.getClassList()") if self.debug else '' # debug
         classList = [obj[0:2] for obj in value]
         uClassList:list[list[int]] = []
         # classListにあり、uClassListにないものを探してリストアップする
@@ -1063,6 +1466,30 @@ class EchonetLite():
         else:
             return [0,0,0,0,0,0]
 
+## ESVごとの記述子、import時に一度だけ作る
+# ESV: (解析レイアウト, 返答する関数名, 返答する関数に渡すdetailsのキー)
+# 解析レイアウトはEPCの格納先(0=SET, 1=GET, 2=INF)の並びで、2つならOPCSet, OPCGetの2部構成として検証、解析する
+# キーがNoneならdetails全体を渡す
+EchonetLite.ESV_TABLE = {
+    EchonetLite.SETI:       ((0,), 'replySetDetail', 'SET'),
+    EchonetLite.SETC:       ((0,), 'replySetDetail', 'SET'),
+    EchonetLite.GET:        ((1,), 'replyGetDetail', 'GET'),
+    EchonetLite.INF_REQ:    ((1,), 'replyInfreqDetail', 'GET'),
+    EchonetLite.SETGET:     ((0, 1), 'replySetgetDetail', None),
+    EchonetLite.INFC:       ((1,), 'replyInfcDetail', 'GET'),
+    EchonetLite.SETI_SNA:   ((2,), None, None),
+    EchonetLite.SETC_SNA:   ((2,), None, None),
+    EchonetLite.GET_SNA:    ((2,), None, None),
+    EchonetLite.INF_SNA:    ((2,), None, None),
+    EchonetLite.SET_RES:    ((2,), None, None),
+    EchonetLite.GET_RES:    ((2,), None, None),
+    EchonetLite.INF:        ((2,), None, None),
+    EchonetLite.INFC_RES:   ((2,), None, None),
+    EchonetLite.SETGET_RES: ((2, 2), None, None),
+    EchonetLite.SETGET_SNA: ((2, 2), None, None),
+}
+
+
 if __name__ == '__main__':
     print("===== echonet_lite.py unit test")
     el = EchonetLite( [EchonetLite.EOJ_Controller] )
@@ -1076,9 +1503,8 @@ if __name__ == '__main__':
     #print(el.getHexString([1,2,3,4]))
     print("- replyGetDetail_sub()")
     print( el.replyGetDetail_sub( EchonetLite.EOJ_Controller, 0x84) )
-    t = PDCEDT()
-    t.setEDT([0x02, 0x81, 0x82])
+    t = PDCEDT.fromEDT([0x02, 0x81, 0x82])
     print( el.parsePropertyMap(t) )
-    t.setEDT([0x10, 0x01, 0x01, 0x01, 0x01, 0x01, 0x01, 0x01, 0x01, 0x01, 0x01, 0x01, 0x01, 0x01, 0x01, 0x01, 0x01])
+    t = PDCEDT.fromEDT([0x10, 0x01, 0x01, 0x01, 0x01, 0x01, 0x01, 0x01, 0x01, 0x01, 0x01, 0x01, 0x01, 0x01, 0x01, 0x01, 0x01])
     print( el.parsePropertyMap(t) )
     el.sendOPC1( '192.168.86.158', '05ff01', '0ef001', '62', '80', '00')
@@ -6,46 +6,63 @@
 @date 2023年度
 @details EDTをPDCと結びつけて管理することを主とする
 """
-from copy import deepcopy
-
 class PDCEDT():
     """!
     @brief PDCEDTクラス
-    @details EDTをPDCと結びつけて管理することを主とする
+    @details EDTをPDCと結びつけて管理することを主とする。
+    中身はPDC+EDTのbytesで持ち、コピーはbytesを共有する
+    @note 作った後は変えない。値を変える時は新しいPDCEDTを作り、ELOBJのSetEDTかSetPDCEDTで入れ替える
     """
+    __slots__ = ('raw',)
+
     def __init__(self, obj = None):
         """!
         @brief コンストラクタ
-        @param obj (PDCEDT | list[int]) = None
+        @param obj (PDCEDT | list[int] | bytes | memoryview) = None  list[int]などはPDCを含む
         """
-        self.pdc:int = 0 # @var pdc
-        self.edt:list[int] = []
-        self.length:int = 1
+        self.raw:bytes = b'\x00' # @var raw PDC+EDT
         if obj == None:
-            self.pdc = 0
-            self.edt = []
-            self.length = 1
+            pass
         elif type(obj) is PDCEDT:
-            self.pdc = obj.pdc
-            self.edt = deepcopy(obj.edt)
-            self.length = obj.length
-        elif type(obj) is list and len(obj) != 0:
-            self.pdc = obj[0]
-            if self.pdc == 0:
-                self.edt = []
-            else:
-                self.edt = obj[1:]
-            self.length = len(obj)
-        else:
-            self.pdc = 0
-            self.edt = []
-            self.length = 1
+            self.raw = obj.raw # 不変なので共有する
+        elif isinstance(obj, (list, bytes, bytearray, memoryview)) and len(obj) != 0:
+            # 受信バッファのPDC+EDT部分など
+            raw = bytes(obj)
+            if len(raw) > raw[0] + 1: # PDCより長い部分は捨てる
+                raw = raw[:raw[0] + 1]
+            self.raw = raw
+
+    @property
+    def pdc(self) -> int:
+        """!
+        @brief PDC
+        @return int
+        """
+        return self.raw[0]
+
+    @property
+    def edt(self) -> list[int]:
+        """!
+        @brief EDT、互換のためlist[int]で返す
+        @return list[int]
+        """
+        return list(self.raw[1:])
 
-    def __del__(self):
+    @property
+    def edtBytes(self) -> bytes:
         """!
-        @brief デストラクタ
+        @brief EDTをbytesで返す
+        @return bytes
         """
-        #print("__del__")
+        return self.raw[1:]
+
+    @property
+    def length(self) -> int:
+        """!
+        @brief PDC+EDTのbyte数
+        @return int
+        """
+        return len(self.raw)
 
     def __eq__(self, other) -> bool:
         """!
@@ -57,53 +74,43 @@ class PDCEDT():
         # print("__eq__")
         if not isinstance(other, PDCEDT):
             return NotImplemented
-        return (self.pdc == other.pdc) and (self.edt == other.edt) and (self.length == other.length)
+        return self.raw == other.raw
 
-    def setEDT(self, edt:list[int]):
+    @staticmethod
+    def fromEDT(edt:list[int]|bytes) -> 'PDCEDT':
         """!
-        @brief EDTを指定して格納、PDCは自動計算
-        @param edt (list[int])
+        @brief EDTを指定して作る、PDCは自動計算
+        @param edt (list[int] | bytes)
+        @return PDCEDT
         """
-        self.pdc = len(edt)
-        if self.pdc == 0:
-            self.edt = []
-        else:
-            self.edt = edt
-        self.length = len(edt)+1
+        pdcedt = PDCEDT()
+        pdcedt.raw = bytes([len(edt)]) + bytes(edt)
+        return pdcedt
 
     def getString(self) -> str:
         """!
         @brief PDCEDTの文字列を返す
         @return str
         """
-        if self.edt==None:
-            return '00'
-        else:
-            hexArr = [format(i,'02x') for i in self.edt]
-            return format(self.pdc,'02x') + "".join(hexArr).lower()
+        return self.raw.hex()
 
     def println(self):
         """!
         @brief 現在の格納データを標準出力する
         """
-        if len(self.edt) == 0:
+        if len(self.raw) == 1:
             print("PDC:", format(self.pdc,'02x'), ", EDT: []" )
         else:
-            h = [format(i,'02x') for i in self.edt]
-            print("PDC:", format(self.pdc,'02x'), ", EDT:", ",".join(h) )
+            print("PDC:", format(self.pdc,'02x'), ", EDT:", self.raw[1:].hex(',') )
 
     def printString(self) -> str:
         """!
         @brief 現在の格納データを文字列出力する
         @return str
         """
-        s = ""
-        if len(self.edt) == 0:
-            s = "PDC:" + format(self.pdc,'02x') +", EDT: []"
-        else:
-            h = [format(i,'02x') for i in self.edt]
-            s = "PDC:" + format(self.pdc,'02x') + ", EDT:" + (",".join(h))
-        return s
+        if len(self.raw) == 1:
+            return "PDC:" + format(self.pdc,'02x') +", EDT: []"
+        return "PDC:" + format(self.pdc,'02x') + ", EDT:" + self.raw[1:].hex(',')
 
 
 if __name__ == '__main__':
@@ -118,10 +125,9 @@ if __name__ == '__main__':
     print(test2==test1)
     print(test2==test22)
     print("-- t3")
-    test3 = test22
-    test3.println()
-    test3.setEDT([0x80,0x81])
+    test3 = PDCEDT.fromEDT([0x80,0x81])
     test3.println()
+    test22.println()
     print("test3.pdc:", test3.pdc)
     print("test3.edt:", test3.edt)
     print(test3.getString())
@@ -129,5 +135,11 @@ if __name__ == '__main__':
     print("-- t4")
     test4 = PDCEDT([0, 0x00])
     test4.println()
-    test4.setEDT([0x30])
+    test4 = PDCEDT.fromEDT([0x30])
+    test4.println()
+    print("-- t5")
+    test5 = PDCEDT(test4)
+    print(test5.raw is test4.raw, test5 == test4)
+    test5 = PDCEDT.fromEDT(b'\x31\x32')
     test4.println()
+    test5.println()
@@ -5,7 +5,8 @@
 @author SUGIMURA Hiroshi, Kanagawa Institute of Technology
 @date 2023年度
 """
-from .EchonetLite import EchonetLite, ELOBJ, PDCEDT
+from .EchonetLite import EchonetLite, ELOBJ, PDCEDT, ELFrame
+from .AsyncEchonetLite import AsyncEchonetLite
 #from EchonetLite.EchonetLite import *
 #from EchonetLite.ELOBJ import *
 #from EchonetLite.PDCEDT import *
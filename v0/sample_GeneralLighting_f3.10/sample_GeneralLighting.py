@@ -110,4 +110,6 @@ try:
     loop()
 except:
     print("except -> exit")
-    os._exit(0) # sys.exitではwindowsの受信ソケットが解放されないので仕方なく
+    el.stop() # 受信スレッドはすぐに終わる
+    el.join()
+    sys.exit(0)